@@ -2,9 +2,17 @@
 
 import json
 import os
+from bisect import bisect_left
+
+from book_source import load_book
+from boundary_index import BoundaryIndex
+from correction_journal import hash_file
+from metrics import metrics, profile_stage
+from pipeline_state import STAGE_APPLIED, PipelineState, correction_key, open_pipeline_state
+
 def correct_text(original_text : str,correction : dict) :
 
-    
+
     original_text_part = original_text[correction["position_start"]:correction["position_end"]]
 
     if correction["is_corrected"]:
@@ -23,6 +31,187 @@ def correct_text(original_text : str,correction : dict) :
 
     return original_text
 
+
+def is_overlapping(range_a : tuple, range_b : tuple):
+    """
+    判断两个 [start, end) 范围是否重叠，起点相同的范围也视为冲突。
+    """
+    return (range_a[0] < range_b[1] and range_b[0] < range_a[1]) or range_a[0] == range_b[0]
+
+
+def select_corrections(original_text, correction_list : list):
+    """
+    校验所有校正，并处理范围重叠的校正。
+
+    范围重叠时（例如第二轮得到的整句校正包含了第一轮的片段校正），保留范围更大的一条，
+    范围相同时保留id更小的一条，其余记为冲突。结果与输入顺序无关。
+
+    :return: (accepted, skipped, conflicts)
+             accepted 为按 position_start 升序排列的待应用校正；
+             skipped 为未修改或原文不匹配的校正；
+             conflicts 为因范围重叠而被放弃的校正，附带与之冲突的校正id。
+    """
+    skipped = []
+    candidates = []
+
+    for correction in correction_list:
+        if not correction["is_corrected"]:
+            skipped.append({"id": correction["id"], "reason": "not_corrected"})
+            continue
+
+        start, end = correction["position_start"], correction["position_end"]
+        if not (0 <= start <= end <= len(original_text)):
+            skipped.append({"id": correction["id"], "reason": "invalid_range"})
+            print(f"校正范围无效，跳过校正。校正id: {correction['id']}")
+            continue
+
+        original_text_part = original_text[start:end]
+        if original_text_part != correction["original_text"]:
+            skipped.append({"id": correction["id"], "reason": "mismatch"})
+            print("原文与校正内容不匹配！，跳过校正。")
+            print(f"校正id: {correction['id']}")
+            print(f"原文片段: {original_text_part}")
+            print(f"预期片段: {correction['original_text']}")
+            continue
+
+        candidates.append(correction)
+
+    # 范围大的优先，其次按起点、id排序，保证结果确定
+    candidates.sort(key=lambda x: (-(x["position_end"] - x["position_start"]), x["position_start"], int(x["id"])))
+
+    accepted_starts = []
+    accepted = []
+    conflicts = []
+
+    for correction in candidates:
+        current_range = (correction["position_start"], correction["position_end"])
+        index = bisect_left(accepted_starts, current_range[0])
+
+        # 已接受的校正互不重叠，只需检查左右相邻的两条
+        neighbours = accepted[max(0, index - 1):index + 1]
+        conflict_with = [x["id"] for x in neighbours if is_overlapping(current_range, (x["position_start"], x["position_end"]))]
+
+        if conflict_with:
+            conflicts.append({"id": correction["id"], "conflict_with": conflict_with})
+            print(f"校正范围与其他校正重叠，跳过校正。校正id: {correction['id']}，冲突的校正id: {conflict_with}")
+            continue
+
+        accepted_starts.insert(index, current_range[0])
+        accepted.insert(index, correction)
+
+    return accepted, skipped, conflicts
+
+
+def apply_corrections(original_text : str, correction_list : list):
+    """
+    一次性应用所有校正，只遍历一遍原文。
+
+    :param original_text: 原文。
+    :param correction_list: correction.json 中的校正列表。
+    :return: (校正后的文本, 报告)，报告中包含 applied, skipped, conflicts 三个列表。
+    """
+    accepted, skipped, conflicts = select_corrections(original_text, correction_list)
+
+    parts = []
+    cursor = 0
+    for correction in accepted:
+        print(f"正在校正：{correction['original_text']} -> {correction['corrected_text']}")
+        parts.append(original_text[cursor:correction["position_start"]])
+        parts.append(correction["corrected_text"])
+        cursor = correction["position_end"]
+    parts.append(original_text[cursor:])
+
+    report = {
+        "applied": [correction["id"] for correction in accepted],
+        "skipped": skipped,
+        "conflicts": conflicts
+    }
+
+    return "".join(parts), report
+
+
+def write_corrections(original_text, correction_list : list, output_path : str, chunk_size : int = 1 << 20):
+    """
+    与 apply_corrections 相同，但直接把结果分块写入文件，不在内存中拼出整本书。
+
+    :param original_text: 原文，str 或 book_source.MappedBook。
+    :param correction_list: correction.json 中的校正列表。
+    :param output_path: 输出文件路径。
+    :param chunk_size: 每次复制的最大字符数。
+    :return: 报告，格式与 apply_corrections 相同。
+    """
+    accepted, skipped, conflicts = select_corrections(original_text, correction_list)
+
+    def copy_range(f, start, end):
+        for chunk_start in range(start, end, chunk_size):
+            f.write(original_text[chunk_start:min(end, chunk_start + chunk_size)])
+
+    # 保留原文中的换行符，不做转换
+    with open(output_path, 'w', encoding='utf-8', newline='') as f:
+        cursor = 0
+        for correction in accepted:
+            print(f"正在校正：{correction['original_text']} -> {correction['corrected_text']}")
+            copy_range(f, cursor, correction["position_start"])
+            f.write(correction["corrected_text"])
+            cursor = correction["position_end"]
+        copy_range(f, cursor, len(original_text))
+
+    return {
+        "applied": [correction["id"] for correction in accepted],
+        "skipped": skipped,
+        "conflicts": conflicts
+    }
+
+def add_sentence_context(original_text, correction_list : list, report : dict, boundary_index : BoundaryIndex):
+    """
+    给报告中原文不匹配和范围冲突的校正附上它们在原文中所在的句子，便于人工核对。
+    冲突的校正覆盖的范围可能跨过多个句子，此时附上的是包含整个范围的句子。
+
+    :param boundary_index: 原文的边界索引。
+    """
+    corrections_by_id = {correction["id"]: correction for correction in correction_list}
+    entries = [entry for entry in report["skipped"] if entry["reason"] == "mismatch"] + report["conflicts"]
+    for entry in entries:
+        correction = corrections_by_id[entry["id"]]
+        sentence_start, sentence_end = boundary_index.sentence_range(correction["position_start"], correction["position_end"])
+        entry["sentence"] = {"start": sentence_start, "end": sentence_end, "text": original_text[sentence_start:sentence_end]}
+
+
+def apply_to_book(original_text, correction_list : list, output_path : str, pipeline_state : PipelineState = None, book_hash : str = None,
+                  boundary_index : BoundaryIndex = None):
+    """
+    完整的应用步骤：把校正写入输出文件，并输出统计。
+
+    校正的位置都是相对于原文的，因此每次都从原文一次性应用全部校正；
+    传入 pipeline_state 时只用来记录应用过的校正，报告中的 new_applied 为本次新增的校正。
+    报告中原文不匹配和范围冲突的校正会附上所在的句子，见 add_sentence_context。
+
+    :param boundary_index: 可选，定位步骤已经为这本书建好的边界索引。不传时只在有需要附上句子的校正时才构建。
+    :return: 报告，格式见 write_corrections。
+    """
+    report = write_corrections(original_text, correction_list, output_path)
+
+    if report["conflicts"] or any(entry["reason"] == "mismatch" for entry in report["skipped"]):
+        if boundary_index is None:
+            boundary_index = BoundaryIndex(original_text)
+        add_sentence_context(original_text, correction_list, report, boundary_index)
+
+    metrics.inc("apply_corrections_total", len(report["applied"]), status="applied")
+    metrics.inc("apply_corrections_total", len(report["skipped"]), status="skipped")
+    metrics.inc("apply_corrections_total", len(report["conflicts"]), status="conflict")
+
+    print(f"已应用 {len(report['applied'])} 条校正，跳过 {len(report['skipped'])} 条，冲突 {len(report['conflicts'])} 条。")
+
+    if pipeline_state is not None:
+        applied = pipeline_state.get_stage(book_hash, STAGE_APPLIED)
+        corrections_by_id = {correction["id"]: correction for correction in correction_list}
+        new_applied = {correction_key(corrections_by_id[correction_id]): correction_id for correction_id in report["applied"]}
+        report["new_applied"] = [correction_id for key, correction_id in new_applied.items() if key not in applied]
+        pipeline_state.put_stage(book_hash, STAGE_APPLIED, new_applied)
+        print(f"其中 {len(report['new_applied'])} 条是上次运行之后新增的校正。")
+
+    return report
+
 if __name__ == "__main__":
 
     if not os.path.exists('config.json'):
@@ -34,6 +223,7 @@ if __name__ == "__main__":
     book_path = config["correction_apply"]["book_path"]
     correction_json_path = config["correction_apply"]["correction_json_path"]
     output_path = config["correction_apply"]["output_path"]
+    report_path = config["correction_apply"].get("report_path")
 
     with open(correction_json_path, 'r', encoding='utf-8') as f:
         correction_list = json.load(f)
@@ -42,14 +232,21 @@ if __name__ == "__main__":
         print("错误: 预校对列表为空，请检查输入文件。")
         exit(1)
 
-    # 针对correction_list 按照 position_end 倒序排序
-    correction_list.sort(key=lambda x: x["position_end"], reverse=True) 
+    original_text = load_book(book_path, config["correction_apply"].get("book_encoding"))
 
-    with open(book_path, 'r', encoding='utf-8') as f:
-        original_text = f.read()
+    pipeline_state = open_pipeline_state(config.get("pipeline_state"))
+    book_hash = hash_file(book_path) if pipeline_state is not None else None
 
-    for correction in correction_list:
-        original_text = correct_text(original_text, correction)
+    metrics_settings = config.get("metrics") or {}
+
+    with metrics.stage("apply"), profile_stage("apply", metrics_settings.get("profile")):
+        report = apply_to_book(original_text, correction_list, output_path, pipeline_state, book_hash)
+
+    if pipeline_state is not None:
+        pipeline_state.close()
+
+    if report_path:
+        with open(report_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=4)
 
-    with open(output_path, 'w', encoding='utf-8') as f:
-        f.write(original_text)   
\ No newline at end of file
+    metrics.export(metrics_settings)
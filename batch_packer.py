@@ -0,0 +1,140 @@
+import json
+from typing import Callable
+
+from llm_router import total_concurrency
+from prompt_encoding import compare_encodings
+from rate_limiter import estimate_tokens
+
+# 每条结果中除原文和修正文本之外的固定开销（字段名、布尔值、JSON符号等）
+RESULT_OVERHEAD_TOKENS = 40
+
+# 预计 explanation 字段的长度
+EXPLANATION_TOKENS = 60
+
+# 二分查找均衡批次时的迭代次数
+BALANCE_ITERATIONS = 20
+
+
+def estimate_task_tokens(task : dict, select_function : Callable, compact : bool = False):
+    """
+    估算单个任务的输入token数与预计的输出token数。
+
+    输入按 prompt_encoding.build_messages 中的格式计算，compact 为 True 时按不缩进的紧凑格式计算
+    （不考虑同一批中共用的上下文，因此偏保守）；输出包含原文、修正文本、说明和固定开销，
+    修正文本的长度按与原文相同估算。
+    """
+    selected = select_function([task])[0]
+    if compact:
+        input_tokens = estimate_tokens(json.dumps(selected, ensure_ascii=False, separators=(',', ':')))
+    else:
+        input_tokens = estimate_tokens(json.dumps(selected, indent=2, ensure_ascii=False))
+    text_tokens = estimate_tokens(task["text"])
+    output_tokens = RESULT_OVERHEAD_TOKENS + 2 * text_tokens + EXPLANATION_TOKENS
+    return input_tokens, output_tokens
+
+
+def _greedy_pack(costs : list, max_input : float, max_output : float, max_tasks : int):
+    """
+    按顺序装箱：当前批次再加入一个任务就会超出任一限制时，开始新的批次。
+    单个任务本身超出限制时，单独成为一批。
+
+    :return: 每个批次的 (起点, 终点) 列表。
+    """
+    ranges = []
+    start = 0
+    batch_input = batch_output = 0
+    for i, (input_tokens, output_tokens) in enumerate(costs):
+        if i > start and (batch_input + input_tokens > max_input
+                          or batch_output + output_tokens > max_output
+                          or i - start >= max_tasks):
+            ranges.append((start, i))
+            start = i
+            batch_input = batch_output = 0
+        batch_input += input_tokens
+        batch_output += output_tokens
+    if start < len(costs):
+        ranges.append((start, len(costs)))
+    return ranges
+
+
+def pack_batches(tasks : list, llm_settings : dict, task_per_request : int, select_function : Callable):
+    """
+    按token预算把任务分成若干批，保持任务的原有顺序。
+
+    llm_settings 中可以设置 max_input_tokens_per_request（不含提示词本身）与
+    max_output_tokens_per_request，task_per_request 作为每批任务数的上限。
+    都未设置token预算时，与原来一样按 task_per_request 固定分批。
+
+    先贪心装箱得到最少的批次数，再二分查找一个更小的预算，
+    在批次数不增加的前提下让各批的大小尽量均衡。
+
+    :return: 批次列表，每个批次是任务列表。
+    """
+    max_input = llm_settings.get("max_input_tokens_per_request")
+    max_output = llm_settings.get("max_output_tokens_per_request")
+
+    if not max_input and not max_output:
+        return [tasks[i:i + task_per_request] for i in range(0, len(tasks), task_per_request)]
+
+    max_input = max_input or float('inf')
+    max_output = max_output or float('inf')
+
+    costs = [estimate_task_tokens(task, select_function, llm_settings.get("compact_prompt", False)) for task in tasks]
+    ranges = _greedy_pack(costs, max_input, max_output, task_per_request)
+
+    # 在批次数不变的条件下，缩小预算使各批更均衡
+    low, high = 0.0, 1.0
+    for _ in range(BALANCE_ITERATIONS):
+        scale = (low + high) / 2
+        candidate = _greedy_pack(costs, max_input * scale, max_output * scale, task_per_request)
+        if len(candidate) <= len(ranges):
+            high = scale
+            ranges = candidate
+        else:
+            low = scale
+
+    return [tasks[start:end] for start, end in ranges]
+
+
+def plan_batches(batches : list, llm_settings : dict, select_function : Callable):
+    """
+    估算发送这些批次需要的请求数、token数和时间，不发送任何请求。
+
+    预计时间按每个请求的固定开销 estimated_request_overhead_seconds（默认2秒）
+    加上输出token数除以 estimated_output_tokens_per_second（默认50）计算，
+    再按 max_concurrent_requests（配置了 endpoints 时为各地址的名额之和）并发折算。
+    baseline_input_tokens 为原来的缩进格式下的输入token数，用于和 compact_prompt 比较。
+    """
+    overhead_seconds = llm_settings.get("estimated_request_overhead_seconds", 2)
+    output_speed = llm_settings.get("estimated_output_tokens_per_second", 50)
+    concurrency = total_concurrency(llm_settings)
+
+    compact = llm_settings.get("compact_prompt", False)
+
+    total_input = 0
+    baseline_input = 0
+    total_output = 0
+    total_seconds = 0.0
+    batch_sizes = []
+    for batch in batches:
+        costs = [estimate_task_tokens(task, select_function) for task in batch]
+        # 输入按实际发送的消息估算，同时记录原格式下的token数用于比较
+        baseline_tokens, compact_tokens, _ = compare_encodings(llm_settings["llm_prompt"], select_function(batch))
+        batch_input = compact_tokens if compact else baseline_tokens
+        batch_output = sum(cost[1] for cost in costs)
+        total_input += batch_input
+        baseline_input += baseline_tokens
+        total_output += batch_output
+        total_seconds += overhead_seconds + batch_output / output_speed
+        batch_sizes.append(len(batch))
+
+    return {
+        "requests": len(batches),
+        "tasks": sum(batch_sizes),
+        "min_tasks_per_request": min(batch_sizes) if batch_sizes else 0,
+        "max_tasks_per_request": max(batch_sizes) if batch_sizes else 0,
+        "input_tokens": total_input,
+        "baseline_input_tokens": baseline_input,
+        "output_tokens": total_output,
+        "estimated_seconds": round(total_seconds / concurrency, 1)
+    }
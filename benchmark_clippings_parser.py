@@ -0,0 +1,131 @@
+# 在合成的大型 'My Clippings.txt' 上评测标注解析的速度，并与原来只支持中文的正则表达式比较
+
+import os
+import re
+import time
+import random
+import argparse
+import tempfile
+
+from clippings_parser import CLIPPING_SEPARATOR, iter_clipping_entries, parse_clipping_entry, parse_and_group_clippings
+
+# 原来的正则表达式，只能识别中文 Kindle 的标注
+LEGACY_CLIPPING_PATTERN = re.compile(
+    r"^(?P<title>.+?)(?:\s*\(.+?\))?\n"
+    r"-\s*您在(?:第 (?P<page>\d+) 页（)?"
+    r"位置 #(?P<loc_start>\d+)(?:-(?P<loc_end>\d+))?.+?\n\n"
+    r"(?P<text>.+)",
+    re.MULTILINE
+)
+
+SAMPLE_CHARS = "的一是在不了有和人这中大为上个国我以要他时来用们生到作地于出就分对成会可主发年动同工也能下过子说产种面而方后多定行学法所民得经"
+
+# 各语言的元数据行模板：(语言, 类型, 模板)
+METADATA_TEMPLATES = [
+    ("zh", "highlight", "- 您在位置 #{start}-{end}的标注 | 添加于 2024年1月1日星期一 上午10:00:00"),
+    ("zh", "highlight", "- 您在第 {page} 页（位置 #{start}-{end}）的标注 | 添加于 2024年1月1日星期一 上午10:00:00"),
+    ("zh", "note", "- 您在位置 #{end}的笔记 | 添加于 2024年1月1日星期一 上午10:00:00"),
+    ("zh", "bookmark", "- 您在位置 #{start}的书签 | 添加于 2024年1月1日星期一 上午10:00:00"),
+    ("en", "highlight", "- Your Highlight on page {page} | Location {start}-{end} | Added on Monday, January 1, 2024 10:00:00 AM"),
+    ("en", "note", "- Your Note on Location {end} | Added on Monday, January 1, 2024 10:00:00 AM"),
+    ("en", "bookmark", "- Your Bookmark on Location {start} | Added on Monday, January 1, 2024 10:00:00 AM"),
+    ("ja", "highlight", "- {page}ページ|位置No. {start}-{end}のハイライト |作成日: 2024年1月1日月曜日 10:00:00"),
+    ("ja", "note", "- 位置No. {end}のメモ |作成日: 2024年1月1日月曜日 10:00:00"),
+    ("de", "highlight", "- Ihre Markierung bei Position {start}-{end} | Hinzugefügt am Montag, 1. Januar 2024 10:00:00"),
+    ("de", "bookmark", "- Ihr Lesezeichen bei Position {start} | Hinzugefügt am Montag, 1. Januar 2024 10:00:00"),
+]
+
+
+def make_clippings_file(path : str, size_mb : float, locales : list, seed : int = 0):
+    """
+    生成约 size_mb MB 的合成标注文件，按 locales 中的语言混合各种类型的条目。
+
+    :return: 写入的条目数。
+    """
+    rng = random.Random(seed)
+    templates = [template for template in METADATA_TEMPLATES if template[0] in locales]
+    target_size = int(size_mb * (1 << 20))
+    written = 0
+    count = 0
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        f.write('﻿')
+        while written < target_size:
+            _, clipping_type, template = rng.choice(templates)
+            start = rng.randint(1, 90000)
+            metadata = template.format(start=start, end=start + rng.randint(1, 30), page=rng.randint(1, 900))
+            text = "" if clipping_type == "bookmark" else "".join(rng.choice(SAMPLE_CHARS) for _ in range(rng.randint(10, 120)))
+            entry = f"书籍{rng.randint(1, 50)} (作者)\r\n{metadata}\r\n\r\n{text}\r\n{CLIPPING_SEPARATOR}\r\n"
+            f.write(entry)
+            written += len(entry.encode('utf-8'))
+            count += 1
+    return count
+
+
+def legacy_parse_entry(entry : str):
+    entry = entry.replace('﻿', '').strip()
+    if not entry:
+        return None
+    match = LEGACY_CLIPPING_PATTERN.search(entry)
+    if not match:
+        return None
+    data = match.groupdict()
+    return {
+        'title': data['title'].strip(),
+        'page': int(data['page']) if data.get('page') else None,
+        'location_start': int(data['loc_start']),
+        'text': data['text'].strip()
+    }
+
+
+def run_parser(path : str, parse_function):
+    """
+    用 parse_function 解析文件中的每个条目。
+
+    :return: (用时秒数, 识别的条目数, 无法识别的条目数)
+    """
+    parsed = 0
+    unparsed = 0
+    start = time.perf_counter()
+    for _, _, entry in iter_clipping_entries(path):
+        if parse_function(entry) is None:
+            unparsed += 1
+        else:
+            parsed += 1
+    return time.perf_counter() - start, parsed, unparsed
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="评测标注解析的速度（MB/s），并与原来的正则表达式比较。")
+    parser.add_argument("--size-mb", type=float, default=50, help="合成文件的大小（MB）。")
+    parser.add_argument("--locales", default="zh,en,ja,de", help="逗号分隔的语言列表：zh, en, ja, de。")
+    parser.add_argument("--repeat", type=int, default=3, help="每种解析方式重复的次数，取最快的一次。")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    temp_dir = tempfile.mkdtemp()
+    path = os.path.join(temp_dir, "My Clippings.txt")
+    count = make_clippings_file(path, args.size_mb, args.locales.split(","), args.seed)
+    size_mb = os.path.getsize(path) / (1 << 20)
+    print(f"合成文件 {size_mb:.1f} MB，共 {count} 个条目，语言: {args.locales}。\n")
+
+    print(f"{'解析方式':<16}{'MB/s':>10}{'识别':>10}{'未识别':>10}")
+    for name, parse_function in (("原来的正则表达式", legacy_parse_entry), ("状态机", parse_clipping_entry)):
+        best = None
+        for _ in range(args.repeat):
+            result = run_parser(path, parse_function)
+            if best is None or result[0] < best[0]:
+                best = result
+        seconds, parsed, unparsed = best
+        print(f"{name:<16}{size_mb / seconds:>10.1f}{parsed:>10}{unparsed:>10}")
+
+    # 完整的解析流程，包括分组和写出JSON
+    output_json = os.path.join(temp_dir, "grouped_clippings.json")
+    start = time.perf_counter()
+    parse_and_group_clippings(path, output_json, incremental=False)
+    seconds = time.perf_counter() - start
+    print(f"\nparse_and_group_clippings 完整解析: {size_mb / seconds:.1f} MB/s")
+
+    for name in os.listdir(temp_dir):
+        os.remove(os.path.join(temp_dir, name))
+    os.rmdir(temp_dir)
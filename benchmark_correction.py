@@ -0,0 +1,151 @@
+# 在本地模拟服务器上评测 get_correction 在不同并发与分批设置下的吞吐量
+
+import json
+import time
+import random
+import argparse
+
+import pre_correction_to_correction as correction
+from batch_packer import pack_batches
+from mock_llm_server import MockLLMSettings, start_mock_server
+
+BENCHMARK_PROMPT = "请校对以下任务，返回 JSON 数组。\n\nINPUT_TASKS_JSON_STRING\n"
+
+SAMPLE_CHARS = "的一是在不了有和人这中大为上个国我以要他时来用们生到作地于出就分对成会可主发年动同工也能下过子说产种面而方后多定行学法所民得经"
+
+
+def make_tasks(count : int, seed : int = 0):
+    """
+    生成与 pre_correction.json 格式相同的模拟任务。
+    """
+    rng = random.Random(seed)
+    tasks = []
+    position = 0
+    for i in range(count):
+        text = "".join(rng.choice(SAMPLE_CHARS) for _ in range(rng.randint(4, 40)))
+        sentence = "".join(rng.choice(SAMPLE_CHARS) for _ in range(rng.randint(0, 30))) + text + "。"
+        tasks.append({
+            "id": i,
+            "location_start": i * 10,
+            "position_start": position,
+            "position_end": position + len(text),
+            "text": text,
+            "sentence": {"text": sentence},
+            "paragraph": {"text": sentence}
+        })
+        position += len(sentence) + 1
+    return tasks
+
+
+def percentile(values : list, fraction : float):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def run_benchmark(url : str, server_settings : MockLLMSettings, tasks : list, concurrency : int, task_per_request : int, stream : bool = False):
+    """
+    用给定的并发数与每批任务数跑一遍 get_correction。
+
+    :return: 本次运行的统计：吞吐量、请求延迟的 p50/p99，以及重试带来的额外请求比例。
+    """
+    llm_settings = {
+        "llm_api_url": url,
+        "llm_model": "mock",
+        "llm_temperature": 0.1,
+        "llm_api_key": "mock",
+        "llm_prompt": BENCHMARK_PROMPT,
+        "task_per_request": task_per_request,
+        "max_concurrent_requests": concurrency,
+        "stream": stream,
+        "retry_backoff_seconds": 0.05,
+        "http_backoff_seconds": 0.05,
+        "http_max_backoff_seconds": 1
+    }
+
+    latencies = []
+    send_batch = correction.process_batch_with_custom_api
+
+    def timed_send(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return send_batch(*args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - start)
+
+    planned_requests = len(pack_batches(tasks, llm_settings, task_per_request, correction.select_clippings_sentence))
+    requests_before = server_settings.stats["requests"]
+
+    correction.process_batch_with_custom_api = timed_send
+    try:
+        start = time.perf_counter()
+        results, failed = correction.get_correction(llm_settings, tasks, task_per_request,
+                                                    correction.select_clippings_sentence, correction.select_output_snippet)
+        elapsed = time.perf_counter() - start
+    finally:
+        correction.process_batch_with_custom_api = send_batch
+
+    http_requests = server_settings.stats["requests"] - requests_before
+    return {
+        "concurrency": concurrency,
+        "task_per_request": task_per_request,
+        "stream": stream,
+        "tasks": len(tasks),
+        "succeeded": len(results),
+        "failed": len(failed),
+        "seconds": round(elapsed, 3),
+        "tasks_per_second": round(len(results) / elapsed, 2) if elapsed else 0.0,
+        "batch_latency_p50": round(percentile(latencies, 0.5), 3),
+        "batch_latency_p99": round(percentile(latencies, 0.99), 3),
+        "planned_requests": planned_requests,
+        "batch_calls": len(latencies),
+        "http_requests": http_requests,
+        "retry_overhead": round(http_requests / planned_requests - 1, 3) if planned_requests else 0.0
+    }
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="在本地模拟服务器上评测校对流程的吞吐量。")
+    parser.add_argument("--tasks", type=int, default=200, help="模拟任务的数量。")
+    parser.add_argument("--concurrency", default="1,4,8", help="逗号分隔的并发数列表。")
+    parser.add_argument("--task-per-request", default="10,20", help="逗号分隔的每批任务数列表。")
+    parser.add_argument("--stream", action="store_true", help="使用流式请求。")
+    parser.add_argument("--latency-median", type=float, default=0.2)
+    parser.add_argument("--latency-sigma", type=float, default=0.5)
+    parser.add_argument("--seconds-per-task", type=float, default=0.01)
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--rate-500", type=float, default=0.0)
+    parser.add_argument("--malformed-rate", type=float, default=0.0)
+    parser.add_argument("--truncated-rate", type=float, default=0.0)
+    parser.add_argument("--reorder-rate", type=float, default=0.0)
+    parser.add_argument("--drop-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="把结果保存为JSON文件。")
+    args = parser.parse_args()
+
+    server_settings = MockLLMSettings(args.latency_median, args.latency_sigma, args.seconds_per_task,
+                                      args.rate_429, args.rate_500, args.malformed_rate, args.truncated_rate,
+                                      args.reorder_rate, args.drop_rate, retry_after=0.1, seed=args.seed)
+    server, url = start_mock_server(server_settings)
+    tasks = make_tasks(args.tasks, args.seed)
+
+    reports = []
+    for concurrency in [int(x) for x in args.concurrency.split(",")]:
+        for task_per_request in [int(x) for x in args.task_per_request.split(",")]:
+            reports.append(run_benchmark(url, server_settings, tasks, concurrency, task_per_request, args.stream))
+
+    server.shutdown()
+
+    print()
+    print(f"{'并发':>4} {'每批':>4} {'成功':>6} {'失败':>4} {'秒':>8} {'任务/秒':>8} {'p50':>7} {'p99':>7} {'请求':>5} {'重试开销':>8}")
+    for report in reports:
+        print(f"{report['concurrency']:>6} {report['task_per_request']:>6} {report['succeeded']:>8} {report['failed']:>6} "
+              f"{report['seconds']:>9} {report['tasks_per_second']:>11} {report['batch_latency_p50']:>7} "
+              f"{report['batch_latency_p99']:>7} {report['http_requests']:>7} {report['retry_overhead']:>12.1%}")
+    print(f"服务器统计: {server_settings.stats}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(reports, f, ensure_ascii=False, indent=4)
@@ -0,0 +1,94 @@
+# 在一本真实的书上评测本地预筛（triage）：干净句子的跳过率，以及人为引入错别字后的召回率
+
+import re
+import random
+import argparse
+
+from book_source import load_book
+from triage import DEFAULT_FREQUENT_MARGIN, CHAR_ALTERNATIVES, CHAR_CONFUSION_SETS, FREQUENT_CONFUSION_SETS, WORD_ALTERNATIVES, BigramModel, find_candidates
+
+SENTENCE_PATTERN = re.compile(r"[^。！？!?\n]{8,200}[。！？!?]?")
+
+
+def error_class(original : str):
+    """
+    错误所属的混淆集，用于按类别统计召回率。
+    """
+    for group in FREQUENT_CONFUSION_SETS:
+        if original in group:
+            return group
+    if original in CHAR_ALTERNATIVES:
+        return "其他单字"
+    return "词语"
+
+
+def corrupt(sentence : str, rng : random.Random):
+    """
+    把句子中一个混淆集中的字或词换成替换项，模拟一处错别字。
+
+    :return: (改动后的句子, 错误类别)，句中没有可替换的字词时返回 None。
+    """
+    positions = [(index, char) for index, char in enumerate(sentence) if char in CHAR_ALTERNATIVES]
+    for word in WORD_ALTERNATIVES:
+        start = sentence.find(word)
+        if start != -1:
+            positions.append((start, word))
+    if not positions:
+        return None
+    index, original = rng.choice(positions)
+    replacement = rng.choice(CHAR_ALTERNATIVES.get(original) or WORD_ALTERNATIVES[original])
+    return sentence[:index] + replacement + sentence[index + len(original):], error_class(original)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="评测本地预筛的跳过率和召回率。")
+    parser.add_argument("book", help="书籍的txt文件。")
+    parser.add_argument("--encoding", default=None)
+    parser.add_argument("--sentences", type=int, default=2000, help="抽样的句子数。")
+    parser.add_argument("--margin", type=float, default=1.0)
+    parser.add_argument("--frequent-margin", type=float, nargs="+", default=[DEFAULT_FREQUENT_MARGIN], help="可以给出多个值依次评测。")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    text = load_book(args.book, args.encoding)
+    # MappedBook 转为 str，以便替换其中的句子
+    text = text[:len(text)]
+
+    sentences = [match.group(0) for match in SENTENCE_PATTERN.finditer(text)]
+    sentences = rng.sample(sentences, min(args.sentences, len(sentences)))
+    corrupted = [(sentence, corrupt(sentence, rng)) for sentence in sentences]
+    corrupted = [(sentence, result[0], result[1]) for sentence, result in corrupted if result is not None]
+
+    # 错别字本来就印在书里，因此二元语法模型用引入了错别字的全文统计
+    wrong_text = text
+    for sentence, wrong_sentence, _ in corrupted:
+        wrong_text = wrong_text.replace(sentence, wrong_sentence, 1)
+    model = BigramModel(wrong_text)
+
+    print(f"书中共 {len(text)} 个字符，抽样 {len(sentences)} 个句子，其中 {len(corrupted)} 个可以引入错别字。")
+    print(f"单字混淆集 {len(CHAR_CONFUSION_SETS)} 组，常用字混淆集 {len(FREQUENT_CONFUSION_SETS)} 组，margin = {args.margin}。\n")
+
+    classes = list(FREQUENT_CONFUSION_SETS) + ["其他单字", "词语"]
+    frequent_chars = set("".join(FREQUENT_CONFUSION_SETS))
+    frequent_sentences = [sentence for sentence in sentences if frequent_chars.intersection(sentence)]
+
+    print(f"{'frequent_margin':<16}{'跳过率':>8}{'含常用字':>8}{'召回率':>8}" + "".join(f"{name:>10}" for name in classes))
+    for frequent_margin in args.frequent_margin:
+        skipped = sum(1 for sentence in sentences if not find_candidates(sentence, model, args.margin, frequent_margin))
+        frequent_skipped = sum(1 for sentence in frequent_sentences if not find_candidates(sentence, model, args.margin, frequent_margin))
+
+        # 句子只要有一个候选就会发送给大模型，错别字也就会被看到，因此按句子统计召回率
+        found = {name: [0, 0] for name in classes}
+        for _, wrong_sentence, name in corrupted:
+            found[name][1] += 1
+            if find_candidates(wrong_sentence, model, args.margin, frequent_margin):
+                found[name][0] += 1
+        recall = sum(value[0] for value in found.values()) / max(1, len(corrupted))
+        per_class = "".join(f"{(value[0] / value[1] if value[1] else 0):>10.1%}" for value in found.values())
+        print(f"{frequent_margin:<16}{skipped / max(1, len(sentences)):>8.1%}"
+              f"{frequent_skipped / max(1, len(frequent_sentences)):>8.1%}{recall:>8.1%}{per_class}")
+
+    print("\n跳过率为抽样的干净句子中没有任何候选的比例，“含常用字”只统计含有常用字混淆集的句子。")
+    print("各类别的样本数：" + "，".join(f"{name} {found[name][1]}" for name in classes))
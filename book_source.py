@@ -0,0 +1,214 @@
+import mmap
+import codecs
+from bisect import bisect_right
+
+# 稀疏索引中相邻两个检查点之间的字节数
+CHECKPOINT_INTERVAL = 1 << 14
+
+# 编码与 BOM，按长度从长到短排列，避免 utf-16 的 BOM 被误判
+_BOMS = [
+    (codecs.BOM_UTF8, 'utf-8'),
+    (codecs.BOM_UTF16_LE, 'utf-16-le'),
+    (codecs.BOM_UTF16_BE, 'utf-16-be'),
+]
+
+# 可以直接在字节层面查找、并按字节对齐检查点的编码
+SUPPORTED_ENCODINGS = {'utf-8', 'utf-16-le', 'utf-16-be'}
+
+
+def _normalize_encoding(encoding : str):
+    name = codecs.lookup(encoding).name
+    return {'utf-8-sig': 'utf-8'}.get(name, name)
+
+
+class MappedBook:
+    """
+    通过 mmap 访问书籍的txt文件，按需解码，不把全文读入内存。
+
+    对外提供与 str 相同的最常用操作：len()、按字符位置切片和取单个字符、find()，
+    因此定位、分句分段和应用校正的代码可以直接使用它代替 str。
+    字符位置与字节位置之间通过一个稀疏的检查点索引换算，每 CHECKPOINT_INTERVAL 字节一个检查点。
+
+    与 open(...).read() 不同，这里不会把 \\r\\n 转换为 \\n，字符位置以文件中的原始内容为准。
+    """
+
+    def __init__(self, path : str, encoding : str = None):
+        """
+        :param path: 书籍txt文件的路径。
+        :param encoding: 文件编码，默认根据 BOM 判断，没有 BOM 时按 utf-8 处理。
+        """
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # 空文件无法 mmap
+            self._mm = b''
+
+        self.base = 0
+        detected = None
+        for bom, bom_encoding in _BOMS:
+            if self._mm[:len(bom)] == bom:
+                detected, self.base = bom_encoding, len(bom)
+                break
+
+        if encoding is None:
+            self.encoding = detected or 'utf-8'
+        else:
+            self.encoding = _normalize_encoding(encoding)
+            if self.encoding == 'utf-16':
+                self.encoding = detected or 'utf-16-le'
+            if detected is None or detected != self.encoding:
+                self.base = 0
+
+        if self.encoding not in SUPPORTED_ENCODINGS:
+            raise ValueError(f"不支持的编码: {self.encoding}")
+
+        self._unit = 1 if self.encoding == 'utf-8' else 2
+        self._build_index()
+
+    def _is_boundary(self, position : int):
+        """
+        判断字节位置是否落在字符的开头。
+        """
+        if position >= len(self._mm):
+            return True
+        if self.encoding == 'utf-8':
+            return self._mm[position] & 0xC0 != 0x80
+        if (position - self.base) % 2:
+            return False
+        unit = self._mm[position:position + 2]
+        high_byte = unit[1] if self.encoding == 'utf-16-le' else unit[0]
+        # 低代理项是代理对的后半部分
+        return not 0xDC <= high_byte <= 0xDF
+
+    def _build_index(self):
+        """
+        顺序解码一遍全文，记录检查点的 (字符位置, 字节位置)。每次只解码一个区间，内存占用固定。
+        """
+        self._checkpoint_chars = [0]
+        self._checkpoint_bytes = [self.base]
+        size = len(self._mm)
+        position = self.base
+        chars = 0
+        while position < size:
+            end = min(size, position + CHECKPOINT_INTERVAL)
+            while end < size and not self._is_boundary(end):
+                end -= 1
+            chars += len(self._mm[position:end].decode(self.encoding))
+            position = end
+            self._checkpoint_chars.append(chars)
+            self._checkpoint_bytes.append(position)
+        self._length = chars
+
+    def __len__(self):
+        return self._length
+
+    def _decode_forward(self, byte_start : int, char_count : int):
+        """
+        从 byte_start 开始解码 char_count 个字符，返回 (文本, 结束的字节位置)。
+        """
+        if char_count <= 0:
+            return '', byte_start
+        # 每个字符最多占4个字节
+        byte_end = min(len(self._mm), byte_start + char_count * 4)
+        decoder = codecs.getincrementaldecoder(self.encoding)()
+        text = decoder.decode(self._mm[byte_start:byte_end], final=byte_end == len(self._mm))[:char_count]
+        return text, byte_start + len(text.encode(self.encoding))
+
+    def char_to_byte(self, char_position : int):
+        """
+        把字符位置换算为字节位置。
+        """
+        char_position = min(max(char_position, 0), self._length)
+        index = bisect_right(self._checkpoint_chars, char_position) - 1
+        checkpoint_char = self._checkpoint_chars[index]
+        checkpoint_byte = self._checkpoint_bytes[index]
+        return self._decode_forward(checkpoint_byte, char_position - checkpoint_char)[1]
+
+    def byte_to_char(self, byte_position : int):
+        """
+        把字节位置（必须位于字符开头）换算为字符位置。
+        """
+        index = bisect_right(self._checkpoint_bytes, byte_position) - 1
+        checkpoint_byte = self._checkpoint_bytes[index]
+        return self._checkpoint_chars[index] + len(self._mm[checkpoint_byte:byte_position].decode(self.encoding))
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self._length)
+            if step != 1:
+                raise ValueError("MappedBook 只支持步长为1的切片")
+            if stop <= start:
+                return ''
+            return self._decode_forward(self.char_to_byte(start), stop - start)[0]
+
+        if key < 0:
+            key += self._length
+        if not 0 <= key < self._length:
+            raise IndexError("MappedBook index out of range")
+        return self[key:key + 1]
+
+    def find(self, sub : str, start : int = 0, end : int = None):
+        """
+        与 str.find 相同，在字节层面查找，不需要解码查找范围内的文本。
+        """
+        if end is None or end > self._length:
+            end = self._length
+        start = max(start, 0)
+        if not sub:
+            return start if start <= end else -1
+
+        needle = sub.encode(self.encoding)
+        byte_start = self.char_to_byte(start)
+        byte_end = self.char_to_byte(end)
+        while True:
+            found = self._mm.find(needle, byte_start, byte_end)
+            if found == -1:
+                return -1
+            if self._is_boundary(found):
+                return self.byte_to_char(found)
+            byte_start = found + 1
+
+    def iter_chunks(self, chunk_size : int = 1 << 20, overlap : int = 0):
+        """
+        按顺序返回 (起始字符位置, 文本)，相邻两块之间重叠 overlap 个字符。
+        """
+        for chunk_start in range(0, self._length, chunk_size):
+            yield chunk_start, self[chunk_start:chunk_start + chunk_size + overlap]
+
+    def close(self):
+        if isinstance(self._mm, mmap.mmap):
+            self._mm.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def iter_text_chunks(text, chunk_size : int = 1 << 20, overlap : int = 0):
+    """
+    分块遍历 str 或 MappedBook。str 直接整体返回，MappedBook 按块解码。
+    """
+    if isinstance(text, str):
+        yield 0, text
+    else:
+        yield from text.iter_chunks(chunk_size, overlap)
+
+
+def load_book(book_path : str, encoding : str = None):
+    """
+    打开书籍txt文件。utf-8 与 utf-16 的文件通过 mmap 访问；
+    其他编码（例如 gb18030）无法在字节层面定位字符，只能整体读入内存。
+
+    无论哪种方式都保留文件中原始的换行符，保证各个阶段得到的字符位置一致。
+    """
+    if encoding is None or _normalize_encoding(encoding) in SUPPORTED_ENCODINGS | {'utf-16'}:
+        return MappedBook(book_path, encoding)
+
+    print(f"编码 {encoding} 不支持按需读取，将整体读入内存。")
+    with open(book_path, 'r', encoding=encoding, newline='') as f:
+        return f.read()
@@ -0,0 +1,90 @@
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+
+from book_source import iter_text_chunks
+
+# 按块扫描 MappedBook 时每块的字符数
+CHUNK_SIZE = 1 << 20
+
+# 句子的结束符
+SENTENCE_ENDERS_PATTERN = re.compile(r'[。!！?？\n]')
+
+# 段落的分隔：两个换行符（包括 \r\n\r\n），或者换行符后接中文空格缩进
+PARAGRAPH_BREAK_PATTERN = re.compile(r'\n(?=\n|\u3000|\r\n)')
+
+
+class BoundaryIndex:
+    """
+    一本书的句子与段落边界索引。
+
+    构建时用正则表达式扫描一遍全文，把句子结束符和段落分隔的位置保存为有序的整数数组，
+    之后每次查找只需要二分查找，不再逐字符向前向后扫描。
+    同一本书的定位和应用阶段共用同一个索引（见 run_pipeline.PipelineContext）。
+    """
+
+    def __init__(self, text):
+        """
+        :param text: 全文，可以是 str，也可以是 book_source.MappedBook（此时按块扫描）。
+        """
+        self.text_length = len(text)
+        self.sentence_enders = array('q')
+
+        # 段落分隔的位置与长度，"\n\n" 和 "\n　" 为2，"\n\r\n" 为3
+        self.paragraph_breaks = array('q')
+        self.paragraph_break_lengths = array('b')
+
+        # 段落分隔最多需要向后看2个字符，相邻两块之间重叠2个字符，
+        # 只记录落在本块自身范围内的位置，避免重复
+        for chunk_start, chunk in iter_text_chunks(text, CHUNK_SIZE, 2):
+            own_length = len(chunk) if chunk_start + len(chunk) >= self.text_length else CHUNK_SIZE
+            for m in SENTENCE_ENDERS_PATTERN.finditer(chunk, 0, own_length):
+                self.sentence_enders.append(chunk_start + m.start())
+            for m in PARAGRAPH_BREAK_PATTERN.finditer(chunk):
+                if m.start() >= own_length:
+                    break
+                self.paragraph_breaks.append(chunk_start + m.start())
+                self.paragraph_break_lengths.append(3 if chunk[m.start() + 1] == '\r' else 2)
+
+        # 用于跳过段首、句首空白的文本引用
+        self._text = text
+
+    def _skip_whitespace(self, position : int):
+        # 去除可能存在的前导空格或换行符
+        while position < self.text_length and self._text[position].isspace():
+            position += 1
+        return position
+
+    def sentence_range(self, start_index : int, end_index : int):
+        """
+        返回包含 [start_index, end_index] 的完整句子的范围 (sentence_start, sentence_end)。
+        句子从 start_index 之前最近的结束符之后开始，到 end_index 之后最近的结束符（包含）为止。
+        """
+        index = bisect_right(self.sentence_enders, start_index)
+        sentence_start = self.sentence_enders[index - 1] + 1 if index else 0
+        sentence_start = self._skip_whitespace(sentence_start)
+
+        index = bisect_left(self.sentence_enders, end_index)
+        sentence_end = self.sentence_enders[index] + 1 if index < len(self.sentence_enders) else self.text_length
+
+        return sentence_start, sentence_end
+
+    def paragraph_range(self, start_index : int, end_index : int):
+        """
+        返回包含 [start_index, end_index] 的完整段落的范围 (paragraph_start, paragraph_end)。
+        段落的终点包含结尾的段落分隔符。
+        """
+        index = bisect_right(self.paragraph_breaks, start_index)
+        if index:
+            paragraph_start = self.paragraph_breaks[index - 1] + self.paragraph_break_lengths[index - 1]
+        else:
+            paragraph_start = 0
+        paragraph_start = self._skip_whitespace(paragraph_start)
+
+        index = bisect_left(self.paragraph_breaks, end_index)
+        if index < len(self.paragraph_breaks):
+            paragraph_end = self.paragraph_breaks[index] + self.paragraph_break_lengths[index]
+        else:
+            paragraph_end = self.text_length
+
+        return paragraph_start, paragraph_end
@@ -0,0 +1,90 @@
+import hashlib
+
+from boundary_index import BoundaryIndex
+
+
+def content_hash(text : str):
+    """
+    标注文本的内容哈希。
+    """
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def merge_located_clippings(text, items : list, boundary_index : BoundaryIndex):
+    """
+    合并定位后重复或重叠的标注。
+
+    Kindle 每次延长或重新划线都会写入一条新的标注，因此同一段文字会出现多条完全相同、
+    或者互相包含、部分重叠的标注。这里先按 (内容哈希, 起点) 合并完全相同的标注，
+    再把 [position_start, position_end) 有重叠或包含关系的标注合并为它们的并集，
+    并重新计算合并后范围所在的句子和段落。只是首尾相接的范围不合并。
+    相同的文字出现在书中不同位置时是不同的标注，不会被合并。
+
+    :param text: 原文，str 或 book_source.MappedBook。
+    :param items: build_pre_correction 生成的标注列表。
+    :param boundary_index: 原文的句子与段落边界索引。
+    :return: (merged, stats)。merged 中每条标注的 id 为其来源中最小的 id，
+             source_ids 记录合并前的所有标注 id；stats 包含合并前后的数量。
+    """
+    # 完全相同的标注只保留一条
+    unique = {}
+    for item in items:
+        key = (content_hash(item['text']), item['position_start'])
+        if key in unique:
+            unique[key]['source_ids'].append(item['id'])
+        else:
+            unique[key] = dict(item, source_ids=[item['id']])
+    duplicates = len(items) - len(unique)
+
+    # 按起点排序后扫描一遍，重叠或包含的范围合并为一组
+    groups = []
+    group_end = None
+    for item in sorted(unique.values(), key=lambda x: (x['position_start'], -x['position_end'])):
+        if groups and item['position_start'] < group_end:
+            groups[-1].append(item)
+            group_end = max(group_end, item['position_end'])
+        else:
+            groups.append([item])
+            group_end = item['position_end']
+
+    merged = []
+    for group in groups:
+        if len(group) == 1:
+            merged.append(group[0])
+            continue
+
+        start = min(item['position_start'] for item in group)
+        end = max(item['position_end'] for item in group)
+        sentence_start, sentence_end = boundary_index.sentence_range(start, end)
+        paragraph_start, paragraph_end = boundary_index.paragraph_range(start, end)
+        source_ids = sorted(source_id for item in group for source_id in item['source_ids'])
+
+        merged.append({
+            'id': source_ids[0],
+            'location_start': min(item['location_start'] for item in group),
+            'position_start': start,
+            'position_end': end,
+            'text': text[start:end],
+            'match_confidence': min(item['match_confidence'] for item in group),
+            'sentence': {
+                'start': sentence_start,
+                'end': sentence_end,
+                'text': text[sentence_start:sentence_end]
+            },
+            'paragraph': {
+                'start': paragraph_start,
+                'end': paragraph_end,
+                'text': text[paragraph_start:paragraph_end]
+            },
+            'source_ids': source_ids
+        })
+
+    merged.sort(key=lambda x: x['id'])
+
+    stats = {
+        'before': len(items),
+        'after': len(merged),
+        'duplicates': duplicates,
+        'overlapping': len(unique) - len(merged)
+    }
+    return merged, stats
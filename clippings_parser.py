@@ -0,0 +1,416 @@
+import os
+import re
+import json
+import hashlib
+
+# Kindle 在每条标注之后写入的分隔行
+CLIPPING_SEPARATOR = '=========='
+
+# 校验文件开头时读取的字节数
+HEAD_SIGNATURE_SIZE = 4096
+
+# 各语言的 Kindle 在元数据行中表示标注类型的词，按顺序匹配（已转为小写）
+CLIPPING_TYPE_KEYWORDS = [
+    ("书签", "bookmark"), ("bookmark", "bookmark"), ("ブックマーク", "bookmark"), ("lesezeichen", "bookmark"),
+    ("signet", "bookmark"), ("marcador", "bookmark"), ("segnalibro", "bookmark"),
+    ("笔记", "note"), ("ノート", "note"), ("メモ", "note"), ("notiz", "note"), ("note", "note"), ("nota", "note"),
+    ("标注", "highlight"), ("highlight", "highlight"), ("ハイライト", "highlight"), ("markierung", "highlight"),
+    ("surlignement", "highlight"), ("subrayado", "highlight"), ("evidenziazione", "highlight"), ("destaque", "highlight"),
+]
+
+# 解析的规则或输出的格式改变时增加，已有的断点会失效并重新完整解析
+PARSER_VERSION = 2
+
+# 位置编号前面的词（已转为小写），较长的放在前面
+LOCATION_KEYWORDS = ["位置no.", "位置 #", "位置#", "location", "loc.", "position", "posición", "posizione", "posição", "emplacement"]
+
+# 添加时间前面的词（已转为小写）
+DATE_KEYWORDS = ["added on", "添加于", "作成日：", "作成日:", "hinzugefügt am", "ajouté le", "añadido el",
+                 "aggiunto in data", "aggiunto il", "adicionado:", "adicionado em"]
+
+
+def _keyword_pattern(keywords : list, suffix : str = ""):
+    """
+    把关键词列表编译为一个只含字面量分支的正则表达式，一次扫描就能找到最左边的关键词。
+    """
+    return re.compile("(" + "|".join(re.escape(keyword) for keyword in keywords) + ")" + suffix)
+
+
+def _search_keyword(pattern : re.Pattern, text : str):
+    """
+    返回 pattern 在 text 中第一个位于词首的匹配，"position" 不会匹配 "composition" 中的一部分。
+    在正则表达式中用后顾断言会使关键词分支无法快速扫描，因此在这里检查前一个字符。
+    """
+    match = pattern.search(text)
+    while match and match.start() > 0 and match.group(1)[0].isascii() and text[match.start() - 1].isalpha():
+        match = pattern.search(text, match.start() + 1)
+    return match
+
+
+CLIPPING_TYPES = dict(CLIPPING_TYPE_KEYWORDS)
+CLIPPING_TYPE_PATTERN = _keyword_pattern([keyword for keyword, _ in CLIPPING_TYPE_KEYWORDS])
+DATE_PATTERN = _keyword_pattern(DATE_KEYWORDS)
+
+# 位置编号，例如 "位置 #1234-1240"、"Location 1234-40"；关键词后面必须紧跟编号，
+# 其他段中偶然出现的 "position" 等词不会被当作位置
+LOCATION_PATTERN = _keyword_pattern(LOCATION_KEYWORDS, r"\s*#?\s*(\d+)(?:\s*-\s*(\d+))?")
+
+# 页码，例如 "第 12 页"、"12ページ"、"page 12"
+PAGE_PATTERN = re.compile(r"第\s*(\d+)\s*页|(\d+)\s*ページ|(?:page|seite|página|pagina)\s+(\d+)")
+
+
+def iter_clipping_entries(file_path : str, start_offset : int = 0):
+    """
+    以生成器的方式逐条读取 'My Clippings.txt'，不会一次性把整个文件读入内存。
+
+    只有以分隔行结尾的完整条目才会被返回，文件末尾尚未写完的条目会被忽略，
+    这样记录下来的偏移量总是落在条目边界上。
+
+    :param file_path: 'My Clippings.txt' 的文件路径。
+    :param start_offset: 开始读取的字节偏移，必须位于条目边界上。
+    :return: 生成 (entry_start, entry_end, entry_text)，其中偏移均为字节偏移，
+             entry_end 指向分隔行之后的位置。
+    """
+    with open(file_path, 'rb') as f:
+        f.seek(start_offset)
+        offset = start_offset
+        entry_start = offset
+        lines = []
+        for raw_line in f:
+            offset += len(raw_line)
+            line = raw_line.decode('utf-8', errors='replace').rstrip('\r\n')
+            if line == CLIPPING_SEPARATOR:
+                yield entry_start, offset, '\n'.join(lines)
+                lines = []
+                entry_start = offset
+            else:
+                lines.append(line)
+
+
+def _expand_location_end(location_start : int, location_end : str):
+    """
+    旧款 Kindle 会把结束位置缩写为与起始位置不同的末几位，例如 "1234-40" 表示 1234 到 1240。
+    """
+    end = int(location_end)
+    if end < location_start and len(location_end) < len(str(location_start)):
+        end = int(str(location_start)[:-len(location_end)] + location_end)
+    return end
+
+
+def parse_metadata_line(line : str):
+    """
+    解析标注的第二行（元数据行），兼容中文、英文、日文、德文、法文、西班牙文、意大利文和葡萄牙文的 Kindle。
+
+    例如：
+        - 您在第 12 页（位置 #177-178）的标注 | 添加于 2020年1月1日星期三 下午10:00:00
+        - Your Highlight on page 12 | Location 177-178 | Added on Wednesday, January 1, 2020 10:00:00 PM
+        - 12ページ|位置No. 177-178のハイライト |作成日: 2020年1月1日水曜日 22:00:00
+
+    按 "|" 分段后逐段查找关键词。关键词只用字面量分支匹配，不会像原来的 .+? 那样回溯。
+
+    :return: 包含 type, page, location_start, location_end, date 的字典，不是元数据行时返回 None。
+             type 为 highlight、note 或 bookmark；没有对应信息的项为 None。
+    """
+    if not line.startswith("-"):
+        return None
+
+    clipping_type = None
+    page = None
+    location_start = None
+    location_end = None
+    date = None
+
+    for segment in line[1:].split("|"):
+        segment = segment.strip()
+        lowered = segment.lower()
+        if not lowered:
+            continue
+
+        # 添加时间所在的段不再包含其他信息
+        match = _search_keyword(DATE_PATTERN, lowered)
+        if match:
+            date = segment[match.end():].strip()
+            continue
+
+        if clipping_type is None:
+            match = _search_keyword(CLIPPING_TYPE_PATTERN, lowered)
+            if match:
+                clipping_type = CLIPPING_TYPES[match.group(1)]
+
+        if location_start is None:
+            match = _search_keyword(LOCATION_PATTERN, lowered)
+            if match:
+                location_start = int(match.group(2))
+                if match.group(3):
+                    location_end = _expand_location_end(location_start, match.group(3))
+
+        if page is None:
+            match = PAGE_PATTERN.search(lowered)
+            if match:
+                page = int(match.group(1) or match.group(2) or match.group(3))
+
+    if clipping_type is None or (location_start is None and page is None):
+        return None
+
+    return {
+        'type': clipping_type,
+        'page': page,
+        'location_start': location_start,
+        'location_end': location_end,
+        'date': date
+    }
+
+
+def _strip_title(line : str):
+    """
+    去掉标题行末尾的作者，例如 "书名 (作者)" 得到 "书名"，"Foo (Bar) Baz (Author)" 得到 "Foo (Bar) Baz"。
+    只去掉与末尾的 ")" 配对的那一组括号。
+    """
+    line = line.strip()
+    if not line.endswith(")"):
+        return line
+
+    if line.count("(") == 1:
+        return line[:line.index("(")].strip() or line
+
+    depth = 0
+    for index in range(len(line) - 1, -1, -1):
+        if line[index] == ")":
+            depth += 1
+        elif line[index] == "(":
+            depth -= 1
+            if depth == 0:
+                # 整行都在括号中时不是作者，保留原样
+                return line[:index].strip() or line
+    return line
+
+
+def parse_clipping_entry(entry : str):
+    """
+    解析单条标注的文本。
+
+    按行的状态机依次读取：标题行 → 元数据行 → 空行 → 正文（可以有多行）。
+
+    :param entry: 两个分隔行之间的原始文本。
+    :return: 包含 title, type, page, location_start, location_end, date, text 的字典；
+             条目为空或无法识别时返回 None。
+    """
+    title = None
+    metadata = None
+    text_lines = []
+    # 0: 等待标题，1: 等待元数据行，2: 等待空行，3: 正文
+    state = 0
+
+    for line in entry.split('\n'):
+        if state == 0:
+            # 文件开头以及部分条目的标题前会带有 BOM
+            line = line.replace('\ufeff', '').strip()
+            if line:
+                title = _strip_title(line)
+                state = 1
+        elif state == 1:
+            metadata = parse_metadata_line(line.strip())
+            if metadata is None:
+                return None
+            state = 2
+        elif state == 2:
+            state = 3
+            if line.strip():
+                text_lines.append(line)
+        else:
+            text_lines.append(line)
+
+    if metadata is None:
+        return None
+
+    clipping = {'title': title}
+    clipping.update(metadata)
+    clipping['text'] = '\n'.join(text_lines).strip()
+    return clipping
+
+
+def _hash_file_range(file_path : str, start : int, end : int):
+    """
+    计算文件中 [start, end) 字节范围的 sha256。
+    """
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        return hashlib.sha256(f.read(end - start)).hexdigest()
+
+
+def load_checkpoint(checkpoint_path : str, file_path : str):
+    """
+    读取上一次解析留下的断点，并检查断点与当前的解析程序版本一致、'My Clippings.txt' 仍然只是在末尾追加。
+
+    :param checkpoint_path: 断点文件路径。
+    :param file_path: 'My Clippings.txt' 的文件路径。
+    :return: 断点仍然有效时返回断点字典，否则返回 None。
+    """
+    if not os.path.exists(checkpoint_path):
+        return None
+
+    try:
+        with open(checkpoint_path, 'r', encoding='utf-8') as f:
+            checkpoint = json.load(f)
+        if checkpoint.get('parser_version') != PARSER_VERSION:
+            print("断点是由旧版本的解析程序生成的，将重新完整解析。")
+            return None
+
+        offset = checkpoint['offset']
+        last_entry_start = checkpoint['last_entry_start']
+        head_size = min(HEAD_SIGNATURE_SIZE, offset)
+
+        if os.path.getsize(file_path) < offset:
+            print("标注文件比上次解析时更短，将重新完整解析。")
+            return None
+
+        if _hash_file_range(file_path, 0, head_size) != checkpoint['head_hash']:
+            print("标注文件开头已改变，将重新完整解析。")
+            return None
+
+        if _hash_file_range(file_path, last_entry_start, offset) != checkpoint['last_entry_hash']:
+            print("上次解析的最后一条标注已改变，将重新完整解析。")
+            return None
+
+    except (IOError, ValueError, KeyError) as e:
+        print(f"断点文件 '{checkpoint_path}' 无法使用，将重新完整解析。错误信息: {e}")
+        return None
+
+    return checkpoint
+
+
+def save_checkpoint(checkpoint_path : str, file_path : str, last_entry_start : int, offset : int):
+    """
+    记录本次解析结束的位置，以及用于校验文件未被改写的哈希值。
+
+    :param checkpoint_path: 断点文件路径。
+    :param file_path: 'My Clippings.txt' 的文件路径。
+    :param last_entry_start: 最后一条已解析标注的起始字节偏移。
+    :param offset: 最后一条已解析标注结束处的字节偏移。
+    """
+    checkpoint = {
+        'parser_version': PARSER_VERSION,
+        'offset': offset,
+        'last_entry_start': last_entry_start,
+        'head_hash': _hash_file_range(file_path, 0, min(HEAD_SIGNATURE_SIZE, offset)),
+        'last_entry_hash': _hash_file_range(file_path, last_entry_start, offset)
+    }
+    with open(checkpoint_path, 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f, ensure_ascii=False, indent=4)
+
+
+def default_checkpoint_path(output_json_path : str):
+    """
+    断点文件默认与输出的JSON放在一起，例如 grouped_clippings.checkpoint.json
+    """
+    return os.path.splitext(output_json_path)[0] + '.checkpoint.json'
+
+
+def parse_and_group_clippings(file_path, output_json_path='grouped_clippings.json', checkpoint_path=None, incremental=True):
+    """
+    解析 'My Clippings.txt' 文件，将标注按书名分组，并保存为JSON文件。
+    兼容有无页码的情况，以及各种语言的 Kindle。只保留划线标注，笔记、书签和无法识别的条目只计数。
+
+    Kindle 只会在文件末尾追加标注，因此在启用增量模式时，会从上次记录的断点开始
+    只解析新追加的标注，并合并到已有的JSON文件中。如果文件已被改写（断点校验失败），
+    则退回到完整解析。
+
+    :param file_path: 'My Clippings.txt' 的文件路径。
+    :param output_json_path: 输出的JSON文件的路径。
+    :param checkpoint_path: 断点文件路径，默认与输出的JSON放在一起。
+    :param incremental: 是否启用增量解析。
+    """
+    if not os.path.exists(file_path):
+        print(f"错误: 找不到文件 '{file_path}'")
+        return None
+
+    if checkpoint_path is None:
+        checkpoint_path = default_checkpoint_path(output_json_path)
+
+    grouped_by_title = {}
+    start_offset = 0
+    last_entry_start = 0
+
+    checkpoint = load_checkpoint(checkpoint_path, file_path) if incremental else None
+    if checkpoint and os.path.exists(output_json_path):
+        with open(output_json_path, 'r', encoding='utf-8') as json_file:
+            grouped_by_title = json.load(json_file)
+        start_offset = checkpoint['offset']
+        last_entry_start = checkpoint['last_entry_start']
+        print(f"正在从第 {start_offset} 字节处增量解析 '{file_path}'...")
+    else:
+        print(f"正在解析 '{file_path}'...")
+
+    offset = start_offset
+    new_clippings = 0
+    # 笔记和书签不是书中的原文，不参与校正，只计数；无法识别的条目也计数，而不是悄悄丢弃
+    skipped = {'note': 0, 'bookmark': 0, 'no_location': 0, 'unparsed': 0}
+
+    for entry_start, entry_end, entry in iter_clipping_entries(file_path, start_offset):
+        last_entry_start, offset = entry_start, entry_end
+
+        clipping = parse_clipping_entry(entry)
+        if clipping is None:
+            if entry.replace('\ufeff', '').strip():
+                skipped['unparsed'] += 1
+            continue
+        if clipping['type'] != 'highlight':
+            skipped[clipping['type']] += 1
+            continue
+        if clipping['location_start'] is None:
+            skipped['no_location'] += 1
+            continue
+
+        # --- 按 'title' 分组 ---
+        # 在每个条目中移除title，因为title已经是键了
+        title = clipping.pop('title')
+        clipping.pop('type')
+        grouped_by_title.setdefault(title, []).append(clipping)
+        new_clippings += 1
+
+    if any(skipped.values()):
+        print(f"跳过了 {skipped['note']} 条笔记、{skipped['bookmark']} 个书签、{skipped['no_location']} 条没有位置的标注，"
+              f"另有 {skipped['unparsed']} 条无法识别。")
+
+    if not grouped_by_title:
+        print("没有找到任何有效的标注。")
+        return None
+
+    if start_offset:
+        print(f"解析完成，新增 {new_clippings} 条标注。")
+    else:
+        print(f"解析完成，共找到 {new_clippings} 条标注。")
+
+    # --- 保存为JSON文件 ---
+    print(f"正在将分组后的标注保存到 '{output_json_path}'...")
+    try:
+        with open(output_json_path, 'w', encoding='utf-8') as json_file:
+            # ensure_ascii=False 确保中文等字符正确显示
+            # indent=4 使JSON文件格式优美，易于阅读
+            json.dump(grouped_by_title, json_file, ensure_ascii=False, indent=4)
+        print("成功保存JSON文件。")
+        if offset:
+            save_checkpoint(checkpoint_path, file_path, last_entry_start, offset)
+    except IOError as e:
+        print(f"错误：无法写入文件 '{output_json_path}'。错误信息: {e}")
+        return None
+
+    return grouped_by_title
+
+
+def merge_grouped_clippings(grouped_list : list):
+    """
+    合并多个按书名分组的标注（例如多台 Kindle 各自解析的结果）。
+    同一本书中位置和文本都相同的标注只保留一条。
+    """
+    merged = {}
+    seen = set()
+    for grouped in grouped_list:
+        for title, clippings in grouped.items():
+            for clipping in clippings:
+                key = (title, clipping['location_start'], clipping['text'])
+                if key in seen:
+                    continue
+                seen.add(key)
+                merged.setdefault(title, []).append(clipping)
+    return merged
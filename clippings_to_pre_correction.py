@@ -1,15 +1,31 @@
 import os
 import re
 import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+from book_source import load_book
+from boundary_index import BoundaryIndex
+from clipping_merger import merge_located_clippings
+from correction_journal import hash_file
+from locator import locate_clippings
+from metrics import metrics, profile_stage
+from pipeline_state import STAGE_LOCATED, PipelineState, clipping_key, open_pipeline_state
+from text_matcher import match_text
 
 def find_text_in_source_txt(clipping : dict, 
                             source_txt_content : str,
                             total_chars : int, 
                             total_locs : int,
                             start_locs : int,
-                            search_window : int):
+                            search_window : int,
+                            max_edit_ratio : float = 0.1):
     """
-    使用比例换算法在源TXT文件中精确定位标注文本。
+    使用比例换算法在源TXT文件中定位标注文本。
+
+    先在估算位置附近的窗口内精确查找，找不到时依次尝试规范化匹配、模糊匹配和整本书查找，
+    具体见 text_matcher.match_text。
     
     :param clipping: 包含标注信息的字典，必须包含 'text', 'page', 'location_start' 键。
     
@@ -23,7 +39,9 @@ def find_text_in_source_txt(clipping : dict,
 
     :param search_window: 搜索窗口大小，单位为字符数。
 
-    :return: 如果找到匹配的文本，返回一个包含起始和结束字符位置的列表 [start_pos, end_pos]；否则返回 None。    
+    :param max_edit_ratio: 模糊匹配允许的最大编辑距离占标注长度的比例。
+
+    :return: 如果找到匹配的文本，返回 {'start', 'end', 'confidence', 'method'}；否则返回 None。    
     """
     print(f"\n正在处理标注: '{clipping['text'][:50]}...'")
     print(f"原始信息: 位置 #{clipping['location_start']}")
@@ -35,18 +53,18 @@ def find_text_in_source_txt(clipping : dict,
     search_start = max(0, estimated_char_pos - search_window)
     search_end = min(total_chars, estimated_char_pos + len(highlighted_text) + search_window)
 
-    found_pos = source_txt_content.find(highlighted_text, search_start, search_end)
+    match = match_text(source_txt_content, highlighted_text, search_start, search_end, estimated_char_pos, max_edit_ratio)
 
-    if found_pos != -1:
-        print(f"✅ 成功定位! 文本位于源TXT文件的第 {found_pos} 个字符处。")
-        return [found_pos,found_pos + len(clipping['text'])]
+    if match:
+        print(f"✅ 成功定位! 文本位于源TXT文件的第 {match['start']} 个字符处。匹配方式: {match['method']}，置信度: {match['confidence']}")
+        return match
     else:
         print("❌ 错误: 未能在源文件中找到匹配的标注内容。")
         return None
 
 
     
-def find_sentences_by_range(text: str, index_range : tuple):
+def find_sentences_by_range(text: str, index_range : tuple, boundary_index : BoundaryIndex = None):
     """
     根据给定的索引范围 (start, end)，找到一个包含该范围的完整句子或多个句子。
 
@@ -55,6 +73,7 @@ def find_sentences_by_range(text: str, index_range : tuple):
 
     :param text: 待搜索的完整文本。
     :param index_range: 一个元组或列表，格式为 (start_index, end_index)。
+    :param boundary_index: 这本书的边界索引，处理多条标注时应当只构建一次并重复使用。
     :return: 包含指定范围的、从句子开头到结尾的文本字符串。
     """
     start_index, end_index = index_range
@@ -64,32 +83,14 @@ def find_sentences_by_range(text: str, index_range : tuple):
         print("错误: 索引范围无效。")
         return ""
 
-    # 定义句子的结束符
-    sentence_enders = {'。', '!', '！', '?', '？', '\n'}
+    if boundary_index is None:
+        boundary_index = BoundaryIndex(text)
 
-    # 1. 寻找文本片段的真正起点
-    # 从 `start_index` 向前搜索，找到它所在句子的起点
-    sentence_start = 0
-    for i in range(start_index, -1, -1):
-        if text[i] in sentence_enders:
-            sentence_start = i + 1  # 句子的真正起点是标点符号的后一个字符
-            break
-    
-    # 去除可能存在的前导空格或换行符
-    while sentence_start < len(text) and text[sentence_start].isspace():
-        sentence_start += 1
-
-    # 2. 寻找文本片段的真正终点
-    # 从 `end_index` 向后搜索，找到它所在句子的终点
-    sentence_end = len(text)
-    for i in range(end_index, len(text)):
-        if text[i] in sentence_enders:
-            sentence_end = i + 1  # 句子的终点包含这个标点符号
-            break
+    sentence_start, sentence_end = boundary_index.sentence_range(start_index, end_index)
 
     return sentence_start, sentence_end, text[sentence_start:sentence_end]
 
-def find_paragraph_by_range(text : str, index_range : tuple):
+def find_paragraph_by_range(text : str, index_range : tuple, boundary_index : BoundaryIndex = None):
     """
     根据给定的索引范围 (start, end)，找到一个包含该范围的完整段落。
 
@@ -98,6 +99,7 @@ def find_paragraph_by_range(text : str, index_range : tuple):
 
     :param text: 待搜索的完整文本。
     :param index_range: 一个元组或列表，格式为 (start_index, end_index)。
+    :param boundary_index: 这本书的边界索引，处理多条标注时应当只构建一次并重复使用。
     :return: 包含指定范围的、从段落开头到结尾的文本字符串。
     """
     start_index, end_index = index_range
@@ -107,34 +109,225 @@ def find_paragraph_by_range(text : str, index_range : tuple):
         print("错误: 索引范围无效。")
         return ""
 
-    # 定义段落的结束符
-    # 两个换行符，以及或一个换行符+中文空格
-    paragraph_enders = {'\n\n', '\r\n\r\n' , '\n　'}
-
-    # 1. 寻找文本片段的真正起点
-    # 从 `start_index` 向前搜索，找到它所在段落的起点
-    paragraph_start = 0
-    for i in range(start_index, -1, -1):
-        if text[i:i+2] in paragraph_enders:
-            paragraph_start = i + 2  # 段落的真正起点是两个换行符之后
-            break
-
-    # 去除可能存在的前导空格或换行符
-    while paragraph_start < len(text) and text[paragraph_start].isspace():
-        paragraph_start += 1
-
-    # 2. 寻找文本片段的真正终点
-    # 从 `end_index` 向后搜索，找到它所在段落的终点
-    paragraph_end = len(text)
-    for i in range(end_index, len(text)):
-        if text[i:i+2] in paragraph_enders:
-            paragraph_end = i + 2  # 段落的终点包含两个换行符
-            break
+    if boundary_index is None:
+        boundary_index = BoundaryIndex(text)
+
+    paragraph_start, paragraph_end = boundary_index.paragraph_range(start_index, end_index)
 
     return paragraph_start, paragraph_end, text[paragraph_start:paragraph_end]
 
+def build_pre_correction(text,
+                         clippings : list,
+                         locations : dict = None,
+                         search_window_in_percentage : float = 0.05,
+                         max_edit_ratio : float = 0.1,
+                         merge_overlapping : bool = True,
+                         state : PipelineState = None,
+                         book_hash : str = None,
+                         boundary_index : BoundaryIndex = None):
+    """
+    定位一本书的所有标注，并找到其所在的句子和段落。
+    merge_overlapping 为 True 时，重复或重叠的标注会被合并，见 clipping_merger.merge_located_clippings。
+
+    :param text: 书籍的全文，str 或 book_source.MappedBook。
+    :param clippings: 这本书的标注列表。
+    :param locations: 可选的 {'start', 'end'}，见 locator.locate_clippings。
+    :param search_window_in_percentage: 最大查找半径占全书字符数的比例。
+    :param max_edit_ratio: 模糊匹配允许的最大编辑距离占标注长度的比例。
+    :param merge_overlapping: 是否合并重复或重叠的标注。
+    :param state: 可选的流水线状态。传入时，之前已经定位过的标注直接使用保存的结果，只定位新增的标注。
+    :param book_hash: 书籍文件的哈希，使用 state 时必须提供。
+    :param boundary_index: 可选，已经为这本书建好的边界索引，不传时在这里构建。
+    :return: (ans, unmatched, locate_stats)，ans 为写入 pre_correction.json 的列表，
+             unmatched 为未能定位的标注。
+    """
+    total_chars = len(text)
+
+    search_window = int(search_window_in_percentage * total_chars)
+
+    known_matches = None
+    if state is not None:
+        located = state.get_stage(book_hash, STAGE_LOCATED)
+        keys = [clipping_key(clipping) for clipping in clippings]
+        known_matches = [located.get(key) for key in keys]
+        known_count = sum(match is not None for match in known_matches)
+        print(f"{known_count} 条标注之前已经定位过，需要定位 {len(clippings) - known_count} 条新的标注。")
+
+    matches, locate_stats = locate_clippings(text, clippings, locations, search_window, max_edit_ratio, known_matches=known_matches)
+
+    if state is not None:
+        state.put_stage(book_hash, STAGE_LOCATED, {keys[i]: match for i, match in enumerate(matches)
+                                                   if match is not None and known_matches[i] is None})
+
+    print(f"定位过程共扫描 {locate_stats['scanned_chars']} 个字符，"
+          f"固定窗口的方法需要扫描约 {len(clippings) * (2 * search_window)} 个字符。")
+
+    if boundary_index is None:
+        boundary_index = BoundaryIndex(text)
+
+    ans = []
+    unmatched = []
+
+    for i, clipping in enumerate(clippings):
+
+        match = matches[i]
+
+        if match is None:
+            unmatched.append({'id': i, 'location_start': clipping['location_start'], 'text': clipping['text']})
+            continue
+
+        pos = (match['start'], match['end'])
+
+        sentence_start, sentence_end, sentence_text = find_sentences_by_range(text, pos, boundary_index)
+        paragraph_start, paragraph_end, paragraph_text = find_paragraph_by_range(text, pos, boundary_index)
+
+        item = {
+            'id' : i,
+            'location_start' : clipping['location_start'],
+            'position_start' : pos[0],
+            'position_end' : pos[1],
+            # 非精确匹配时，使用原文中的文本，保证后续校正时与原文一致
+            'text' : text[pos[0]:pos[1]],
+            'match_confidence' : match['confidence'],
+            'sentence' : {
+                'start' : sentence_start,
+                'end' : sentence_end,
+                'text' : sentence_text
+            },
+            'paragraph' : {
+                'start' : paragraph_start,
+                'end' : paragraph_end,
+                'text' : paragraph_text 
+            }
+        }
+        if item['text'] != clipping['text']:
+            item['clipping_text'] = clipping['text']
+
+        ans.append(item)
+
+    if merge_overlapping:
+        ans, merge_stats = merge_located_clippings(text, ans, boundary_index)
+        locate_stats['merged'] = merge_stats['before'] - merge_stats['after']
+        print(f"合并了 {merge_stats['duplicates']} 条重复的标注和 {merge_stats['overlapping']} 条范围重叠的标注，"
+              f"剩余 {merge_stats['after']} 条。")
+
+    if unmatched:
+        print(f"\n有 {len(unmatched)} 条标注未能在源文件中找到匹配的文本，已跳过：")
+        for clipping in unmatched:
+            print(f"  id {clipping['id']}，位置 #{clipping['location_start']}: {clipping['text'][:50]}")
+        print("请手动检查，或者设置更大的 search_window_in_percentage。")
+    else:
+        print("所有标注文本已成功定位。")
+
+    return ans, unmatched, locate_stats
+
+
+def _safe_file_name(title : str):
+    """
+    把书名转换为可以作为文件名的字符串。
+    """
+    return re.sub(r'[\\/:*?"<>|\s]+', '_', title).strip('_') or 'untitled'
+
+
+def process_library_book(title : str, clippings : list, book_settings : dict, output_dir : str, state_settings : dict = None):
+    """
+    书库模式下处理一本书，在子进程中运行。
+
+    :param title: 标注文件中的书名。
+    :param clippings: 这本书的标注列表。
+    :param book_settings: 清单中这本书的设置，必须包含 book_path。
+    :param output_dir: 未指定 pre_correction_json_path 时的输出目录。
+    :param state_settings: 配置文件中的 pipeline_state 字段。
+    :return: 这本书的统计信息。
+    """
+    started_at = time.perf_counter()
+
+    text = load_book(book_settings["book_path"], book_settings.get("book_encoding"))
+    state = open_pipeline_state(state_settings)
+    book_hash = hash_file(book_settings["book_path"]) if state is not None else None
+    loaded_at = time.perf_counter()
+
+    ans, unmatched, locate_stats = build_pre_correction(
+        text,
+        clippings,
+        book_settings.get("locations"),
+        book_settings.get("search_window_in_percentage", 0.05),
+        book_settings.get("max_edit_ratio", 0.1),
+        book_settings.get("merge_overlapping", True),
+        state,
+        book_hash
+    )
+
+    if state is not None:
+        state.close()
+
+    output_path = book_settings.get("pre_correction_json_path") or os.path.join(output_dir, _safe_file_name(title) + ".pre_correction.json")
+    with open(output_path, 'w', encoding='utf-8') as json_file:
+        json.dump(ans, json_file, ensure_ascii=False, indent=4)
+
+    finished_at = time.perf_counter()
+
+    return {
+        'title': title,
+        'book_path': book_settings["book_path"],
+        'pre_correction_json_path': output_path,
+        'clippings': len(clippings),
+        'matched': len(ans),
+        'unmatched': len(unmatched),
+        'match_rate': round(len(ans) / len(clippings), 4) if clippings else 0,
+        'anchors': locate_stats['anchors'],
+        'scanned_chars': locate_stats['scanned_chars'],
+        'merged': locate_stats.get('merged', 0),
+        'load_seconds': round(loaded_at - started_at, 3),
+        'locate_seconds': round(finished_at - loaded_at, 3),
+    }
+
+
+def locate_library(clipping_json : dict, manifest : dict, output_dir : str, max_workers : int = None, state_settings : dict = None):
+    """
+    书库模式：按清单同时处理多本书，每本书在一个独立的进程中定位。
+
+    清单的格式为 {书名: {"book_path": ..., "locations": ..., "search_window_in_percentage": ...,
+    "max_edit_ratio": ..., "pre_correction_json_path": ...}}，除 book_path 外都可以省略。
+
+    :param clipping_json: grouped_clippings.json 的内容。
+    :param manifest: 书名到书籍设置的清单。
+    :param output_dir: 默认的输出目录。
+    :param max_workers: 最大进程数，默认为CPU核数。
+    :param state_settings: 配置文件中的 pipeline_state 字段，每个进程各自打开状态存储。
+    :return: 每本书的统计信息列表，顺序与清单一致。
+    """
+    os.makedirs(output_dir, exist_ok=True)
+
+    summaries = {}
+    futures = {}
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for title, book_settings in manifest.items():
+            if title not in clipping_json:
+                print(f"错误: 在标注文件中未找到书名 '{title}' 的标注，已跳过。")
+                summaries[title] = {'title': title, 'error': 'no_clippings'}
+                continue
+            futures[title] = executor.submit(process_library_book, title, clipping_json[title], book_settings, output_dir, state_settings)
+
+        for title, future in futures.items():
+            try:
+                summaries[title] = future.result()
+                print(f"《{title}》处理完成，匹配率 {summaries[title]['match_rate']:.2%}。")
+            except Exception as e:
+                print(f"错误: 处理《{title}》时失败。错误信息: {e}")
+                summaries[title] = {'title': title, 'error': str(e)}
+
+    return [summaries[title] for title in manifest]
+
+
 if __name__ == "__main__":
 
+    parser = argparse.ArgumentParser(description="定位标注在txt原文中的位置，以及其所在的句子和段落。")
+    parser.add_argument("--manifest", help="书库模式：书名到书籍文件的清单，同时处理清单中的所有书。")
+    parser.add_argument("--workers", type=int, default=None, help="书库模式下的最大进程数，默认为CPU核数。")
+    parser.add_argument("--output-dir", default="pre_corrections", help="书库模式下的输出目录。")
+    parser.add_argument("--summary", default="library_summary.json", help="书库模式下的汇总文件路径。")
+    args = parser.parse_args()
 
     # 读取配置文件
     if not os.path.exists('config.json'):
@@ -145,23 +338,44 @@ if __name__ == "__main__":
 
     clipping_json_path = config["clippings_to_pre_correction"]["clipping_json_path"]
 
-    book_title_in_clipping = config["clippings_to_pre_correction"]["book_title_in_clipping"]
-
-    book_path = config["clippings_to_pre_correction"]["book_path"]
-
     with open(clipping_json_path , "r" ,encoding="utf-8" ) as f :
         clipping_json = json.load(f)
 
-    with open(book_path,"r",encoding="utf-8") as f :
-        text = f.read()
+    if args.manifest:
+        with open(args.manifest, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
 
-    total_chars = len(text)
+        started_at = time.perf_counter()
+        with metrics.stage("locate"):
+            summaries = locate_library(clipping_json, manifest, args.output_dir, args.workers, config.get("pipeline_state"))
+
+        # 各本书在子进程中定位，指标只能从汇总信息中取回
+        for book_summary in summaries:
+            if 'scanned_chars' in book_summary:
+                metrics.inc("locate_scanned_chars_total", book_summary['scanned_chars'])
+                metrics.inc("locate_clippings_total", book_summary['matched'], method="matched")
+                metrics.inc("locate_clippings_total", book_summary['unmatched'], method="unmatched")
+
+        summary = {
+            'books': summaries,
+            'total_seconds': round(time.perf_counter() - started_at, 3)
+        }
+        with open(args.summary, 'w', encoding='utf-8') as json_file:
+            json.dump(summary, json_file, ensure_ascii=False, indent=4)
 
-    total_locs = config["clippings_to_pre_correction"]["locations"]["end"]
+        print(f"书库处理完成，共 {len(summaries)} 本书，用时 {summary['total_seconds']} 秒，汇总已保存到 '{args.summary}'。")
+        metrics.export(config.get("metrics"))
+        exit(0)
 
-    start_locs = config["clippings_to_pre_correction"]["locations"]["start"]
+    book_title_in_clipping = config["clippings_to_pre_correction"]["book_title_in_clipping"]
+
+    book_path = config["clippings_to_pre_correction"]["book_path"]
 
-    search_window = int(config["clippings_to_pre_correction"]["search_window_in_percentage"] * total_chars)
+    text = load_book(book_path, config["clippings_to_pre_correction"].get("book_encoding"))
+
+    # 可选的流水线状态，只定位新增的标注
+    pipeline_state = open_pipeline_state(config.get("pipeline_state"))
+    book_hash = hash_file(book_path) if pipeline_state is not None else None
 
     select_clipping = clipping_json[book_title_in_clipping] if book_title_in_clipping in clipping_json else None
 
@@ -171,54 +385,27 @@ if __name__ == "__main__":
     
     print(f"正在处理书名: '{book_title_in_clipping}' 的标注...")
 
-    pos = []
-
-    for clipping in select_clipping:
-
-        pos_c = find_text_in_source_txt(clipping, text, total_chars, total_locs, start_locs, search_window)
-
-        pos.append(pos_c)
-
+    metrics_settings = config.get("metrics") or {}
 
-    if None in pos:
-        print("错误: 在源文件中未能找到所有标注的匹配文本。")
-        print("请手动检查，或者设置更大的 search_window_in_percentage。")
-        exit(1)
-
-    print("所有标注文本已成功定位。")
-
-    ans = []
-    for i in range(len(pos)):
-
-        sentence_start, sentence_end, sentence_text = find_sentences_by_range(text, pos[i])
-        paragraph_start, paragraph_end, paragraph_text = find_paragraph_by_range(text, pos[i])
+    with metrics.stage("locate"), profile_stage("locate", metrics_settings.get("profile")):
+        ans, unmatched, locate_stats = build_pre_correction(
+            text,
+            select_clipping,
+            # locations 可以不填，此时完全依靠锚点拟合位置映射
+            config["clippings_to_pre_correction"].get("locations"),
+            config["clippings_to_pre_correction"].get("search_window_in_percentage", 0.05),
+            config["clippings_to_pre_correction"].get("max_edit_ratio", 0.1),
+            config["clippings_to_pre_correction"].get("merge_overlapping", True),
+            pipeline_state,
+            book_hash
+        )
 
-
-        ans.append({
-            'id' : i,
-            'location_start' : select_clipping[i]['location_start'],
-            'position_start' : pos[i][0],
-            'position_end' : pos[i][1],
-            'text' : select_clipping[i]['text'],
-            'sentence' : {
-                'start' : sentence_start,
-                'end' : sentence_end,
-                'text' : sentence_text
-            },
-            'paragraph' : {
-                'start' : paragraph_start,
-                'end' : paragraph_end,
-                'text' : paragraph_text 
-            }
-        })
+    if pipeline_state is not None:
+        pipeline_state.close()
 
     pre_correction_json_path = config["clippings_to_pre_correction"]["pre_correction_json_path"]
 
     with open(pre_correction_json_path,'w', encoding='utf-8') as json_file:
         json.dump(ans, json_file, ensure_ascii=False, indent=4)
 
-
-
-
-
-
+    metrics.export(metrics_settings)
@@ -0,0 +1,115 @@
+import os
+import json
+import hashlib
+import threading
+
+
+class CorrectionJournal:
+    """
+    只追加的批处理日志（JSONL）。
+
+    每完成一批请求，就把这一批通过校验的结果追加到日志末尾并立即 fsync，
+    程序崩溃或被中断后，可以通过 --resume 重放日志，跳过已经完成的任务。
+
+    第一行是文件头，记录输入的任务列表的哈希，输入变化后旧日志不再使用。
+    之后每一行对应一批结果，格式为 {"phase": 阶段名, "results": [...]}。
+    """
+
+    def __init__(self, path : str, input_hash : str, resume : bool = False):
+        self.path = path
+        self.input_hash = input_hash
+        self.lock = threading.Lock()
+        # phase -> {id: 结果}
+        self.completed = {}
+
+        if resume and os.path.exists(path):
+            self._replay()
+        else:
+            self._start()
+
+    def _start(self):
+        with open(self.path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({"input_hash": self.input_hash}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _replay(self):
+        with open(self.path, 'rb') as f:
+            data = f.read()
+
+        # 最后一行可能在写入时被中断。截断到最后一个完整的行，
+        # 否则之后追加的内容会接在这半行后面，下次恢复时又无法解析
+        complete_end = data.rfind(b"\n") + 1
+        if complete_end < len(data):
+            print("日志的最后一行在写入时被中断，已截断。")
+            with open(self.path, 'r+b') as f:
+                f.truncate(complete_end)
+                f.flush()
+                os.fsync(f.fileno())
+        lines = data[:complete_end].decode('utf-8', errors='replace').splitlines()
+
+        try:
+            header = json.loads(lines[0])
+        except (IndexError, ValueError):
+            header = {}
+
+        if header.get("input_hash") != self.input_hash:
+            print(f"日志 '{self.path}' 与当前的输入文件不一致，将从头开始处理。")
+            self._start()
+            return
+
+        replayed = 0
+        for line in lines[1:]:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                print("日志中有一行无法解析，已忽略。")
+                continue
+            phase_results = self.completed.setdefault(record["phase"], {})
+            for result in record["results"]:
+                phase_results[str(result["id"])] = result
+                replayed += 1
+
+        print(f"已从日志 '{self.path}' 中恢复 {replayed} 条校对结果。")
+
+    def get_completed(self, phase : str):
+        """
+        返回某一阶段已完成的结果，格式为 {id: 结果}。
+        """
+        return self.completed.get(phase, {})
+
+    def append(self, phase : str, results : list):
+        """
+        追加一批已完成的结果，并在返回前写入磁盘。
+        """
+        if not results:
+            return
+        line = json.dumps({"phase": phase, "results": results}, ensure_ascii=False)
+        with self.lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            phase_results = self.completed.setdefault(phase, {})
+            for result in results:
+                phase_results[str(result["id"])] = result
+
+
+def hash_file(file_path : str):
+    """
+    计算文件内容的 sha256。
+    """
+    sha = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def hash_data(data):
+    """
+    计算可以序列化为JSON的数据的 sha256，与字段顺序和缩进无关。
+    流水线在内存中传递任务列表时，用它代替 hash_file 作为日志的输入哈希。
+    """
+    source = json.dumps(data, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(source.encode('utf-8')).hexdigest()
@@ -0,0 +1,398 @@
+import os
+import re
+import json
+import glob
+import hashlib
+import tempfile
+
+# Kindle 上标注文件相对于存储根目录的路径
+CLIPPINGS_RELATIVE_PATH = ("documents", "My Clippings.txt")
+
+# 校验本地文件仍是设备上文件的前缀时，比较的开头和结尾的字节数
+SIGNATURE_SIZE = 4096
+
+# 挂载点的常见位置：Linux 的 U 盘挂载、gvfs 挂载的 MTP 设备，以及 macOS。
+# /mnt 下通常是网络共享或其他磁盘，不自动查找，手动挂载的 Kindle 用 --mount-root 指定
+DEFAULT_MOUNT_PATTERNS = [
+    "/media/*/*",
+    "/run/media/*/*",
+    "/run/user/*/gvfs/*",
+    "/Volumes/*",
+]
+
+
+def _sha256(data : bytes):
+    return hashlib.sha256(data).hexdigest()
+
+
+class KindleDevice:
+    """
+    一台已连接的 Kindle，只提供读取 'My Clippings.txt' 需要的操作。
+
+    supports_partial_read 为 True 的设备可以从任意偏移读取，同步时只下载末尾新增的部分；
+    否则每次只能下载整个文件。
+    """
+
+    supports_partial_read = False
+
+    def __init__(self, device_id : str, name : str):
+        self.id = device_id
+        self.name = name
+
+    def stat(self):
+        """
+        :return: 标注文件的 (字节数, 修改时间)，设备无法提供的项为 None；找不到文件时返回 None。
+        """
+        raise NotImplementedError
+
+    def read(self, offset : int = 0, length : int = None):
+        """
+        读取标注文件从 offset 开始的 length 个字节，length 为 None 时读到末尾。
+        不支持部分读取的设备只接受 offset 为 0、length 为 None。
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class MountedDevice(KindleDevice):
+    """
+    以文件系统方式挂载的 Kindle：U 盘模式的盘符或挂载点，或者 gvfs / jmtpfs 等工具挂载的 MTP 设备。
+    """
+
+    supports_partial_read = True
+
+    def __init__(self, root : str, clippings_path : str):
+        super().__init__(os.path.abspath(root), os.path.basename(os.path.normpath(root)) or root)
+        self.clippings_path = clippings_path
+
+    def stat(self):
+        try:
+            status = os.stat(self.clippings_path)
+        except OSError:
+            return None
+        return status.st_size, status.st_mtime
+
+    def read(self, offset : int = 0, length : int = None):
+        with open(self.clippings_path, 'rb') as f:
+            f.seek(offset)
+            return f.read() if length is None else f.read(length)
+
+
+def find_clippings_path(root : str):
+    """
+    在挂载点下查找标注文件，documents 文件夹的大小写不敏感。
+    MTP 挂载时存储根目录（例如 "Internal Storage"）位于挂载点下一层，也一并查找。
+    """
+    candidates = [root]
+    try:
+        candidates += [os.path.join(root, child) for child in sorted(os.listdir(root))]
+    except OSError:
+        return None
+
+    for storage in candidates:
+        try:
+            children = os.listdir(storage)
+        except OSError:
+            continue
+        for child in children:
+            if child.lower() != CLIPPINGS_RELATIVE_PATH[0]:
+                continue
+            clippings_path = os.path.join(storage, child, CLIPPINGS_RELATIVE_PATH[1])
+            if os.path.isfile(clippings_path):
+                return clippings_path
+    return None
+
+
+class DeviceBackend:
+    """
+    查找某一类连接方式下的所有 Kindle。
+    """
+
+    name = "base"
+
+    def list_devices(self):
+        raise NotImplementedError
+
+
+class MountedBackend(DeviceBackend):
+    """
+    在挂载点中查找带有 documents/My Clippings.txt 的设备，可以在 Linux、macOS 上运行，
+    Windows 下 U 盘模式的旧款 Kindle 也会以盘符出现。
+    """
+
+    name = "mounted"
+
+    def __init__(self, roots : list = None):
+        """
+        :param roots: 挂载点列表，默认按 DEFAULT_MOUNT_PATTERNS 查找，Windows 下还会检查所有盘符。
+        """
+        self.roots = roots
+
+    def candidate_roots(self):
+        if self.roots:
+            return list(self.roots)
+        roots = []
+        for pattern in DEFAULT_MOUNT_PATTERNS:
+            roots.extend(sorted(glob.glob(pattern)))
+        if os.name == "nt":
+            roots.extend(f"{letter}:\\" for letter in "DEFGHIJKLMNOPQRSTUVWXYZ" if os.path.exists(f"{letter}:\\"))
+        return roots
+
+    def list_devices(self):
+        devices = []
+        for root in self.candidate_roots():
+            clippings_path = find_clippings_path(root)
+            if clippings_path:
+                devices.append(MountedDevice(root, clippings_path))
+        return devices
+
+
+class WPDDevice(KindleDevice):
+    """
+    通过 Windows Portable Devices（mtp 库）访问的 Kindle。WPD 只能下载整个文件，不支持部分读取。
+    """
+
+    def __init__(self, device, clippings_file):
+        super().__init__(f"wpd:{device.name}:{getattr(device, 'serialnumber', '')}", device.name)
+        self.device = device
+        self.clippings_file = clippings_file
+
+    def stat(self):
+        # mtp 库的对象不一定提供大小和修改时间，没有时每次都完整下载
+        return getattr(self.clippings_file, "size", None), getattr(self.clippings_file, "date_modified", None)
+
+    def read(self, offset : int = 0, length : int = None):
+        if offset != 0 or length is not None:
+            raise ValueError("WPD 设备不支持部分读取。")
+        # 与原来一样只传文件名，mtp 库会把文件下载到当前目录，因此先切换到临时目录
+        temp_dir = tempfile.mkdtemp()
+        temp_path = os.path.join(temp_dir, CLIPPINGS_RELATIVE_PATH[1])
+        cwd = os.getcwd()
+        try:
+            os.chdir(temp_dir)
+            try:
+                self.clippings_file.download_file(CLIPPINGS_RELATIVE_PATH[1])
+            finally:
+                os.chdir(cwd)
+            with open(temp_path, 'rb') as f:
+                return f.read()
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            os.rmdir(temp_dir)
+
+    def close(self):
+        self.device.close()
+
+
+class WPDBackend(DeviceBackend):
+    """
+    通过 mtp 库（仅Windows）查找 Kindle，安装方法见 readme 附录。
+    """
+
+    name = "wpd"
+
+    def list_devices(self):
+        try:
+            import mtp.win_access as mtp_access
+        except ImportError:
+            print("未安装 mtp 库，跳过 MTP 设备。")
+            return []
+
+        print("正在通过 MTP 查找 Kindle 设备...")
+        devices = []
+        for dev in mtp_access.get_portable_devices():
+            # 使用 "Kindle" 或 "Scribe" 进行更可靠的识别
+            if "Kindle" not in dev.name and "Scribe" not in dev.name:
+                continue
+            print(f"找到设备: 名称: {dev.name}, 描述: {dev.description}")
+
+            clippings_file = None
+            # Kindle 的 MTP 路径通常不包含 "Internal Storage" 这层，而是直接是存储根
+            for storage in dev.get_content():
+                document_folder = storage.get_child(CLIPPINGS_RELATIVE_PATH[0])
+                if document_folder and document_folder.content_type == mtp_access.WPD_CONTENT_TYPE_DIRECTORY:
+                    candidate = document_folder.get_child(CLIPPINGS_RELATIVE_PATH[1])
+                    if candidate and candidate.content_type == mtp_access.WPD_CONTENT_TYPE_FILE:
+                        clippings_file = candidate
+                        break
+
+            if clippings_file is None:
+                print(f"错误: 未在设备 {dev.name} 上找到 'documents/My Clippings.txt'。")
+                dev.close()
+                continue
+            devices.append(WPDDevice(dev, clippings_file))
+        return devices
+
+
+class FakeDevice(KindleDevice):
+    """
+    内存中的假设备，用于在没有 Kindle 的环境下测试同步逻辑。
+    append 模拟 Kindle 在文件末尾追加标注，bytes_read 记录一共读取了多少字节。
+    """
+
+    def __init__(self, name : str, data : bytes = b"", mtime : float = 0.0, supports_partial_read : bool = True):
+        super().__init__(f"fake:{name}", name)
+        self.data = data
+        self.mtime = mtime
+        self.supports_partial_read = supports_partial_read
+        self.bytes_read = 0
+
+    def append(self, data : bytes):
+        self.data += data
+        self.mtime += 1
+
+    def rewrite(self, data : bytes):
+        self.data = data
+        self.mtime += 1
+
+    def stat(self):
+        return len(self.data), self.mtime
+
+    def read(self, offset : int = 0, length : int = None):
+        if not self.supports_partial_read and (offset != 0 or length is not None):
+            raise ValueError("该设备不支持部分读取。")
+        end = len(self.data) if length is None else offset + length
+        data = self.data[offset:end]
+        self.bytes_read += len(data)
+        return data
+
+
+class FakeBackend(DeviceBackend):
+
+    name = "fake"
+
+    def __init__(self, devices : list):
+        self.devices = devices
+
+    def list_devices(self):
+        return list(self.devices)
+
+
+def find_devices(backends : list):
+    """
+    依次用各个后端查找设备，同一台设备只保留第一次找到的。
+    """
+    devices = []
+    seen = set()
+    for backend in backends:
+        for device in backend.list_devices():
+            if device.id not in seen:
+                seen.add(device.id)
+                devices.append(device)
+    return devices
+
+
+def make_backends(backend_names : list, mount_roots : list = None):
+    """
+    按名称创建后端，"auto" 表示先查找挂载的设备，Windows 下再通过 MTP 查找。
+    """
+    backends = []
+    for backend_name in backend_names:
+        if backend_name in ("auto", "mounted"):
+            backends.append(MountedBackend(mount_roots))
+        if backend_name == "wpd" or (backend_name == "auto" and os.name == "nt"):
+            backends.append(WPDBackend())
+    return backends
+
+
+def load_sync_state(state_path : str):
+    if not os.path.exists(state_path):
+        return {}
+    try:
+        with open(state_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (IOError, ValueError) as e:
+        print(f"同步记录 '{state_path}' 无法读取，将完整下载。错误信息: {e}")
+        return {}
+
+
+def save_sync_state(state_path : str, state : dict):
+    with open(state_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=4)
+
+
+def _file_signature(local_path : str):
+    """
+    本地文件的大小，以及开头和结尾 SIGNATURE_SIZE 个字节的哈希。
+    """
+    size = os.path.getsize(local_path)
+    with open(local_path, 'rb') as f:
+        head = f.read(min(SIGNATURE_SIZE, size))
+        tail_start = max(0, size - SIGNATURE_SIZE)
+        f.seek(tail_start)
+        tail = f.read(size - tail_start)
+    return size, _sha256(head), _sha256(tail)
+
+
+def sync_clippings_file(device : KindleDevice, local_path : str, state : dict):
+    """
+    把设备上的 'My Clippings.txt' 同步到 local_path。
+
+    设备上文件的大小和修改时间与上次同步时相同时不下载。Kindle 只会在文件末尾追加，
+    因此设备支持部分读取、且设备上文件的开头和原来末尾的一段与本地文件相同时，只下载新增的部分追加到本地；
+    其他情况（文件被改写、设备不支持部分读取）下载整个文件。
+
+    :param state: 同步记录，按设备 id 保存上次的大小、修改时间和哈希，会被就地更新。
+    :return: (local_path, 同步方式)，同步方式为 "unchanged"、"appended" 或 "full"；找不到文件时返回 None。
+    """
+    remote = device.stat()
+    if remote is None:
+        print(f"错误: 未在设备 {device.name} 上找到 'My Clippings.txt'。")
+        return None
+    size, mtime = remote
+
+    previous = state.get(device.id)
+    local_size = os.path.getsize(local_path) if os.path.exists(local_path) else None
+    local_matches = previous is not None and local_size == previous["size"]
+
+    mode = "full"
+    if local_matches and size is not None and size == previous["size"] and mtime is not None and mtime == previous["mtime"]:
+        mode = "unchanged"
+    elif local_matches and device.supports_partial_read and size is not None and size >= local_size:
+        tail_start = max(0, local_size - SIGNATURE_SIZE)
+        head = device.read(0, min(SIGNATURE_SIZE, local_size))
+        tail = device.read(tail_start, local_size - tail_start)
+        if _sha256(head) == previous["head_hash"] and _sha256(tail) == previous["tail_hash"]:
+            mode = "appended"
+        else:
+            print(f"设备 {device.name} 上的标注文件已被改写，将完整下载。")
+
+    if mode == "appended":
+        appended = device.read(local_size)
+        with open(local_path, 'ab') as f:
+            f.write(appended)
+        print(f"设备 {device.name}: 下载了新增的 {len(appended)} 字节。")
+        if not appended:
+            mode = "unchanged"
+    elif mode == "full":
+        data = device.read()
+        # 先写临时文件再替换，下载中断时不会留下不完整的文件
+        temp_path = local_path + ".tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, local_path)
+        print(f"设备 {device.name}: 下载了整个文件，共 {len(data)} 字节。")
+    else:
+        print(f"设备 {device.name}: 标注文件没有变化，跳过下载。")
+
+    local_size, head_hash, tail_hash = _file_signature(local_path)
+    state[device.id] = {
+        "name": device.name,
+        "size": local_size,
+        "mtime": mtime,
+        "head_hash": head_hash,
+        "tail_hash": tail_hash,
+        "local_path": local_path
+    }
+    return local_path, mode
+
+
+def device_directory(device : KindleDevice, base_dir : str = "devices"):
+    """
+    同时连接多台设备时，每台设备的文件保存在各自的文件夹中。
+    """
+    safe_name = re.sub(r'[^\w.-]+', '_', device.name).strip('_') or "kindle"
+    return os.path.join(base_dir, f"{safe_name}_{_sha256(device.id.encode('utf-8'))[:8]}")
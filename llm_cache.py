@@ -0,0 +1,119 @@
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+
+class LLMCache:
+    """
+    以单个任务为粒度、按内容寻址的llm返回结果缓存，保存在SQLite中。
+
+    缓存键由模型名、温度、提示词模板的哈希以及发送给llm的任务内容共同决定，
+    因此任务被重新分批后依然可以命中，而修改提示词或模型后则会自动失效。
+    """
+
+    def __init__(self, path : str = "llm_cache.sqlite", max_entries : int = None, max_age_days : float = None):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            "key TEXT PRIMARY KEY, "
+            "result TEXT NOT NULL, "
+            "created_at REAL NOT NULL, "
+            "last_used_at REAL NOT NULL)"
+        )
+        self.connection.commit()
+        self.evict()
+
+    @staticmethod
+    def make_key(llm_settings : dict, task : dict):
+        """
+        计算单个任务的缓存键。
+
+        :param llm_settings: 本轮使用的llm设置，其中 llm_model 应为实际处理请求的模型（配置了 endpoints 时见 llm_router.served_model）。
+        :param task: 经过 select_function 筛选后、实际发送给llm的任务。
+                     id 只用于对应输入输出，不影响结果，因此不参与计算。
+        """
+        task = {field: value for field, value in task.items() if field != "id"}
+        prompt_hash = hashlib.sha256(llm_settings["llm_prompt"].encode('utf-8')).hexdigest()
+        key_source = json.dumps({
+            "model": llm_settings["llm_model"],
+            "temperature": llm_settings["llm_temperature"],
+            "prompt": prompt_hash,
+            "task": task
+        }, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(key_source.encode('utf-8')).hexdigest()
+
+    def get(self, key : str):
+        """
+        读取缓存的结果，未命中时返回 None。
+        """
+        with self.lock:
+            row = self.connection.execute("SELECT result FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.connection.execute("UPDATE llm_cache SET last_used_at = ? WHERE key = ?", (time.time(), key))
+            self.connection.commit()
+        return json.loads(row[0])
+
+    def put(self, key : str, result : dict):
+        """
+        保存一个已经通过校验的任务结果。
+        """
+        now = time.time()
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, result, created_at, last_used_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(result, ensure_ascii=False), now, now)
+            )
+            self.connection.commit()
+
+    def evict(self):
+        """
+        删除超过 max_age_days 的条目，并在条目数超过 max_entries 时删除最久未使用的条目。
+        """
+        with self.lock:
+            if self.max_age_days:
+                cutoff = time.time() - self.max_age_days * 86400
+                self.connection.execute("DELETE FROM llm_cache WHERE created_at < ?", (cutoff,))
+            if self.max_entries:
+                self.connection.execute(
+                    "DELETE FROM llm_cache WHERE key IN ("
+                    "SELECT key FROM llm_cache ORDER BY last_used_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,)
+                )
+            self.connection.commit()
+
+    def stats(self):
+        """
+        返回命中、未命中次数和当前条目数。
+        """
+        with self.lock:
+            entries = self.connection.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "entries": entries}
+
+    def close(self):
+        self.evict()
+        with self.lock:
+            self.connection.close()
+
+
+def open_llm_cache(cache_settings : dict):
+    """
+    根据配置文件中的 llm_cache 字段打开缓存，未配置或未启用时返回 None。
+    """
+    if not cache_settings or not cache_settings.get("enabled", True):
+        return None
+    return LLMCache(
+        cache_settings.get("path", "llm_cache.sqlite"),
+        cache_settings.get("max_entries"),
+        cache_settings.get("max_age_days")
+    )
@@ -0,0 +1,219 @@
+import json
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import metrics, record_llm_usage
+from rate_limiter import estimate_tokens, get_rate_limiter
+
+# 可以重试的HTTP状态码：超时、限流和服务端的临时错误
+RETRYABLE_STATUS_CODES = {408, 409, 425, 429, 500, 502, 503, 504}
+
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_READ_TIMEOUT = 180
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_BACKOFF_SECONDS = 1
+DEFAULT_MAX_BACKOFF_SECONDS = 60
+
+
+class LLMRequestError(Exception):
+    """
+    请求llm失败。retryable 表示这类错误重试后可能成功（网络错误、429、5xx），
+    否则为不应重试的错误（例如 401 key无效、400 请求格式错误）。
+    """
+
+    def __init__(self, message : str, retryable : bool, status_code : int = None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.status_code = status_code
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(pool_size : int = 1):
+    """
+    获取共用的 requests.Session，同一个地址的请求复用已建立的连接（keep-alive），
+    不必每次重新握手。连接池大小与并发请求数一致，线程之间共用同一个 Session。
+    """
+    pool_size = max(1, int(pool_size))
+    with _sessions_lock:
+        if pool_size not in _sessions:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _sessions[pool_size] = session
+        return _sessions[pool_size]
+
+
+def parse_retry_after(value : str):
+    """
+    解析 Retry-After 头，支持秒数和HTTP日期两种格式，无法解析时返回 None。
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt : int, base : float, cap : float, retry_after : float = None):
+    """
+    第 attempt 次重试前的等待时间：在 [0, min(cap, base * 2^attempt)] 中随机取值（full jitter），
+    服务端给出 Retry-After 时至少等待这么久。
+    """
+    delay = random.uniform(0, min(cap, base * (2 ** attempt)))
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+
+def _send(session : requests.Session, url : str, headers : dict, payload : dict, timeout : tuple, stream : bool = False):
+    """
+    发送一次请求并把各种失败统一为 LLMRequestError。
+
+    :return: (解析后的JSON, 错误, Retry-After秒数)，成功时错误为 None；
+             stream 为 True 时成功返回的是尚未读取响应体的 response。
+    """
+    try:
+        response = session.post(url, headers=headers, json=payload, timeout=timeout, stream=stream)
+    except (requests.ConnectionError, requests.Timeout) as e:
+        return None, LLMRequestError(f"网络错误: {e}", retryable=True), None
+    except requests.RequestException as e:
+        return None, LLMRequestError(f"请求错误: {e}", retryable=False), None
+
+    if response.status_code >= 400:
+        retryable = response.status_code in RETRYABLE_STATUS_CODES
+        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+        error = LLMRequestError(f"HTTP {response.status_code}: {response.text[:200]}", retryable, response.status_code)
+        return None, error, retry_after
+
+    if stream:
+        return response, None, None
+
+    try:
+        return response.json(), None, None
+    except ValueError as e:
+        # 响应体不完整，通常是连接中途断开
+        return None, LLMRequestError(f"响应不是有效的JSON: {e}", retryable=True, status_code=response.status_code), None
+
+
+def _request_with_retry(llm_settings : dict, payload : dict, tokens : int, stream : bool):
+    """
+    按 llm_settings 中的网络设置发送请求，可重试的错误按退避策略重试。
+    """
+    url = llm_settings["llm_api_url"]
+    headers = {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {llm_settings['llm_api_key']}"
+    }
+    timeout = (llm_settings.get("connect_timeout", DEFAULT_CONNECT_TIMEOUT),
+               llm_settings.get("read_timeout", DEFAULT_READ_TIMEOUT))
+    max_retries = llm_settings.get("max_http_retries", DEFAULT_MAX_RETRIES)
+    backoff_seconds = llm_settings.get("http_backoff_seconds", DEFAULT_BACKOFF_SECONDS)
+    max_backoff_seconds = llm_settings.get("http_max_backoff_seconds", DEFAULT_MAX_BACKOFF_SECONDS)
+
+    session = get_session(llm_settings.get("max_concurrent_requests", 1))
+    rate_limiter = get_rate_limiter(llm_settings)
+
+    attempt = 0
+    while True:
+        if rate_limiter:
+            rate_limiter.acquire(tokens)
+
+        started_at = time.perf_counter()
+        response_data, error, retry_after = _send(session, url, headers, payload, timeout, stream)
+        if not stream:
+            metrics.observe("llm_request_seconds", time.perf_counter() - started_at, model=llm_settings["llm_model"])
+        if error is None:
+            return response_data
+
+        reason = str(error.status_code) if error.status_code else "network"
+        if not error.retryable or attempt >= max_retries:
+            metrics.inc("llm_request_failures_total", model=llm_settings["llm_model"], reason=reason)
+            raise error
+
+        metrics.inc("llm_http_retries_total", model=llm_settings["llm_model"], reason=reason)
+
+        delay = backoff_delay(attempt, backoff_seconds, max_backoff_seconds, retry_after)
+        print(f"请求失败（{error}），{delay:.1f} 秒后第 {attempt + 1} 次重试。")
+        time.sleep(delay)
+        attempt += 1
+
+
+def post_chat_completion(llm_settings : dict, payload : dict, tokens : int = 0):
+    """
+    向 llm_settings["llm_api_url"] 发送一次 chat completion 请求，流水线中所有的llm请求都通过这里发送。
+
+    使用共用的连接池，连接与读取分别超时（connect_timeout 默认10秒，read_timeout 默认180秒）。
+    可重试的错误按指数退避加随机抖动重试 max_http_retries 次（默认3次），
+    退避的基数为 http_backoff_seconds（默认1秒），上限为 http_max_backoff_seconds（默认60秒），
+    并遵守服务端返回的 Retry-After。每次发送前都会经过限流器。
+
+    :param tokens: 本次请求估算的token数，用于按 tokens_per_minute 限流。
+    :return: 响应的JSON。
+    :raises LLMRequestError: 遇到不可重试的错误，或重试次数用尽。
+    """
+    response_data = _request_with_retry(llm_settings, payload, tokens, stream=False)
+    if isinstance(response_data, dict) and response_data.get("usage"):
+        record_llm_usage(llm_settings, response_data["usage"])
+    return response_data
+
+
+def stream_chat_completion(llm_settings : dict, payload : dict, tokens : int = 0):
+    """
+    以流式（server-sent events）发送 chat completion 请求，逐段返回模型输出的文本。
+
+    建立连接和收到响应头之前的失败与 post_chat_completion 一样重试；
+    开始接收之后连接断开或读取超时（read_timeout 此时是两段数据之间的最长间隔）不再重试，
+    抛出 LLMRequestError，调用方可以保留已经收到的内容。
+
+    返回中没有 usage 时，按提示词和收到的文本估算token数。
+
+    :return: 生成器，每次返回一段 delta.content 文本。
+    """
+    started_at = time.perf_counter()
+    response = _request_with_retry(llm_settings, dict(payload, stream=True), tokens, stream=True)
+    usage = None
+    completion_tokens = 0
+    try:
+        for line in response.iter_lines():
+            if not line.startswith(b"data:"):
+                continue
+            data = line[len(b"data:"):].strip()
+            if data == b"[DONE]":
+                break
+            try:
+                chunk = json.loads(data)
+            except ValueError:
+                continue
+            if chunk.get("usage"):
+                usage = chunk["usage"]
+            for choice in chunk.get("choices") or []:
+                content = (choice.get("delta") or {}).get("content")
+                if content:
+                    if not completion_tokens:
+                        metrics.observe("llm_first_token_seconds", time.perf_counter() - started_at, model=llm_settings["llm_model"])
+                    completion_tokens += estimate_tokens(content)
+                    yield content
+    except requests.RequestException as e:
+        metrics.inc("llm_request_failures_total", model=llm_settings["llm_model"], reason="stream_interrupted")
+        raise LLMRequestError(f"流式响应中断: {e}", retryable=True) from e
+    finally:
+        response.close()
+        metrics.observe("llm_request_seconds", time.perf_counter() - started_at, model=llm_settings["llm_model"])
+        if usage:
+            record_llm_usage(llm_settings, usage)
+        else:
+            record_llm_usage(llm_settings, {"prompt_tokens": tokens, "completion_tokens": completion_tokens}, estimated=True)
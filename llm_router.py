@@ -0,0 +1,287 @@
+import json
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from llm_client import LLMRequestError, post_chat_completion, stream_chat_completion
+from metrics import metrics
+
+DEFAULT_HEALTH_WINDOW = 20
+DEFAULT_MIN_HEALTH_SAMPLES = 5
+DEFAULT_EJECT_ERROR_RATE = 0.5
+DEFAULT_EJECT_SECONDS = 60
+DEFAULT_HEDGE_QUANTILE = 0.95
+DEFAULT_HEDGE_MIN_SAMPLES = 20
+
+# 计算对冲延迟时保留的最近成功请求的延迟数
+LATENCY_SAMPLES = 200
+
+# 与 endpoints 中每一项合并时，不继承的本轮设置
+ROUTER_ONLY_FIELDS = ("endpoints", "hedge_requests", "hedge_quantile", "hedge_min_samples",
+                      "eject_error_rate", "eject_seconds", "health_window")
+
+
+class Endpoint:
+    """
+    一个llm服务地址：合并后的设置、权重、并发上限，以及最近请求的成败记录。
+    """
+
+    def __init__(self, settings : dict, weight : float, max_concurrent_requests : int, health_window : int):
+        self.settings = settings
+        self.name = settings.get("name") or f"{settings['llm_api_url']}#{settings['llm_model']}"
+        self.weight = weight
+        self.max_concurrent_requests = max_concurrent_requests
+        self.in_flight = 0
+        self.recent = deque(maxlen=health_window)
+        self.ejected_until = 0.0
+
+
+class LLMRouter:
+    """
+    把一轮的请求分发到多个llm服务地址。
+
+    llm_settings 中的 endpoints 是一个列表，每一项可以覆盖 llm_api_url、llm_api_key、llm_model
+    以及网络和限流设置，未填写的沿用本轮的设置；weight（默认1）是分配请求的权重，
+    max_concurrent_requests（默认1）是这个地址同时进行的最大请求数。
+
+    每个地址最近 health_window 次请求的失败比例达到 eject_error_rate 时，暂停使用 eject_seconds 秒。
+    一个请求失败后会换一个还没有试过的地址重新发送。
+    hedge_requests 为 true 时，请求用时超过最近成功请求延迟的 hedge_quantile 分位数（默认p95），
+    就再向另一个地址发送同样的请求，先返回的结果被采用。
+    """
+
+    def __init__(self, llm_settings : dict):
+        base_settings = {key: value for key, value in llm_settings.items() if key not in ROUTER_ONLY_FIELDS}
+        health_window = llm_settings.get("health_window", DEFAULT_HEALTH_WINDOW)
+
+        self.endpoints = []
+        for endpoint_settings in llm_settings["endpoints"]:
+            settings = dict(base_settings, **endpoint_settings)
+            settings.pop("weight", None)
+            max_concurrent_requests = max(1, int(endpoint_settings.get("max_concurrent_requests", 1)))
+            self.endpoints.append(Endpoint(settings, float(endpoint_settings.get("weight", 1)), max_concurrent_requests, health_window))
+
+        self.eject_error_rate = llm_settings.get("eject_error_rate", DEFAULT_EJECT_ERROR_RATE)
+        self.eject_seconds = llm_settings.get("eject_seconds", DEFAULT_EJECT_SECONDS)
+        self.hedge_requests = llm_settings.get("hedge_requests", False) and len(self.endpoints) > 1
+        self.hedge_quantile = llm_settings.get("hedge_quantile", DEFAULT_HEDGE_QUANTILE)
+        self.hedge_min_samples = llm_settings.get("hedge_min_samples", DEFAULT_HEDGE_MIN_SAMPLES)
+
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+        self.condition = threading.Condition()
+        # 每个正在进行的请求都占用一个地址的并发名额，线程数不会超过名额总数
+        self.executor = ThreadPoolExecutor(max_workers=self.total_concurrency())
+
+    def total_concurrency(self):
+        return sum(endpoint.max_concurrent_requests for endpoint in self.endpoints)
+
+    def acquire(self, exclude : list = (), block : bool = True):
+        """
+        按权重随机选择一个有空闲名额的地址，并占用一个名额。
+
+        优先选择健康的地址；未排除的地址都被暂停时也会使用被暂停的，而不是一直等待。
+        block 为 True 时等待名额释放，为 False 时没有空闲名额就返回 None。
+        所有地址都已排除时返回 None。
+        """
+        with self.condition:
+            while True:
+                candidates = [endpoint for endpoint in self.endpoints if endpoint not in exclude]
+                if not candidates:
+                    return None
+
+                now = time.monotonic()
+                healthy = [endpoint for endpoint in candidates if endpoint.ejected_until <= now]
+                available = [endpoint for endpoint in (healthy or candidates)
+                             if endpoint.in_flight < endpoint.max_concurrent_requests]
+                if available:
+                    endpoint = random.choices(available, weights=[endpoint.weight for endpoint in available])[0]
+                    endpoint.in_flight += 1
+                    return endpoint
+
+                if not block:
+                    return None
+                # 暂停到期时也需要重新选择，因此不无限等待
+                self.condition.wait(timeout=1.0)
+
+    def release(self, endpoint : Endpoint):
+        with self.condition:
+            endpoint.in_flight -= 1
+            self.condition.notify_all()
+
+    def record(self, endpoint : Endpoint, success : bool, seconds : float = None):
+        """
+        记录一次请求的结果，失败比例过高时暂停使用这个地址。
+        """
+        metrics.inc("llm_endpoint_requests_total", endpoint=endpoint.name, status="ok" if success else "error")
+        with self.condition:
+            endpoint.recent.append(success)
+            if success and seconds is not None:
+                self.latencies.append(seconds)
+
+            failures = endpoint.recent.count(False)
+            if (not success and len(endpoint.recent) >= DEFAULT_MIN_HEALTH_SAMPLES
+                    and failures / len(endpoint.recent) >= self.eject_error_rate):
+                endpoint.ejected_until = time.monotonic() + self.eject_seconds
+                endpoint.recent.clear()
+                metrics.inc("llm_endpoint_ejections_total", endpoint=endpoint.name)
+                print(f"{endpoint.name} 最近的请求有 {failures} 次失败，暂停使用 {self.eject_seconds} 秒。")
+            self.condition.notify_all()
+
+    def hedge_delay(self):
+        """
+        发送对冲请求前等待的时间：最近成功请求延迟的 hedge_quantile 分位数，样本不足时返回 None。
+        """
+        if not self.hedge_requests:
+            return None
+        with self.condition:
+            if len(self.latencies) < self.hedge_min_samples:
+                return None
+            ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(self.hedge_quantile * len(ordered)))]
+
+    def _call(self, endpoint : Endpoint, payload : dict, tokens : int):
+        """
+        向一个地址发送请求，调用前必须已经占用了这个地址的名额，结束后释放。
+        """
+        started_at = time.perf_counter()
+        try:
+            response_data = post_chat_completion(endpoint.settings, dict(payload, model=endpoint.settings["llm_model"]), tokens)
+        except LLMRequestError:
+            self.record(endpoint, False)
+            raise
+        finally:
+            self.release(endpoint)
+        self.record(endpoint, True, time.perf_counter() - started_at)
+        return response_data
+
+    def _post_hedged(self, primary : Endpoint, payload : dict, tokens : int, tried : list):
+        future = self.executor.submit(self._call, primary, payload, tokens)
+        delay = self.hedge_delay()
+        if delay is None or wait([future], timeout=delay).done:
+            return future.result()
+
+        backup = self.acquire(tried, block=False)
+        if backup is None:
+            return future.result()
+        tried.append(backup)
+        print(f"请求用时超过 {delay:.1f} 秒，同时向 {backup.name} 发送对冲请求。")
+        hedge = self.executor.submit(self._call, backup, payload, tokens)
+
+        # 采用先成功返回的结果，另一个请求在后台结束后释放名额
+        pending = {future, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for finished in done:
+                try:
+                    response_data = finished.result()
+                except LLMRequestError as e:
+                    error = e
+                    continue
+                metrics.inc("llm_hedged_requests_total", winner="hedge" if finished is hedge else "primary")
+                return response_data
+        raise error
+
+    def post(self, payload : dict, tokens : int = 0):
+        """
+        发送一次 chat completion 请求，失败时依次换用其他地址。
+
+        :raises LLMRequestError: 所有地址都失败。
+        """
+        tried = []
+        error = None
+        while True:
+            endpoint = self.acquire(tried)
+            if endpoint is None:
+                raise error or LLMRequestError("没有可用的llm地址", retryable=True)
+            tried.append(endpoint)
+            try:
+                return self._post_hedged(endpoint, payload, tokens, tried)
+            except LLMRequestError as e:
+                error = e
+                print(f"{endpoint.name} 请求失败（{e}），换用其他地址。")
+
+    def stream(self, payload : dict, tokens : int = 0):
+        """
+        以流式发送请求。流式请求不做对冲，也不换用其他地址重发，由调用方保留已收到的内容。
+        """
+        endpoint = self.acquire()
+        started_at = time.perf_counter()
+        try:
+            yield from stream_chat_completion(endpoint.settings, dict(payload, model=endpoint.settings["llm_model"]), tokens)
+        except LLMRequestError:
+            self.record(endpoint, False)
+            raise
+        else:
+            self.record(endpoint, True, time.perf_counter() - started_at)
+        finally:
+            self.release(endpoint)
+
+
+_routers = {}
+_routers_lock = threading.Lock()
+
+
+def get_router(llm_settings : dict):
+    """
+    获取本轮设置对应的路由器，同样的设置共用一个，以便共享并发名额和健康状态。
+    llm_settings 中没有 endpoints 时返回 None。
+    """
+    if not llm_settings.get("endpoints"):
+        return None
+    key = json.dumps(llm_settings, ensure_ascii=False, sort_keys=True)
+    with _routers_lock:
+        if key not in _routers:
+            _routers[key] = LLMRouter(llm_settings)
+        return _routers[key]
+
+
+def total_concurrency(llm_settings : dict):
+    """
+    本轮最多同时进行的请求数：配置了 endpoints 时为各地址名额之和，否则为 max_concurrent_requests。
+    """
+    router = get_router(llm_settings)
+    if router is not None:
+        return router.total_concurrency()
+    return max(1, int(llm_settings.get("max_concurrent_requests", 1)))
+
+
+def endpoint_models(llm_settings : dict):
+    """
+    本轮可能处理请求的所有模型：配置了 endpoints 时为各地址合并后的 llm_model，否则只有 llm_model。
+    """
+    router = get_router(llm_settings)
+    if router is None:
+        return [llm_settings["llm_model"]]
+    return [endpoint.settings["llm_model"] for endpoint in router.endpoints]
+
+
+def served_model(llm_settings : dict):
+    """
+    本轮请求实际使用的模型。配置了 endpoints 时为各地址合并后的 llm_model，
+    各地址的模型不同时返回 None，此时无法事先确定一个任务会由哪个模型处理。
+    """
+    models = set(endpoint_models(llm_settings))
+    return models.pop() if len(models) == 1 else None
+
+
+def route_chat_completion(llm_settings : dict, payload : dict, tokens : int = 0):
+    """
+    配置了 endpoints 时通过路由器发送，否则与 llm_client.post_chat_completion 相同。
+    """
+    router = get_router(llm_settings)
+    if router is None:
+        return post_chat_completion(llm_settings, payload, tokens)
+    return router.post(payload, tokens)
+
+
+def route_stream_chat_completion(llm_settings : dict, payload : dict, tokens : int = 0):
+    """
+    配置了 endpoints 时通过路由器发送，否则与 llm_client.stream_chat_completion 相同。
+    """
+    router = get_router(llm_settings)
+    if router is None:
+        return stream_chat_completion(llm_settings, payload, tokens)
+    return router.stream(payload, tokens)
@@ -0,0 +1,243 @@
+from bisect import bisect_right
+
+from metrics import metrics
+from text_matcher import find_closest, match_text
+
+# 可以作为锚点的标注的最短长度，太短的文本容易在书中多处出现
+MIN_ANCHOR_LENGTH = 12
+
+# 没有配置 locations 时，在整本书中查找的锚点数量
+WHOLE_BOOK_ANCHOR_COUNT = 4
+
+
+class LocationMapper:
+    """
+    根据已经确认的锚点 (location, 字符位置)，拟合一个单调的分段线性映射，
+    把 Kindle 的位置数换算成原文中的字符位置。
+    """
+
+    def __init__(self, anchors : list, total_chars : int):
+        """
+        :param anchors: 锚点列表 [(location, char_pos)]。
+        :param total_chars: 原文的总字符数。
+        """
+        self.total_chars = total_chars
+        self.anchors = self._monotone(sorted(set(anchors)))
+        self.locs = [loc for loc, _ in self.anchors]
+        self.positions = [pos for _, pos in self.anchors]
+
+        if len(self.anchors) >= 2 and self.locs[-1] > self.locs[0]:
+            self.slope = (self.positions[-1] - self.positions[0]) / (self.locs[-1] - self.locs[0])
+        else:
+            self.slope = None
+
+    @staticmethod
+    def _monotone(anchors : list):
+        """
+        去掉与其他锚点顺序矛盾的锚点：取 location 与字符位置都严格递增的最长子序列。
+        """
+        if not anchors:
+            return []
+
+        tails = []
+        tail_indices = []
+        previous = [-1] * len(anchors)
+        for i, (loc, pos) in enumerate(anchors):
+            # 同一个 location 只保留一个锚点
+            if i and anchors[i - 1][0] == loc:
+                continue
+            index = bisect_right(tails, pos)
+            if index and tails[index - 1] == pos:
+                continue
+            if index == len(tails):
+                tails.append(pos)
+                tail_indices.append(i)
+            else:
+                tails[index] = pos
+                tail_indices[index] = i
+            previous[i] = tail_indices[index - 1] if index else -1
+
+        result = []
+        i = tail_indices[-1]
+        while i != -1:
+            result.append(anchors[i])
+            i = previous[i]
+        return result[::-1]
+
+    def add_anchor(self, loc : float, pos : int):
+        """
+        加入一个新确认的锚点，与已有锚点顺序矛盾或 location 重复时忽略。
+        """
+        index = bisect_right(self.locs, loc)
+        if index and self.locs[index - 1] == loc:
+            return
+        if index and self.positions[index - 1] >= pos:
+            return
+        if index < len(self.locs) and self.positions[index] <= pos:
+            return
+        self.anchors.insert(index, (loc, pos))
+        self.locs.insert(index, loc)
+        self.positions.insert(index, pos)
+
+    def is_ready(self):
+        return self.slope is not None
+
+    def estimate(self, loc : float):
+        """
+        估算 location 对应的字符位置，锚点范围之外按整体斜率外推。
+        """
+        index = bisect_right(self.locs, loc)
+        if index == 0:
+            estimated = self.positions[0] + (loc - self.locs[0]) * self.slope
+        elif index == len(self.locs):
+            estimated = self.positions[-1] + (loc - self.locs[-1]) * self.slope
+        else:
+            left_loc, right_loc = self.locs[index - 1], self.locs[index]
+            left_pos, right_pos = self.positions[index - 1], self.positions[index]
+            estimated = left_pos + (loc - left_loc) / (right_loc - left_loc) * (right_pos - left_pos)
+        return int(min(max(estimated, 0), self.total_chars))
+
+
+def _select_anchor_candidates(clippings : list, anchor_count : int):
+    """
+    按 location 把标注分成 anchor_count 段，每段取最长的一条作为锚点候选，使锚点分布均匀。
+    """
+    candidates = [i for i, clipping in enumerate(clippings) if len(clipping['text']) >= MIN_ANCHOR_LENGTH]
+    candidates.sort(key=lambda i: clippings[i]['location_start'])
+    if len(candidates) <= anchor_count:
+        return candidates
+
+    selected = []
+    bucket_size = len(candidates) / anchor_count
+    for bucket in range(anchor_count):
+        bucket_items = candidates[int(bucket * bucket_size):int((bucket + 1) * bucket_size)]
+        if bucket_items:
+            selected.append(max(bucket_items, key=lambda i: len(clippings[i]['text'])))
+    return selected
+
+
+def locate_clippings(text : str,
+                     clippings : list,
+                     locations : dict = None,
+                     search_window : int = None,
+                     max_edit_ratio : float = 0.1,
+                     anchor_count : int = 32,
+                     min_window : int = 256,
+                     growth : int = 4,
+                     known_matches : list = None):
+    """
+    两阶段定位所有标注。
+
+    第一阶段：挑选分布均匀、足够长的标注，在书中查找在 search_window 范围内唯一出现的位置作为锚点。
+    配置了 locations 时只在按整体比例估算的窗口内查找，否则只取少量候选在整本书中查找。
+
+    第二阶段：用锚点拟合单调的分段线性映射，估算每条标注的字符位置，
+    从一个很小的窗口开始精确查找（多处出现时取离估算位置最近的），找不到时窗口按 growth 倍扩大，
+    直到 search_window 仍找不到时，才交给 text_matcher.match_text 做规范化、模糊和整本书查找。
+    标注按 location 顺序处理，足够长的精确匹配结果会作为新的锚点加入映射，使后续的估算越来越准；
+    第一阶段没有得到两个锚点时，这些结果先收集起来，凑够两个后再拟合映射。
+
+    :param text: 原文。
+    :param clippings: 标注列表，每条包含 'location_start' 和 'text'。
+    :param locations: 可选的 {'start', 'end'}，标注中 location_start 的最小值与最大值。
+    :param search_window: 最大的查找半径（字符数），默认为全书的 5%。
+    :param max_edit_ratio: 模糊匹配允许的最大编辑距离占标注长度的比例。
+    :param anchor_count: 锚点候选的数量。
+    :param min_window: 初始的查找半径（字符数）。
+    :param growth: 每次未找到时查找半径扩大的倍数。
+    :param known_matches: 可选，与 clippings 一一对应，之前已经定位过的结果，未定位过的为 None。
+                          已知的结果直接使用，其中足够长的精确匹配作为锚点，足够多时跳过第一阶段的查找。
+    :return: (matches, stats)，matches 与 clippings 一一对应，找不到的为 None；
+             stats 包含最终用于映射的锚点数量和扫描过的字符数（包括 match_text 中扫描的）。
+    """
+    total_chars = len(text)
+    if search_window is None:
+        search_window = max(min_window, int(total_chars * 0.05))
+
+    stats = {'anchors': 0, 'scanned_chars': 0}
+    matches = list(known_matches) if known_matches is not None else [None] * len(clippings)
+
+    def global_estimate(loc):
+        start_locs, end_locs = locations['start'], locations['end']
+        return int((loc - start_locs) / (end_locs - start_locs) * total_chars)
+
+    # --- 第一阶段：寻找锚点 ---
+    # 没有 locations 时需要在整本书中查找，只取少量锚点，其余的在第二阶段逐步加入
+    anchors = [(clippings[i]['location_start'], match['start']) for i, match in enumerate(matches)
+               if match is not None and match['confidence'] == 1.0 and len(clippings[i]['text']) >= MIN_ANCHOR_LENGTH]
+    candidates = [] if len(anchors) >= 2 else _select_anchor_candidates(clippings, anchor_count if locations else min(anchor_count, WHOLE_BOOK_ANCHOR_COUNT))
+    for i in candidates:
+        if matches[i] is not None:
+            continue
+        highlighted_text = clippings[i]['text']
+        if locations:
+            estimated_char_pos = global_estimate(clippings[i]['location_start'])
+            window_start = max(0, estimated_char_pos - search_window)
+            window_end = min(total_chars, estimated_char_pos + len(highlighted_text) + search_window)
+        else:
+            window_start, window_end = 0, total_chars
+
+        found_pos = text.find(highlighted_text, window_start, window_end)
+        stats['scanned_chars'] += (found_pos if found_pos != -1 else window_end) - window_start
+        if found_pos == -1:
+            continue
+
+        # 在其后 search_window 之内唯一出现才能作为锚点。第二阶段的窗口不超过 search_window，
+        # 更远处的重复不会被误认为这一处；没有 locations 时也不必把整本书剩下的部分再扫描一遍
+        check_end = min(window_end, found_pos + len(highlighted_text) + search_window)
+        next_pos = text.find(highlighted_text, found_pos + 1, check_end)
+        stats['scanned_chars'] += check_end - found_pos
+        if next_pos != -1:
+            continue
+
+        anchors.append((clippings[i]['location_start'], found_pos))
+        matches[i] = {'start': found_pos, 'end': found_pos + len(highlighted_text), 'confidence': 1.0, 'method': 'anchor'}
+
+    mapper = LocationMapper(anchors, total_chars)
+    print(f"找到 {len(anchors)} 个锚点，其中 {len(mapper.anchors)} 个用于拟合位置映射。")
+
+    # --- 第二阶段：用拟合的映射在小窗口内查找 ---
+    for i in sorted(range(len(clippings)), key=lambda i: clippings[i]['location_start']):
+        if matches[i] is not None:
+            continue
+
+        clipping = clippings[i]
+
+        highlighted_text = clipping['text']
+        if mapper.is_ready():
+            estimated_char_pos = mapper.estimate(clipping['location_start'])
+        elif locations:
+            estimated_char_pos = global_estimate(clipping['location_start'])
+        else:
+            estimated_char_pos = total_chars // 2
+
+        window = min(min_window, search_window)
+        while True:
+            window_start = max(0, estimated_char_pos - window)
+            window_end = min(total_chars, estimated_char_pos + len(highlighted_text) + window)
+            # 同一段文字在窗口内可能出现多次，取离估算位置最近的一处
+            found_pos = find_closest(text, highlighted_text, estimated_char_pos, window_start, window_end)
+            scanned_end = min(window_end, max(found_pos, estimated_char_pos) + len(highlighted_text)) if found_pos != -1 else window_end
+            stats['scanned_chars'] += scanned_end - window_start
+            if found_pos != -1:
+                matches[i] = {'start': found_pos, 'end': found_pos + len(highlighted_text), 'confidence': 1.0, 'method': 'exact'}
+                if len(highlighted_text) >= MIN_ANCHOR_LENGTH:
+                    if mapper.is_ready():
+                        mapper.add_anchor(clipping['location_start'], found_pos)
+                    else:
+                        # 第一阶段的锚点不足两个时，先收集起来，够用后重新拟合映射
+                        anchors.append((clipping['location_start'], found_pos))
+                        mapper = LocationMapper(anchors, total_chars)
+                break
+            if window >= search_window:
+                matches[i] = match_text(text, highlighted_text, window_start, window_end, estimated_char_pos, max_edit_ratio, stats)
+                break
+            window = min(window * growth, search_window)
+
+    stats['anchors'] = len(mapper.anchors)
+    metrics.inc("locate_scanned_chars_total", stats['scanned_chars'])
+    metrics.inc("locate_anchors_total", stats['anchors'])
+    for match in matches:
+        metrics.inc("locate_clippings_total", method=match['method'] if match is not None else "unmatched")
+
+    return matches, stats
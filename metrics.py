@@ -0,0 +1,227 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+# 请求延迟直方图的桶（秒）
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+# 计算分位数时，每个直方图最多保留的原始观测值数量
+MAX_SAMPLES = 10000
+
+
+class Metrics:
+    """
+    进程内的运行指标：计数器、直方图和各步骤的用时，可以导出为JSON报告和 Prometheus textfile。
+
+    指标以 (名称, 标签) 区分，标签是一个 dict，例如 {"model": "gemini-2.5-flash"}。
+    所有方法都是线程安全的，并发发送请求时可以直接记录。
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    @staticmethod
+    def _key(name : str, labels : dict):
+        return name, tuple(sorted((labels or {}).items()))
+
+    def inc(self, name : str, value : float = 1, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name : str, value : float, **labels):
+        with self.lock:
+            self.gauges[self._key(name, labels)] = value
+
+    def observe(self, name : str, value : float, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {"buckets": [0] * len(LATENCY_BUCKETS), "sum": 0.0, "count": 0, "samples": []}
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if value <= bound:
+                    histogram["buckets"][i] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+            if len(histogram["samples"]) < MAX_SAMPLES:
+                histogram["samples"].append(value)
+
+    @contextmanager
+    def stage(self, name : str):
+        """
+        记录一个步骤的用时，结果保存在 stage_seconds{stage=name} 中。
+        """
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.inc("stage_seconds", time.perf_counter() - started_at, stage=name)
+
+    def report(self):
+        """
+        返回可以序列化为JSON的运行报告。
+        """
+        def percentile(samples, fraction):
+            if not samples:
+                return 0.0
+            ordered = sorted(samples)
+            return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+        def entry(key, **fields):
+            name, labels = key
+            return dict(name=name, labels=dict(labels), **fields)
+
+        with self.lock:
+            return {
+                "started_at": self.started_at,
+                "finished_at": time.time(),
+                "counters": [entry(key, value=round(value, 6)) for key, value in sorted(self.counters.items())],
+                "gauges": [entry(key, value=value) for key, value in sorted(self.gauges.items())],
+                "histograms": [entry(key,
+                                     count=histogram["count"],
+                                     sum=round(histogram["sum"], 6),
+                                     p50=round(percentile(histogram["samples"], 0.5), 6),
+                                     p90=round(percentile(histogram["samples"], 0.9), 6),
+                                     p99=round(percentile(histogram["samples"], 0.99), 6),
+                                     buckets=dict(zip([str(bound) for bound in LATENCY_BUCKETS], histogram["buckets"])))
+                               for key, histogram in sorted(self.histograms.items())]
+            }
+
+    def prometheus_text(self, prefix : str = "kindle_correction_"):
+        """
+        按 Prometheus 的文本格式导出，可以交给 node_exporter 的 textfile collector。
+        """
+        def escape(value):
+            return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+        def format_labels(labels, extra=()):
+            items = list(labels) + list(extra)
+            if not items:
+                return ""
+            escaped = ",".join(f'{name}="{escape(value)}"' for name, value in items)
+            return "{" + escaped + "}"
+
+        lines = []
+        with self.lock:
+            for kind, values in (("counter", self.counters), ("gauge", self.gauges)):
+                seen = set()
+                for (name, labels), value in sorted(values.items()):
+                    if name not in seen:
+                        lines.append(f"# TYPE {prefix}{name} {kind}")
+                        seen.add(name)
+                    lines.append(f"{prefix}{name}{format_labels(labels)} {value}")
+
+            seen = set()
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                if name not in seen:
+                    lines.append(f"# TYPE {prefix}{name} histogram")
+                    seen.add(name)
+                for bound, count in zip(LATENCY_BUCKETS, histogram["buckets"]):
+                    lines.append(f"{prefix}{name}_bucket{format_labels(labels, [('le', bound)])} {count}")
+                lines.append(f"{prefix}{name}_bucket{format_labels(labels, [('le', '+Inf')])} {histogram['count']}")
+                lines.append(f"{prefix}{name}_sum{format_labels(labels)} {histogram['sum']}")
+                lines.append(f"{prefix}{name}_count{format_labels(labels)} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+    def export(self, metrics_settings : dict):
+        """
+        根据配置文件中的 metrics 字段写出JSON报告（report_path）和 Prometheus textfile（prometheus_path）。
+        """
+        if not metrics_settings:
+            return
+        report_path = metrics_settings.get("report_path")
+        if report_path:
+            with open(report_path, 'w', encoding='utf-8') as f:
+                json.dump(self.report(), f, ensure_ascii=False, indent=4)
+            print(f"运行报告已保存到 '{report_path}'。")
+
+        prometheus_path = metrics_settings.get("prometheus_path")
+        if prometheus_path:
+            # 先写临时文件再替换，避免 textfile collector 读到写了一半的文件
+            temp_path = prometheus_path + ".tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                f.write(self.prometheus_text())
+            os.replace(temp_path, prometheus_path)
+
+
+# 整个进程共用的指标
+metrics = Metrics()
+
+
+def record_llm_usage(llm_settings : dict, usage : dict, estimated : bool = False):
+    """
+    记录一次请求的token用量，并按 llm_settings 中的价格估算费用。
+
+    价格设置为 price_per_million_input_tokens / price_per_million_output_tokens（每百万token的价格），
+    未设置时只记录token数。estimated 表示用量是本地估算的（例如流式返回中没有 usage）。
+    """
+    model = llm_settings["llm_model"]
+    prompt_tokens = usage.get("prompt_tokens", 0) or 0
+    completion_tokens = usage.get("completion_tokens", 0) or 0
+    source = "estimated" if estimated else "reported"
+    metrics.inc("llm_prompt_tokens_total", prompt_tokens, model=model, source=source)
+    metrics.inc("llm_completion_tokens_total", completion_tokens, model=model, source=source)
+
+    input_price = llm_settings.get("price_per_million_input_tokens")
+    output_price = llm_settings.get("price_per_million_output_tokens")
+    if input_price or output_price:
+        cost = (prompt_tokens * (input_price or 0) + completion_tokens * (output_price or 0)) / 1e6
+        metrics.inc("llm_cost_total", cost, model=model)
+
+
+@contextmanager
+def profile_stage(name : str, profile_settings : dict = None):
+    """
+    可选地对一个步骤做 cProfile 和 tracemalloc 分析。
+
+    profile_settings 为配置文件中 metrics.profile 字段：cprofile 为 true 时把结果保存为
+    <output_dir>/<name>.prof（可用 snakeviz 或 pstats 查看）；tracemalloc 为 true 时记录内存峰值，
+    并把分配最多的位置保存为 <output_dir>/<name>.tracemalloc.txt。
+    """
+    profile_settings = profile_settings or {}
+    use_cprofile = profile_settings.get("cprofile", False)
+    use_tracemalloc = profile_settings.get("tracemalloc", False)
+    if not use_cprofile and not use_tracemalloc:
+        yield
+        return
+
+    output_dir = profile_settings.get("output_dir", "profiles")
+    os.makedirs(output_dir, exist_ok=True)
+
+    profiler = None
+    if use_cprofile:
+        import cProfile
+        profiler = cProfile.Profile()
+    if use_tracemalloc:
+        import tracemalloc
+        tracemalloc.start()
+    if profiler is not None:
+        profiler.enable()
+
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profile_path = os.path.join(output_dir, f"{name}.prof")
+            profiler.dump_stats(profile_path)
+            print(f"{name} 的 cProfile 结果已保存到 '{profile_path}'。")
+
+        if use_tracemalloc:
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            metrics.set_gauge("peak_memory_bytes", peak, stage=name)
+            tracemalloc_path = os.path.join(output_dir, f"{name}.tracemalloc.txt")
+            with open(tracemalloc_path, 'w', encoding='utf-8') as f:
+                f.write(f"peak: {peak} bytes\n")
+                for stat in snapshot.statistics("lineno")[:30]:
+                    f.write(f"{stat}\n")
+            print(f"{name} 的内存峰值为 {peak / (1 << 20):.1f} MiB，详细结果已保存到 '{tracemalloc_path}'。")
@@ -0,0 +1,226 @@
+# 本地的 OpenAI 兼容模拟服务器，用于在不调用真实API的情况下测试和评测校对流程
+
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MockLLMSettings:
+    """
+    模拟服务器的行为设置，各种比例都是每个请求独立抽样的概率。
+    """
+
+    def __init__(self,
+                 latency_median : float = 1.0,
+                 latency_sigma : float = 0.5,
+                 seconds_per_task : float = 0.05,
+                 rate_429 : float = 0.0,
+                 rate_500 : float = 0.0,
+                 malformed_rate : float = 0.0,
+                 truncated_rate : float = 0.0,
+                 reorder_rate : float = 0.0,
+                 drop_rate : float = 0.0,
+                 correction_rate : float = 0.1,
+                 retry_after : float = 1.0,
+                 seed : int = None):
+        """
+        :param latency_median: 每个请求固定延迟的中位数（秒），按对数正态分布抽样。
+        :param latency_sigma: 对数正态分布的 sigma，0 表示固定延迟。
+        :param seconds_per_task: 每个任务额外增加的延迟（秒），模拟输出越长越慢。
+        :param rate_429: 返回 429 的概率，带 Retry-After 头。
+        :param rate_500: 返回 500 的概率。
+        :param malformed_rate: 返回无法解析的内容的概率。
+        :param truncated_rate: 输出在中途被截断的概率。
+        :param reorder_rate: 打乱结果顺序的概率。
+        :param drop_rate: 每个结果被遗漏的概率。
+        :param correction_rate: 每个结果被标记为已修正的概率。
+        :param retry_after: 429 响应中 Retry-After 的秒数。
+        :param seed: 随机数种子。
+        """
+        self.latency_median = latency_median
+        self.latency_sigma = latency_sigma
+        self.seconds_per_task = seconds_per_task
+        self.rate_429 = rate_429
+        self.rate_500 = rate_500
+        self.malformed_rate = malformed_rate
+        self.truncated_rate = truncated_rate
+        self.reorder_rate = reorder_rate
+        self.drop_rate = drop_rate
+        self.correction_rate = correction_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+        # 收到的请求数与各类响应的计数
+        self.stats = {"requests": 0, "429": 0, "500": 0, "malformed": 0, "truncated": 0, "ok": 0}
+
+    def chance(self, rate : float):
+        with self.lock:
+            return self.random.random() < rate
+
+    def latency(self, task_count : int):
+        with self.lock:
+            base = self.latency_median * self.random.lognormvariate(0, self.latency_sigma) if self.latency_sigma else self.latency_median
+        return base + self.seconds_per_task * task_count
+
+    def count(self, key : str):
+        with self.lock:
+            self.stats[key] += 1
+
+
+def extract_tasks(prompt : str):
+    """
+    从提示词中找出替换 INPUT_TASKS_JSON_STRING 后的任务数组：第一个能解析为对象数组、且对象都带有 id 的 JSON。
+    """
+    decoder = json.JSONDecoder()
+    position = prompt.find('[')
+    while position != -1:
+        try:
+            value, _ = decoder.raw_decode(prompt, position)
+        except json.JSONDecodeError:
+            value = None
+        if isinstance(value, list) and value and all(isinstance(task, dict) and "id" in task for task in value):
+            return value
+        position = prompt.find('[', position + 1)
+    return []
+
+
+def make_result(task : dict, corrected : bool):
+    """
+    按提示词中要求的字段生成一条结果。
+    """
+    text = task.get("text", "")
+    return {
+        "id": str(task["id"]),
+        "is_corrected": corrected,
+        "error_outside_snippet": False,
+        "original_text": text,
+        "corrected_text": text[::-1] if corrected else text,
+        "explanation": "模拟的校正说明" if corrected else ""
+    }
+
+
+def make_handler(settings : MockLLMSettings):
+
+    class MockLLMHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def send_body(self, status : int, body : bytes, headers : dict = None):
+            self.send_response(status)
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            settings.count("requests")
+
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self.send_body(404, b'{"error": "not found"}', {"Content-Type": "application/json"})
+                return
+
+            if settings.chance(settings.rate_429):
+                settings.count("429")
+                self.send_body(429, b'{"error": "rate limited"}', {"Content-Type": "application/json", "Retry-After": str(settings.retry_after)})
+                return
+            if settings.chance(settings.rate_500):
+                settings.count("500")
+                self.send_body(500, b'{"error": "internal error"}', {"Content-Type": "application/json"})
+                return
+
+            prompt = "".join(message.get("content", "") for message in request.get("messages", []))
+            tasks = extract_tasks(prompt)
+            time.sleep(settings.latency(len(tasks)))
+
+            results = [make_result(task, settings.chance(settings.correction_rate)) for task in tasks if not settings.chance(settings.drop_rate)]
+            if settings.chance(settings.reorder_rate):
+                with settings.lock:
+                    settings.random.shuffle(results)
+            content = json.dumps({"results": results}, ensure_ascii=False, indent=2)
+
+            if settings.chance(settings.malformed_rate):
+                settings.count("malformed")
+                content = "抱歉，我无法按要求的格式输出。" + content[:len(content) // 3]
+            elif settings.chance(settings.truncated_rate):
+                settings.count("truncated")
+                with settings.lock:
+                    content = content[:settings.random.randint(0, len(content))]
+            else:
+                settings.count("ok")
+
+            if request.get("stream"):
+                self.send_stream(request, content)
+            else:
+                response = {
+                    "id": "mock-completion",
+                    "object": "chat.completion",
+                    "model": request.get("model", "mock"),
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                    "usage": {"prompt_tokens": len(prompt), "completion_tokens": len(content), "total_tokens": len(prompt) + len(content)}
+                }
+                self.send_body(200, json.dumps(response, ensure_ascii=False).encode("utf-8"), {"Content-Type": "application/json"})
+
+        def send_stream(self, request : dict, content : str, chunk_size : int = 16):
+            """
+            以 server-sent events 的格式分段发送内容。
+            """
+            events = []
+            for i in range(0, len(content), chunk_size):
+                chunk = {"object": "chat.completion.chunk", "model": request.get("model", "mock"),
+                         "choices": [{"index": 0, "delta": {"content": content[i:i + chunk_size]}}]}
+                events.append(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n")
+            events.append("data: [DONE]\n\n")
+            self.send_body(200, "".join(events).encode("utf-8"), {"Content-Type": "text/event-stream"})
+
+    return MockLLMHandler
+
+
+def start_mock_server(settings : MockLLMSettings = None, host : str = "127.0.0.1", port : int = 0):
+    """
+    在后台线程中启动模拟服务器。
+
+    :return: (server, url)，url 为 chat completions 的完整地址，用完后调用 server.shutdown()。
+    """
+    settings = settings or MockLLMSettings()
+    server = ThreadingHTTPServer((host, port), make_handler(settings))
+    server.daemon_threads = True
+    server.settings = settings
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_port}/v1/chat/completions"
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="本地的 OpenAI 兼容模拟服务器，实现 /v1/chat/completions。")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency-median", type=float, default=1.0, help="每个请求延迟的中位数（秒）。")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="延迟的对数正态分布 sigma。")
+    parser.add_argument("--seconds-per-task", type=float, default=0.05, help="每个任务额外的延迟（秒）。")
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--rate-500", type=float, default=0.0)
+    parser.add_argument("--malformed-rate", type=float, default=0.0)
+    parser.add_argument("--truncated-rate", type=float, default=0.0)
+    parser.add_argument("--reorder-rate", type=float, default=0.0)
+    parser.add_argument("--drop-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    settings = MockLLMSettings(args.latency_median, args.latency_sigma, args.seconds_per_task,
+                               args.rate_429, args.rate_500, args.malformed_rate, args.truncated_rate,
+                               args.reorder_rate, args.drop_rate, seed=args.seed)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(settings))
+    print(f"模拟服务器已启动: http://{args.host}:{args.port}/v1/chat/completions")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"已停止，请求统计: {settings.stats}")
@@ -0,0 +1,130 @@
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+# 各个阶段的名称
+STAGE_LOCATED = "located"
+STAGE_CORRECTED = "corrected"
+STAGE_CORRECTED_2 = "corrected_2"
+STAGE_CORRECTED_SENTENCE = "corrected_sentence"
+STAGE_APPLIED = "applied"
+
+
+def _hash_json(value):
+    source = json.dumps(value, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+
+def clipping_key(clipping : dict):
+    """
+    标注的内容哈希，由位置和文本决定，与标注在文件中的顺序和id无关。
+    """
+    return _hash_json({"location_start": clipping["location_start"], "text": clipping["text"]})
+
+
+def item_key(item : dict, settings_key : str = None):
+    """
+    定位后的一条任务（pre_correction.json 中的一项，或第二轮的一项）的内容哈希，
+    由原文中的范围、文本、所在句子以及第二轮的说明决定，不包含 id。
+
+    :param settings_key: 校正阶段传入 correction_settings_key 的结果，修改了模型或提示词后，之前的结果不再对应。
+    """
+    key_source = {
+        "position_start": item["position_start"],
+        "position_end": item["position_end"],
+        "text": item["text"],
+        "sentence": item["sentence"]["text"],
+        "explanation": item.get("explanation")
+    }
+    if settings_key is not None:
+        key_source["settings"] = settings_key
+    return _hash_json(key_source)
+
+
+def correction_settings_key(llm_settings : dict, models : list):
+    """
+    校正结果所依赖的设置的哈希：与 LLMCache.make_key 一样包含模型、温度和提示词模板，另外包含提示词的格式。
+
+    :param models: 处理请求的模型，配置了 endpoints 时为各地址的模型。
+    """
+    return _hash_json({
+        "models": sorted(set(models)),
+        "temperature": llm_settings["llm_temperature"],
+        "prompt": hashlib.sha256(llm_settings["llm_prompt"].encode('utf-8')).hexdigest(),
+        "compact_prompt": bool(llm_settings.get("compact_prompt", False))
+    })
+
+
+def correction_key(correction : dict):
+    """
+    一条校正的内容哈希，用于记录哪些校正已经应用过。
+    """
+    return _hash_json({field: correction[field] for field in ("position_start", "position_end", "original_text", "corrected_text")})
+
+
+class PipelineState:
+    """
+    按书籍内容哈希保存的流水线状态，记录每本书的哪些标注已经定位、校正和应用过，保存在SQLite中。
+
+    每条记录的键为 (书籍哈希, 阶段, 内容哈希)，书籍内容改变后旧的记录不再使用。
+    重新运行时只需要处理新增或改变的标注，已有的结果直接从这里取出，与新的结果合并后写入输出文件。
+    """
+
+    def __init__(self, path : str = "pipeline_state.sqlite"):
+        self.path = path
+        self.lock = threading.Lock()
+        # 书库模式下多个进程可能同时写入
+        self.connection = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS pipeline_state ("
+            "book_hash TEXT NOT NULL, "
+            "stage TEXT NOT NULL, "
+            "key TEXT NOT NULL, "
+            "value TEXT NOT NULL, "
+            "updated_at REAL NOT NULL, "
+            "PRIMARY KEY (book_hash, stage, key))"
+        )
+        self.connection.commit()
+
+    def get_stage(self, book_hash : str, stage : str):
+        """
+        读取一本书在某个阶段的所有记录。
+
+        :return: {内容哈希: 值}
+        """
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT key, value FROM pipeline_state WHERE book_hash = ? AND stage = ?", (book_hash, stage)
+            ).fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+    def put_stage(self, book_hash : str, stage : str, values : dict):
+        """
+        保存一批记录，已有的同名记录会被覆盖。
+
+        :param values: {内容哈希: 值}
+        """
+        if not values:
+            return
+        now = time.time()
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO pipeline_state (book_hash, stage, key, value, updated_at) VALUES (?, ?, ?, ?, ?)",
+                [(book_hash, stage, key, json.dumps(value, ensure_ascii=False), now) for key, value in values.items()]
+            )
+            self.connection.commit()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+def open_pipeline_state(state_settings : dict):
+    """
+    根据配置文件中的 pipeline_state 字段打开状态存储，未配置或未启用时返回 None。
+    """
+    if not state_settings or not state_settings.get("enabled", True):
+        return None
+    return PipelineState(state_settings.get("path", "pipeline_state.sqlite"))
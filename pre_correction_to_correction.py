@@ -1,8 +1,22 @@
 import os
 import json
-import requests
+import time
+import random
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 from typing import Callable,Union
 
+from batch_packer import pack_batches, plan_batches
+from book_source import load_book
+from correction_journal import CorrectionJournal, hash_data, hash_file
+from llm_cache import LLMCache, open_llm_cache
+from llm_router import endpoint_models, route_chat_completion, route_stream_chat_completion, served_model, total_concurrency
+from metrics import metrics
+from pipeline_state import STAGE_CORRECTED, STAGE_CORRECTED_2, STAGE_CORRECTED_SENTENCE, PipelineState, correction_settings_key, item_key, open_pipeline_state
+from prompt_encoding import build_messages, compare_encodings, estimate_messages_tokens
+from stream_json import JSONArrayStreamParser
+from triage import DEFAULT_FREQUENT_MARGIN, BigramModel, triage
+
 def select_clippings_sentence(clippings_list : dict):
     """
     选择需要发送给llm的字段, id, text, sentence
@@ -31,6 +45,20 @@ def select_clippings_explanation(clippings_list : dict):
         selected_clippings.append(selected_clipping)
     return selected_clippings
 
+def select_clippings_snippets(clippings_list : dict):
+    """
+    选择需要发送给llm的字段, id, text（整个句子）, snippets（句中的所有划线片段）
+    """
+    selected_clippings = []
+    for clipping in clippings_list:
+        selected_clipping = {
+            "id" : clipping["id"],
+            "text" : clipping["text"],
+            "snippets" : clipping["snippets"]
+        }
+        selected_clippings.append(selected_clipping)
+    return selected_clippings
+
 def select_output_snippet(result : dict, pre_correction : dict):
 
     """
@@ -69,6 +97,25 @@ def select_output_nosnippet(result : dict, pre_correction : dict):
             }
 
 
+def select_output_sentence(result : dict, pre_correction : dict):
+    """
+    从模型返回的结果中选择需要的字段，用于按句子分组的校正
+    """
+    return {
+            'id': pre_correction['id'],
+            "location_start": pre_correction['location_start'],
+            "position_start": pre_correction['position_start'],
+            "position_end": pre_correction['position_end'],
+            'is_corrected': result['is_corrected'],
+            'original_text': result['original_text'],
+            'corrected_text': result['corrected_text'],
+            'sentence': pre_correction['sentence'],
+            "paragraph": pre_correction['paragraph'],
+            'explanation': result['explanation'],
+            "error_outside_snippet": False
+            }
+
+
 # 对于输入的json，筛选输出的字段
 def filter_json(input : Union[dict,list] ):
     """ 
@@ -94,49 +141,52 @@ def filter_json(input : Union[dict,list] ):
     return output
 
 
-def create_batch_prompt(llm_prompt : str, clippings_list : Union[dict,list], select_function : Callable):
-    """
-    V3版本：增加一个字段，用于标记片段之外是否存在错误。
-    """
-    tasks_json_string = json.dumps(select_function(clippings_list), indent=2, ensure_ascii=False)
-
-
-    prompt_template = llm_prompt.replace("INPUT_TASKS_JSON_STRING", tasks_json_string)
-
-
-    return prompt_template
-
-
-def process_batch_with_custom_api(llm_settings : dict ,clippings_list : Union[dict,list], select_function : Callable):
+def process_batch_with_custom_api(llm_settings : dict ,clippings_list : Union[dict,list], select_function : Callable, on_result : Callable = None):
     """
     调用自定义API，一次性处理一批校对任务。
-    """
-    # (这部分与之前的单次请求代码基本相同)
-    url = llm_settings["llm_api_url"]
-    api_key = llm_settings["llm_api_key"]
 
-
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {api_key}"
-    }
-    
-    # 1. 使用新的函数创建批处理提示词
-    final_prompt = create_batch_prompt(llm_settings["llm_prompt"],clippings_list,select_function)
+    llm_settings 中 stream 为 true 时以流式接收，结果数组中的每个对象一闭合就交给 on_result；
+    流在中途断开时，已经收到的完整结果仍然返回，只有一个结果都没有收到时才返回 None。
+    """
+    # 1. 创建批处理提示词，compact_prompt 为 true 时使用紧凑格式和固定的系统消息
+    selected_tasks = select_function(clippings_list)
+    messages = build_messages(llm_settings["llm_prompt"], selected_tasks, llm_settings.get("compact_prompt", False))
+    prompt_tokens = estimate_messages_tokens(messages)
+
+    if llm_settings.get("compact_prompt", False):
+        baseline_tokens, _, system_tokens = compare_encodings(llm_settings["llm_prompt"], selected_tasks)
+        metrics.inc("prompt_tokens_estimated_total", baseline_tokens, encoding="json")
+        metrics.inc("prompt_tokens_estimated_total", prompt_tokens, encoding="compact")
+        print(f"紧凑格式约 {prompt_tokens} 个token（其中系统消息 {system_tokens} 个），"
+              f"原格式约 {baseline_tokens} 个，节省 {1 - prompt_tokens / max(1, baseline_tokens):.1%}。")
 
     data = {
         "model": llm_settings["llm_model"],
-        "messages": [{"role": "user", "content": final_prompt}],
+        "messages": messages,
         "temperature": llm_settings["llm_temperature"],
         "response_format": {"type": "json_object"}
     }
 
+    if llm_settings.get("stream"):
+        print(f"正在以流式向API发送包含 {len(clippings_list)} 个任务的批处理请求...")
+        parser = JSONArrayStreamParser()
+        results = []
+        try:
+            for content in route_stream_chat_completion(llm_settings, data, prompt_tokens):
+                for result in parser.feed(content):
+                    results.append(result)
+                    if on_result is not None:
+                        on_result(result)
+        except Exception as e:
+            print(f"流式请求失败: {e}，保留已收到的 {len(results)} 个结果。")
+            if not results:
+                return None
+        return results
+
     print(f"正在向API发送包含 {len(clippings_list)} 个任务的批处理请求...")
     try:
-        response = requests.post(url, headers=headers, data=json.dumps(data), timeout=180) # 批处理可能耗时更长，增加超时
-        response.raise_for_status()
-        
-        response_data = response.json()
+        # 连接复用、超时、限流和HTTP层面的重试都由 llm_client 处理，多个地址之间的分配由 llm_router 处理
+        response_data = route_chat_completion(llm_settings, data, prompt_tokens)
         #print(response_data)
         # 模型返回的content现在应该是一个包含结果列表的JSON字符串
         # 注意：这里的返回格式是我们在Prompt里要求的，所以路径可能需要调整
@@ -157,51 +207,254 @@ def process_batch_with_custom_api(llm_settings : dict ,clippings_list : Union[di
         return None
     
 
-def get_correction(llm_settings : dict , pre_correction_list : Union[dict,list],  task_per_request : int, select_function : Callable , output_function : Callable):
+def process_batch(llm_settings : dict, clippings_list : Union[dict,list], select_function : Callable, output_function : Callable, cache : LLMCache = None, commit : Callable = None):
+    """
+    发送一批校对任务，并检查返回结果与输入是否对应。
+
+    结果按 id 与任务对应，合格的结果保留，只有缺失或不合格的任务记为失败。
+
+    启用缓存时，已经缓存过的任务直接使用缓存结果，只把未命中的任务发送给llm，
+    通过校验的结果会按任务逐条写入缓存。
+
+    传入 commit 时，通过校验的结果会交给 commit（参数为结果列表）保存：
+    非流式时整批调用一次，流式（llm_settings 中 stream 为 true）时每收到一个结果就立即调用。
+
+    :return: (校对结果列表, 失败任务列表)
+    """
+    batch_result = []
+
+    cache_keys = {}
+    task_order = {pre_correction['id']: index for index, pre_correction in enumerate(clippings_list)}
+    # 缓存键使用实际提供服务的模型；各地址的模型不同时不使用缓存，见 get_correction
+    model = served_model(llm_settings) if cache is not None else None
+    if model is not None:
+        key_settings = dict(llm_settings, llm_model=model)
+        uncached_list = []
+        for pre_correction in clippings_list:
+            cache_key = LLMCache.make_key(key_settings, select_function([pre_correction])[0])
+            cached_result = cache.get(cache_key)
+            if cached_result is None:
+                cache_keys[pre_correction['id']] = cache_key
+                uncached_list.append(pre_correction)
+            else:
+                batch_result.append(output_function(cached_result, pre_correction))
+        if len(uncached_list) < len(clippings_list):
+            print(f"缓存命中 {len(clippings_list) - len(uncached_list)} 个任务。")
+            metrics.inc("llm_cache_hits_total", len(clippings_list) - len(uncached_list))
+        clippings_list = uncached_list
+
+    if commit is not None:
+        commit(batch_result)
+
+    if not clippings_list:
+        batch_result.sort(key=lambda x: task_order[x['id']])
+        return batch_result, []
+
+    tasks_by_id = {str(int(pre_correction['id'])): pre_correction for pre_correction in clippings_list}
+    seen_ids = set()
+    accepted_ids = set()
+
+    def accept(result):
+        """
+        按 id 找到结果对应的任务并校验，同一个 id 出现多次时只取第一个。通过校验时返回输出，否则返回 None。
+        """
+        try:
+            result_id = str(int(result['id']))
+        except (KeyError, TypeError, ValueError):
+            print(f"错误: 结果缺少有效的ID，已忽略: {result}")
+            metrics.inc("correction_result_errors_total", reason="invalid_id")
+            return None
+        if result_id not in tasks_by_id or result_id in seen_ids:
+            return None
+        seen_ids.add(result_id)
+        pre_correction = tasks_by_id[result_id]
+
+        # 检测is_corrected,original_text,corrected_text等字段是否存在
+        try:
+            output = output_function(result, pre_correction)
+        except (KeyError, TypeError) as e:
+            print(f"错误: 预校对ID {pre_correction['id']} 的结果缺少字段 {e}。")
+            metrics.inc("correction_result_errors_total", reason="missing_field")
+            return None
+
+        if pre_correction['text'] != result['original_text']:
+            print(f"错误: 预校对文本与结果文本不匹配。预校对文本: {pre_correction['text']}, 结果文本: {result['original_text']}")
+            metrics.inc("correction_result_errors_total", reason="text_mismatch")
+            return None
+
+        accepted_ids.add(result_id)
+        batch_result.append(output)
+
+        if pre_correction['id'] in cache_keys:
+            cache.put(cache_keys[pre_correction['id']], result)
+        return output
+
+    def accept_streamed(result):
+        output = accept(result)
+        if output is not None and commit is not None:
+            commit([output])
+
+    if llm_settings.get("stream"):
+        correction_results = process_batch_with_custom_api(llm_settings, clippings_list, select_function, accept_streamed)
+    else:
+        correction_results = process_batch_with_custom_api(llm_settings, clippings_list, select_function)
+
+        if isinstance(correction_results, list):
+            outputs = [accept(result) for result in correction_results]
+            if commit is not None:
+                commit([output for output in outputs if output is not None])
+        elif correction_results is not None:
+            print(f"错误: 返回结果不是JSON数组，该批 {len(clippings_list)} 个任务记为失败。")
+            metrics.inc("correction_result_errors_total", reason="not_array")
+
+    if correction_results is None:
+        print(f"该批 {len(clippings_list)} 个任务请求失败。")
+        metrics.inc("correction_result_errors_total", reason="request_failed")
+
+    failed_corrections = []
+    for pre_correction in clippings_list:
+        if str(int(pre_correction['id'])) not in accepted_ids:
+            if correction_results is not None and str(int(pre_correction['id'])) not in seen_ids:
+                print(f"错误: 结果中缺少预校对ID {pre_correction['id']}。")
+                metrics.inc("correction_result_errors_total", reason="missing_result")
+            failed_corrections.append(pre_correction)
+
+    # 缓存命中的结果先被加入，这里恢复为任务的原始顺序
+    batch_result.sort(key=lambda x: task_order[x['id']])
+
+    return batch_result, failed_corrections
+
+
+def get_correction(llm_settings : dict , pre_correction_list : Union[dict,list],  task_per_request : int, select_function : Callable , output_function : Callable, cache : LLMCache = None, journal : CorrectionJournal = None, phase : str = "first", retry : bool = True):
+    """
+    将任务分批发送给llm，分批方式见 batch_packer.pack_batches：
+    配置了token预算时按预算装箱，否则按 task_per_request 固定分批。
+
+    llm_settings 中的 max_concurrent_requests 大于1时，会用线程池同时发送多批请求，
+    并按 requests_per_minute / tokens_per_minute 限流；配置了 endpoints 时按各地址的名额之和并发，见 llm_router。无论是否并发，结果都按任务的输入顺序合并，
+    与逐批发送时完全一致。
+
+    传入 cache 时，每个任务先查询缓存，只有未命中的任务才会发送给llm。
+    配置了 endpoints 且各地址的模型不同时，无法确定结果来自哪个模型，本轮不使用缓存。
+
+    传入 journal 时，每完成一批（流式时每收到一个结果）就把结果写入日志；日志中 phase 阶段已经完成的任务会被跳过，
+    其结果直接从日志中取出。
+
+    retry 为 True 时，一批中失败的任务会在指数退避（retry_backoff_seconds，默认1秒）后对半拆分重试，
+    直到拆成单个任务并单独重试一次，这样一个有问题的任务不会拖累同批的其他任务。
+    """
     
-    total_tasks = len(pre_correction_list)
+    completed = journal.get_completed(phase) if journal is not None else {}
+    if completed:
+        remaining_list = [pre_correction for pre_correction in pre_correction_list if str(pre_correction['id']) not in completed]
+        if len(remaining_list) < len(pre_correction_list):
+            print(f"日志中已有 {len(pre_correction_list) - len(remaining_list)} 个任务的结果，跳过这些任务。")
+    else:
+        remaining_list = pre_correction_list
+
+    total_tasks = len(remaining_list)
     print(f"总共有 {total_tasks} 个任务需要处理。")
 
-    number_of_requests = (total_tasks + task_per_request - 1) // task_per_request
-    print(f"将分成 {number_of_requests} 次请求来处理这些任务。")
+    retry_backoff_seconds = llm_settings.get("retry_backoff_seconds", 1)
 
-    total_result = []
-    failed_corrections = []
+    if cache is not None and served_model(llm_settings) is None:
+        print("本轮的各个llm地址使用不同的模型，不使用缓存。")
+        cache = None
 
-    for i in range(number_of_requests):
-        start_index = i * task_per_request
-        end_index = min(start_index + task_per_request, total_tasks)
-        clippings_list = pre_correction_list[start_index:end_index]
+    batches = pack_batches(remaining_list, llm_settings, task_per_request, select_function)
+    print(f"将分成 {len(batches)} 次请求来处理这些任务。")
 
-        correction_results = process_batch_with_custom_api(llm_settings, clippings_list, select_function)
+    def commit(results):
+        if journal is not None:
+            journal.append(phase, results)
 
-        if correction_results is None:
-            print(f"第 {i+1} 次请求失败，终止处理。")
-            failed_corrections.extend(clippings_list)
-            continue
+    def run_batch(clippings_list, depth=0):
+        batch_result, batch_failed = process_batch(llm_settings, clippings_list, select_function, output_function, cache, commit)
+
+        # 单个任务单独发送后仍然失败，不再重试
+        if not retry or not batch_failed or (len(clippings_list) == 1 and depth > 0):
+            return batch_result, batch_failed
+
+        # 指数退避后，把失败的任务对半拆开分别重试；只剩一个任务时单独重试一次
+        delay = retry_backoff_seconds * (2 ** depth) * random.uniform(0.5, 1.5)
+        print(f"{len(batch_failed)} 个任务失败，{delay:.1f} 秒后拆分重试。")
+        metrics.inc("correction_batch_retries_total", phase=phase)
+        metrics.inc("correction_retried_tasks_total", len(batch_failed), phase=phase)
+        time.sleep(delay)
 
-        for j in range(len(correction_results)):
-            result = correction_results[j]
-            pre_correction = clippings_list[j]
+        middle = (len(batch_failed) + 1) // 2
+        halves = [batch_failed[:middle], batch_failed[middle:]] if len(batch_failed) > 1 else [batch_failed]
 
-            # 检测id,is_corrected,original_text,corrected_text是否存在
+        failed = []
+        for half in halves:
+            half_result, half_failed = run_batch(half, depth + 1)
+            batch_result.extend(half_result)
+            failed.extend(half_failed)
+        return batch_result, failed
 
-            if int(pre_correction['id']) != int(result['id']):
-                print(f"错误: 预校对ID {pre_correction['id']} 与结果ID {result['id']} 不匹配。")
-                failed_corrections.append(pre_correction)
-                continue
+    # 配置了多个地址时，并发数为各地址的名额之和
+    max_concurrent_requests = total_concurrency(llm_settings)
 
-            if pre_correction['text'] != result['original_text']:
-                print(f"错误: 预校对文本与结果文本不匹配。预校对文本: {pre_correction['text']}, 结果文本: {result['original_text']}")
-                failed_corrections.append(pre_correction)
-                continue
+    if max_concurrent_requests == 1:
+        batch_outputs = [run_batch(clippings_list) for clippings_list in batches]
+    else:
+        print(f"最多同时发送 {max_concurrent_requests} 个请求。")
+        with ThreadPoolExecutor(max_workers=max_concurrent_requests) as executor:
+            futures = [executor.submit(run_batch, clippings_list) for clippings_list in batches]
+            batch_outputs = [future.result() for future in futures]
+
+    results_by_id = {str(task_id): result for task_id, result in completed.items()}
+    failed_corrections = []
 
+    for batch_result, batch_failed in batch_outputs:
+        for result in batch_result:
+            results_by_id[str(result['id'])] = result
+        failed_corrections.extend(batch_failed)
 
-            total_result.append(output_function(result, pre_correction))
+    total_result = [results_by_id[str(pre_correction['id'])] for pre_correction in pre_correction_list if str(pre_correction['id']) in results_by_id]
+
+    metrics.inc("correction_tasks_total", len(total_result), phase=phase, status="succeeded")
+    metrics.inc("correction_tasks_total", len(failed_corrections), phase=phase, status="failed")
             
     return total_result, failed_corrections
 
 
+def get_correction_incremental(state : PipelineState, book_hash : str, stage : str, llm_settings : dict, pre_correction_list : list, task_per_request : int, select_function : Callable, output_function : Callable, cache : LLMCache = None, journal : CorrectionJournal = None, phase : str = "first", retry : bool = True):
+    """
+    与 get_correction 相同，但先从流水线状态中取出之前已经校正过的任务，只把新增或改变的任务发送给llm，
+    新的结果保存到状态中，再与已有的结果按输入顺序合并。state 为 None 时直接调用 get_correction。
+
+    任务按 pipeline_state.item_key 对应，与 id 无关，合并后的结果使用本次输入中的 id。
+    键中包含模型、温度、提示词和提示词格式，修改其中任何一项后，所有任务都会重新校正。
+    """
+    if state is None:
+        return get_correction(llm_settings, pre_correction_list, task_per_request, select_function, output_function, cache, journal, phase, retry)
+
+    stored = state.get_stage(book_hash, stage)
+    settings_key = correction_settings_key(llm_settings, endpoint_models(llm_settings))
+    keys = {}
+    results_by_id = {}
+    new_list = []
+    for pre_correction in pre_correction_list:
+        key = item_key(pre_correction, settings_key)
+        keys[str(pre_correction['id'])] = key
+        if key in stored:
+            results_by_id[str(pre_correction['id'])] = dict(stored[key], id=pre_correction['id'], location_start=pre_correction['location_start'])
+        else:
+            new_list.append(pre_correction)
+
+    print(f"{len(results_by_id)} 个任务之前已经校正过，需要校正 {len(new_list)} 个新的任务。")
+
+    new_results, failed_corrections = get_correction(llm_settings, new_list, task_per_request, select_function, output_function, cache, journal, phase, retry) if new_list else ([], [])
+
+    state.put_stage(book_hash, stage, {keys[str(result['id'])]: result for result in new_results})
+    for result in new_results:
+        results_by_id[str(result['id'])] = result
+
+    total_result = [results_by_id[str(pre_correction['id'])] for pre_correction in pre_correction_list if str(pre_correction['id']) in results_by_id]
+    return total_result, failed_corrections
+
+
 def process_error_data_split(data):
     """
     处理文本错误数据，返回处理后的结果和被筛掉的原始数据。
@@ -293,49 +546,93 @@ def process_error_data_split(data):
     
     
 
-if __name__ == "__main__":
-
-
-    # 读取配置文件
-    if not os.path.exists('config.json'):
-        print("错误: 找不到配置文件 'config.json'")
-        exit(1)
-    
-    config = json.load(open('config.json', 'r', encoding='utf-8'))
-
-    llm_settings = config["pre_correction_to_correction"]["llm_settings"]
-
-    llm_settings_2 = config["pre_correction_to_correction"]["llm_settings_2"]
+def group_by_sentence(data : list):
+    """
+    把同一个句子中的标注合并为一个整句的任务，用于按句子分组的校正。
 
-    pre_correction_json_path = config["pre_correction_to_correction"]["pre_correction_json_path"]
+    句子按原文中的范围 (start, end) 区分，相同的句子出现在书中不同位置时不会合并。
+    每个任务的 id 为句中最小的标注 id，snippets 为句中按位置排列的划线片段，
+    source_ids 记录合并前所有标注的 id。
 
-    correction_json_path = config["pre_correction_to_correction"]["correction_json_path"]
+    :return: 按 id 排序的任务列表。
+    """
+    sentence_groups = {}
+    for item in data:
+        sentence_range = (item['sentence']['start'], item['sentence']['end'])
+        sentence_groups.setdefault(sentence_range, []).append(item)
+
+    grouped_items = []
+    for items in sentence_groups.values():
+        items = sorted(items, key=lambda x: x['position_start'])
+        base_item = min(items, key=lambda x: int(x['id']))
+        grouped_items.append({
+            "id": base_item['id'],
+            "location_start": min(item['location_start'] for item in items),
+            "position_start": base_item['sentence']['start'],
+            "position_end": base_item['sentence']['end'],
+            "text": base_item['sentence']['text'],
+            "sentence": base_item['sentence'],
+            "paragraph": base_item['paragraph'],
+            "snippets": [item['text'] for item in items],
+            "source_ids": sorted((item['id'] for item in items), key=int)
+        })
+
+    grouped_items.sort(key=lambda x: int(x['id']))
+    return grouped_items
+
+
+def sentence_grouping_settings(correction_settings : dict):
+    """
+    按句子分组校正时使用的llm设置：在 llm_settings 的基础上，使用 sentence_grouping 中的提示词和每批任务数。
+    未启用时返回 None。
+    """
+    grouping = correction_settings.get("sentence_grouping") or {}
+    if not grouping.get("enabled", False):
+        return None
+    llm_settings = dict(correction_settings["llm_settings"], llm_prompt=grouping["llm_prompt"])
+    llm_settings["task_per_request"] = grouping.get("task_per_request", llm_settings["task_per_request"])
+    return llm_settings
 
-    re_correction_enabled = config["pre_correction_to_correction"]["re_correction_enabled"]
 
-    with open(pre_correction_json_path, 'r', encoding='utf-8') as f:
-        pre_correction_list = json.load(f)
+def run_correction(correction_settings : dict, pre_correction_list : list, llm_cache : LLMCache = None, journal : CorrectionJournal = None, pipeline_state : PipelineState = None, book_hash : str = None, book_text = None):
+    """
+    完整的校正步骤：第一轮校正所有任务，再把同一句中有多处错误或片段之外有错误的任务合并为整句，进行第二轮校正。
+    启用 sentence_grouping 时改为先按句子分组，每个句子只校正一次，没有第二轮。
 
-    if not pre_correction_list:
-        print("错误: 预校对列表为空，请检查输入文件。")
-        exit(1)
+    启用 triage 且提供了原文时，先在本地预筛，只有可能有错的任务才发送给大模型。
 
-    total_result, failed_corrections = get_correction(llm_settings, pre_correction_list, llm_settings["task_per_request"],select_clippings_sentence,select_output_snippet)
-            
+    :param correction_settings: 配置文件中的 pre_correction_to_correction 字段。
+    :param pre_correction_list: pre_correction.json 中的任务列表。
+    :param book_text: 原文，str 或 book_source.MappedBook，用于本地预筛。
+    :return: (correction.json 的内容, 失败的任务列表)
+    """
+    llm_settings = correction_settings["llm_settings"]
+    llm_settings_2 = correction_settings["llm_settings_2"]
+    re_correction_enabled = correction_settings["re_correction_enabled"]
+
+    # 本地预筛，没有候选错误的任务直接判定为无错，不参与后面的两轮校正
+    triage_settings = correction_settings.get("triage") or {}
+    triaged_result = []
+    if triage_settings.get("enabled", False) and book_text is not None:
+        pre_correction_list, triaged_result = triage(pre_correction_list, BigramModel(book_text), triage_settings.get("margin", 1.0),
+                                                      triage_settings.get("frequent_margin", DEFAULT_FREQUENT_MARGIN))
+
+    # 按句子分组时，每个句子连同句中所有的划线片段只发送一次，直接得到整句的校正，不需要第二轮
+    grouped_llm_settings = sentence_grouping_settings(correction_settings)
+    if grouped_llm_settings is not None:
+        grouped_list = group_by_sentence(pre_correction_list)
+        print(f"按句子分组：{len(pre_correction_list)} 条标注合并为 {len(grouped_list)} 个句子。")
+        total_result, failed_corrections = get_correction_incremental(pipeline_state, book_hash, STAGE_CORRECTED_SENTENCE, grouped_llm_settings, grouped_list, grouped_llm_settings["task_per_request"], select_clippings_snippets, select_output_sentence, llm_cache, journal, "sentence", re_correction_enabled)
+        if failed_corrections:
+            print(f"处理完成，但有 {len(failed_corrections)} 个句子未能成功校对，将保存到 'failed_corrections.json'。")
+        total_result.extend(triaged_result)
+        print(f"最终校对结果包含 {len(total_result)} 条数据。")
+        return filter_json(total_result), failed_corrections
+
+    total_result, failed_corrections = get_correction_incremental(pipeline_state, book_hash, STAGE_CORRECTED, llm_settings, pre_correction_list, llm_settings["task_per_request"],select_clippings_sentence,select_output_snippet,llm_cache,journal,"first",re_correction_enabled)
 
-            
     if failed_corrections:
-        print(f"处理完成，但有 {len(failed_corrections)} 个任务未能成功校对。")
-        if re_correction_enabled:
-            print("正在重新处理未成功校对的任务...")
-            re_correction_results, re_failed_corrections = get_correction(llm_settings, failed_corrections, 5 ,select_clippings_sentence,select_output_snippet)
-            failed_correction = re_failed_corrections
-            total_result.extend(re_correction_results)
-
-        else:
-            print("未启用重新校对功能，已将失败的校对任务保存到 'failed_corrections.json'。")
-
-
+        print(f"处理完成，但有 {len(failed_corrections)} 个任务未能成功校对，将保存到 'failed_corrections.json'。")
 
     print(f"处理完成，共生成 {len(total_result)} 条校对结果。")
 
@@ -344,45 +641,100 @@ if __name__ == "__main__":
 
     if further_correction:
         print(f"对句子中有多处错误的情况，处理 {len(further_correction)} 条数据。")
-        further_correction_results, further_failed_corrections = get_correction(llm_settings_2, further_correction, llm_settings_2["task_per_request"],select_clippings_explanation,select_output_nosnippet)
+        further_correction_results, further_failed_corrections = get_correction_incremental(pipeline_state, book_hash, STAGE_CORRECTED_2, llm_settings_2, further_correction, llm_settings_2["task_per_request"],select_clippings_explanation,select_output_nosnippet,llm_cache,journal,"second",re_correction_enabled)
         
         if further_failed_corrections:
             print(f"对于多处错误的情况，有 {len(further_failed_corrections)} 条数据未能成功校对。")
-
-            if re_correction_enabled:
-                print("正在重新处理未成功校对的任务...")
-                re_correction_results, re_failed_corrections = get_correction(llm_settings_2, further_failed_corrections, 5 ,select_clippings_explanation,select_output_nosnippet)
-            
-                further_failed_corrections = re_failed_corrections
-                further_correction_results.extend(re_correction_results)
-            
             failed_corrections.extend(further_failed_corrections)
         
         total_result.extend(further_correction_results)
 
+    total_result.extend(triaged_result)
 
-    if failed_corrections:    
-        with open('failed_corrections.json', 'w', encoding='utf-8') as f:
-            json.dump(failed_corrections, f, ensure_ascii=False, indent=4)
+    print(f"最终校对结果包含 {len(total_result)} 条数据。")
 
+    return filter_json(total_result), failed_corrections
 
-    print(f"最终校对结果包含 {len(total_result)} 条数据。")
 
-    with open(correction_json_path, 'w', encoding='utf-8') as f:
-        json.dump(filter_json(total_result), f, ensure_ascii=False, indent=4)
-            
+if __name__ == "__main__":
 
-        
+    parser = argparse.ArgumentParser(description="将标注及其上下文发送给大模型，获取校正意见。")
+    parser.add_argument("--resume", action="store_true", help="重放上次运行的日志，跳过已经完成的任务。")
+    parser.add_argument("--plan", action="store_true", help="只估算第一轮的请求数、token数和时间，不发送任何请求。")
+    args = parser.parse_args()
+
+    # 读取配置文件
+    if not os.path.exists('config.json'):
+        print("错误: 找不到配置文件 'config.json'")
+        exit(1)
+    
+    config = json.load(open('config.json', 'r', encoding='utf-8'))
 
+    llm_settings = config["pre_correction_to_correction"]["llm_settings"]
 
+    pre_correction_json_path = config["pre_correction_to_correction"]["pre_correction_json_path"]
 
+    correction_json_path = config["pre_correction_to_correction"]["correction_json_path"]
 
-    
+    llm_cache = open_llm_cache(config["pre_correction_to_correction"].get("llm_cache"))
 
+    with open(pre_correction_json_path, 'r', encoding='utf-8') as f:
+        pre_correction_list = json.load(f)
 
+    if not pre_correction_list:
+        print("错误: 预校对列表为空，请检查输入文件。")
+        exit(1)
 
+    if args.plan:
+        grouped_llm_settings = sentence_grouping_settings(config["pre_correction_to_correction"])
+        if grouped_llm_settings is not None:
+            grouped_list = group_by_sentence(pre_correction_list)
+            plan = plan_batches(pack_batches(grouped_list, grouped_llm_settings, grouped_llm_settings["task_per_request"], select_clippings_snippets), grouped_llm_settings, select_clippings_snippets)
+            print(f"按句子分组，预计发送 {plan['requests']} 次请求，共 {plan['tasks']} 个句子，"
+                  f"每次 {plan['min_tasks_per_request']}~{plan['max_tasks_per_request']} 个句子。")
+            print(f"预计输入 {plan['input_tokens']} 个token，输出 {plan['output_tokens']} 个token，用时约 {plan['estimated_seconds']} 秒。")
+            exit(0)
+
+        plan = plan_batches(pack_batches(pre_correction_list, llm_settings, llm_settings["task_per_request"], select_clippings_sentence), llm_settings, select_clippings_sentence)
+        print(f"第一轮预计发送 {plan['requests']} 次请求，共 {plan['tasks']} 个任务，"
+              f"每次 {plan['min_tasks_per_request']}~{plan['max_tasks_per_request']} 个任务。")
+        print(f"预计输入 {plan['input_tokens']} 个token，输出 {plan['output_tokens']} 个token，用时约 {plan['estimated_seconds']} 秒。")
+        if llm_settings.get("compact_prompt", False):
+            print(f"使用紧凑格式，原格式预计输入 {plan['baseline_input_tokens']} 个token。")
+        print("第二轮的任务数取决于第一轮的结果，无法预先估算。")
+        exit(0)
+
+    journal_path = config["pre_correction_to_correction"].get("journal_path", "correction_journal.jsonl")
+    journal = CorrectionJournal(journal_path, hash_data(pre_correction_list), resume=args.resume)
+
+    # 可选的流水线状态，只校正新增或改变的任务
+    pipeline_state = open_pipeline_state(config.get("pipeline_state"))
+    book_hash = hash_file(config["clippings_to_pre_correction"]["book_path"]) if pipeline_state is not None else None
+
+    # 本地预筛需要原文来统计二元语法
+    book_text = None
+    if (config["pre_correction_to_correction"].get("triage") or {}).get("enabled", False):
+        book_text = load_book(config["clippings_to_pre_correction"]["book_path"], config["clippings_to_pre_correction"].get("book_encoding"))
+
+    with metrics.stage("correct"):
+        correction_list, failed_corrections = run_correction(config["pre_correction_to_correction"], pre_correction_list, llm_cache, journal, pipeline_state, book_hash, book_text)
+
+    if hasattr(book_text, "close"):
+        book_text.close()
 
+    if failed_corrections:    
+        with open('failed_corrections.json', 'w', encoding='utf-8') as f:
+            json.dump(failed_corrections, f, ensure_ascii=False, indent=4)
+
+    with open(correction_json_path, 'w', encoding='utf-8') as f:
+        json.dump(correction_list, f, ensure_ascii=False, indent=4)
 
+    if pipeline_state is not None:
+        pipeline_state.close()
 
+    if llm_cache is not None:
+        cache_stats = llm_cache.stats()
+        print(f"缓存命中 {cache_stats['hits']} 次，未命中 {cache_stats['misses']} 次，当前缓存 {cache_stats['entries']} 条。")
+        llm_cache.close()
 
-    
+    metrics.export(config.get("metrics"))
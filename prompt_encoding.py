@@ -0,0 +1,86 @@
+import json
+
+from rate_limiter import estimate_tokens
+
+# 多个任务可能共用的上下文字段，紧凑格式下同一批中重复的值放进 contexts 表，只发送一次
+SHARED_CONTEXT_FIELDS = ("sentence", "paragraph")
+
+# 引用 contexts 表时，任务中用 "<字段>_ref" 代替原字段。引用放在单独的字段中，
+# 不会与恰好是 "S1" 这样的句子文本混淆
+CONTEXT_REF_SUFFIX = "_ref"
+
+# 替换提示词中 INPUT_TASKS_JSON_STRING 的文字，任务本身放在用户消息中
+TASKS_PLACEHOLDER = "（见用户消息）"
+
+# 使用 contexts 表时放在任务前面的说明
+COMPACT_ENCODING_NOTE = "输入为JSON对象，tasks 为任务数组；任务中的 sentence_ref、paragraph_ref 是 contexts 中的键，该任务的 sentence、paragraph 为对应的值。\n"
+
+
+def encode_tasks_compact(selected_tasks : list):
+    """
+    紧凑的任务编码：不缩进，同一批中重复出现的上下文只写一次。
+
+    SHARED_CONTEXT_FIELDS 中的值在同一批里出现不止一次时，放进 contexts 表，
+    任务中去掉这个字段，改为在 "sentence_ref" 这样的字段中写 "S1"、"S2" 等键；只出现一次的值照常写在任务里。
+    没有重复的上下文时（例如第二轮）直接返回不缩进的任务数组。
+
+    :param selected_tasks: 经过 select_function 筛选后的任务。
+    """
+    occurrences = {}
+    for task in selected_tasks:
+        for field in SHARED_CONTEXT_FIELDS:
+            if field in task:
+                occurrences[task[field]] = occurrences.get(task[field], 0) + 1
+
+    contexts = {}
+    keys = {}
+    tasks = []
+    for task in selected_tasks:
+        # 保持字段的原有顺序，被引用的字段就地换成 "<字段>_ref"
+        encoded = {}
+        for field, value in task.items():
+            if field not in SHARED_CONTEXT_FIELDS or occurrences[value] < 2:
+                encoded[field] = value
+                continue
+            if value not in keys:
+                keys[value] = f"S{len(keys) + 1}"
+                contexts[keys[value]] = value
+            encoded[field + CONTEXT_REF_SUFFIX] = keys[value]
+        tasks.append(encoded)
+
+    if not contexts:
+        return json.dumps(tasks, ensure_ascii=False, separators=(',', ':'))
+    return COMPACT_ENCODING_NOTE + json.dumps({"contexts": contexts, "tasks": tasks}, ensure_ascii=False, separators=(',', ':'))
+
+
+def build_messages(llm_prompt : str, selected_tasks : list, compact : bool = False):
+    """
+    生成发送给llm的 messages。
+
+    默认与原来一样，把缩进的任务JSON替换进提示词，整体作为一条用户消息。
+    compact 为 True 时，提示词作为系统消息，任务以紧凑格式作为用户消息：
+    同一轮中每批的系统消息完全相同，支持提示词缓存的服务商可以复用这部分前缀。
+    """
+    if not compact:
+        tasks_json_string = json.dumps(selected_tasks, indent=2, ensure_ascii=False)
+        return [{"role": "user", "content": llm_prompt.replace("INPUT_TASKS_JSON_STRING", tasks_json_string)}]
+
+    return [
+        {"role": "system", "content": llm_prompt.replace("INPUT_TASKS_JSON_STRING", TASKS_PLACEHOLDER)},
+        {"role": "user", "content": encode_tasks_compact(selected_tasks)}
+    ]
+
+
+def estimate_messages_tokens(messages : list):
+    return sum(estimate_tokens(message["content"]) for message in messages)
+
+
+def compare_encodings(llm_prompt : str, selected_tasks : list):
+    """
+    估算同一批任务在原格式与紧凑格式下的输入token数。
+
+    :return: (原格式token数, 紧凑格式token数, 其中系统消息的token数)
+    """
+    baseline = estimate_messages_tokens(build_messages(llm_prompt, selected_tasks, False))
+    messages = build_messages(llm_prompt, selected_tasks, True)
+    return baseline, estimate_messages_tokens(messages), estimate_tokens(messages[0]["content"])
@@ -68,6 +68,47 @@ INPUT_TASKS_JSON_STRING
 
 """
 
+prompt_template_3 = f"""
+你是一个高度智能、注重细节的中文校对批处理引擎。你的任务是接收一个JSON数组，并对每个任务进行独立的、整句的校对分析。每个任务包含一个完整的句子 "text"，以及读者在这个句子中划出的一个或多个片段 "snippets"。
+
+请严格遵循以下【核心规则】：
+1.  **独立处理**：数组中的每个对象都是一个独立任务，不要让任务之间互相影响。
+2.  **严格对应**：返回的JSON数组中的每个结果对象，必须通过`id`字段与输入任务一一对应。
+3.  **整句校对**：以「划线片段」为线索，校对整个「句子」，修正句中所有明显的错误，包括位于片段之外的错误。遵守“专注修正”、“忠于原意”的原则，不要改写没有错误的部分。
+4.  **原文照抄**：`original_text` 必须与输入的 "text" 完全相同；`corrected_text` 是修正后的整个句子。
+5.  **格式要求**：你的最终输出必须是一个严格的、完整的JSON数组。
+6.  **无错则返**：如果句子没有任何错误，请将`is_corrected`字段设为`false`，并确保 `corrected_text` 与 `original_text` 内容完全相同。
+
+【重点校对维度与特殊指令】
+在执行校对时，请特别关注并应用以下细则：
+1. 结构助词“的、地、得”辨析：
+    - 任务：精确审查并修正结构助词“的”、“地”、“得”的误用。
+    - 标准：“的”用于定语后修饰名词；“地”用于状语后修饰动词；“得”用于动词或形容词后连接补语。
+
+2. 常见错别字来源分析：
+    - 任务：识别并修正由常见输入法错误导致的错别字。
+    - 重点关注a (音近致错)：由拼音输入法造成的谐音或近音错误。例如：“在”与“再”；“部署”与“部属”。
+    - 重点关注b (形近致错)：由五笔等形码输入法造成的字形相近错误。例如：“己”与“已”；“戌”与“戍”。
+
+3. 技术性错误处理指令：
+    - 任务：忽略特定的、由程序处理产生的非内容性错误。
+    - 具体指令：若发现前后半角或全角引号（" " 或 “ ”）不匹配，且明显是由程序断句或片段截取造成的，请忽略此问题，不要将其视为需要修正的错误。
+---
+
+【输入任务列表 (JSON数组)】
+INPUT_TASKS_JSON_STRING
+
+---
+
+【输出结果列表 (JSON数组)】
+请根据上述要求，返回一个JSON数组，每个对象必须包含以下所有字段：
+- `id`: 字符串(string)，与输入任务对应。
+- `is_corrected`: 布尔值(boolean)，表示句子是否被修正。
+- `original_text`: 字符串(string)，原始的句子。
+- `corrected_text`: 字符串(string)，修正后的句子。
+- `explanation`: 字符串(string)，简要说明所有发现。
+"""
+
 json.dump(
     prompt_template,
     open("prompt_template.txt", "w", encoding="utf-8"),
@@ -80,4 +121,11 @@ json.dump(
     open("prompt_template_2.txt", "w", encoding="utf-8"),
     ensure_ascii=False,
     indent=4
+)
+
+json.dump(
+    prompt_template_3,
+    open("prompt_template_3.txt", "w", encoding="utf-8"),
+    ensure_ascii=False,
+    indent=4
 )
\ No newline at end of file
@@ -0,0 +1,87 @@
+import re
+import time
+import threading
+
+# 中日韩文字、全角标点等，大致每个字符对应一个token
+_WIDE_CHAR_PATTERN = re.compile(r'[\u2e80-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef\u3000-\u303f]')
+
+
+def estimate_tokens(text : str):
+    """
+    粗略估算文本的token数，用于限流，不需要精确。
+    中文等宽字符按每字1个token计算，其余字符按每4个字符1个token计算。
+    """
+    wide_chars = len(_WIDE_CHAR_PATTERN.findall(text))
+    return wide_chars + (len(text) - wide_chars + 3) // 4
+
+
+class TokenBucket:
+    """
+    令牌桶，按每分钟的额度匀速补充令牌，线程安全。
+    """
+
+    def __init__(self, per_minute : float):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.refill_per_second = float(per_minute) / 60.0
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.refill_per_second)
+        self.updated_at = now
+
+    def acquire(self, amount : float = 1):
+        """
+        取走 amount 个令牌，额度不足时阻塞等待。
+        单次请求超过桶容量时，等到桶满后放行，并记为欠额，由后续请求偿还。
+        """
+        needed = min(amount, self.capacity)
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= needed:
+                    self.tokens -= amount
+                    return
+                wait = (needed - self.tokens) / self.refill_per_second
+            time.sleep(wait)
+
+
+class RateLimiter:
+    """
+    同时限制每分钟请求数（RPM）与每分钟token数（TPM），未配置的一项不做限制。
+    """
+
+    def __init__(self, requests_per_minute : float = None, tokens_per_minute : float = None):
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+
+    def acquire(self, tokens : int):
+        if self.request_bucket:
+            self.request_bucket.acquire(1)
+        if self.token_bucket:
+            self.token_bucket.acquire(tokens)
+
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(llm_settings : dict):
+    """
+    根据 llm_settings 中的 requests_per_minute / tokens_per_minute 获取限流器。
+    额度是按API key计算的，因此同一个地址、模型和key的多轮请求共用同一个限流器。
+    两项都未配置时返回 None。
+    """
+    requests_per_minute = llm_settings.get("requests_per_minute")
+    tokens_per_minute = llm_settings.get("tokens_per_minute")
+    if not requests_per_minute and not tokens_per_minute:
+        return None
+
+    key = (llm_settings["llm_api_url"], llm_settings["llm_model"], llm_settings["llm_api_key"],
+           requests_per_minute, tokens_per_minute)
+    with _rate_limiters_lock:
+        if key not in _rate_limiters:
+            _rate_limiters[key] = RateLimiter(requests_per_minute, tokens_per_minute)
+        return _rate_limiters[key]
@@ -0,0 +1,250 @@
+# 在一个进程中依次运行 解析标注 → 定位 → 校正 → 应用 四个步骤，各步骤之间直接在内存中传递数据
+
+import os
+import json
+import time
+import argparse
+
+from apply_correction import apply_to_book
+from book_source import load_book
+from boundary_index import BoundaryIndex
+from clippings_parser import parse_and_group_clippings
+from clippings_to_pre_correction import build_pre_correction
+from correction_journal import CorrectionJournal, hash_data, hash_file
+from llm_cache import open_llm_cache
+from metrics import metrics, profile_stage
+from pipeline_state import open_pipeline_state
+from pre_correction_to_correction import run_correction
+
+STAGES = ["parse", "locate", "correct", "apply"]
+
+
+class PipelineContext:
+    """
+    各个步骤共用的资源：配置、状态存储，以及按路径缓存的书籍和边界索引。
+    同一本书在定位、校正（本地初筛）和应用步骤中只读取、解码一次；
+    边界索引在定位步骤中构建，应用步骤用它给不匹配和冲突的校正附上所在的句子。
+    """
+
+    def __init__(self, config : dict, save_intermediate : bool, resume : bool):
+        self.config = config
+        self.save_intermediate = save_intermediate
+        self.resume = resume
+        self.pipeline_state = open_pipeline_state(config.get("pipeline_state"))
+        self._books = {}
+        self._boundary_indexes = {}
+        self._book_hashes = {}
+
+    def book(self, book_path : str, encoding : str = None):
+        if book_path not in self._books:
+            self._books[book_path] = load_book(book_path, encoding)
+        return self._books[book_path]
+
+    def boundary_index(self, book_path : str, encoding : str = None):
+        if book_path not in self._boundary_indexes:
+            self._boundary_indexes[book_path] = BoundaryIndex(self.book(book_path, encoding))
+        return self._boundary_indexes[book_path]
+
+    def book_hash(self, book_path : str):
+        if self.pipeline_state is None:
+            return None
+        if book_path not in self._book_hashes:
+            self._book_hashes[book_path] = hash_file(book_path)
+        return self._book_hashes[book_path]
+
+    def close(self):
+        for book in self._books.values():
+            if hasattr(book, "close"):
+                book.close()
+        if self.pipeline_state is not None:
+            self.pipeline_state.close()
+
+
+def _write_json(path : str, data):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=4)
+    print(f"已保存到 '{path}'。")
+
+
+def _read_json(path : str):
+    if not os.path.exists(path):
+        print(f"错误: 找不到上一步的输出文件 '{path}'。")
+        exit(1)
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def run_parse(context : PipelineContext, clippings_file : str):
+    """
+    解析 My Clippings.txt，返回按书名分组的标注。
+    增量解析依赖上次的输出和断点，因此 grouped_clippings.json 总是会被写入。
+    """
+    output_path = context.config["clippings_to_pre_correction"]["clipping_json_path"]
+    grouped = parse_and_group_clippings(clippings_file, output_path)
+    if grouped is None:
+        print("错误: 解析标注文件失败。")
+        exit(1)
+    return grouped
+
+
+def run_locate(context : PipelineContext, grouped_clippings : dict):
+    """
+    定位配置中那本书的标注，返回 pre_correction.json 的内容。
+    """
+    settings = context.config["clippings_to_pre_correction"]
+    title = settings["book_title_in_clipping"]
+    if not grouped_clippings.get(title):
+        print(f"错误: 在标注文件中未找到书名 '{title}' 的标注。")
+        exit(1)
+
+    print(f"正在处理书名: '{title}' 的标注...")
+    book_path = settings["book_path"]
+    text = context.book(book_path, settings.get("book_encoding"))
+
+    pre_correction_list, _, _ = build_pre_correction(
+        text,
+        grouped_clippings[title],
+        settings.get("locations"),
+        settings.get("search_window_in_percentage", 0.05),
+        settings.get("max_edit_ratio", 0.1),
+        settings.get("merge_overlapping", True),
+        context.pipeline_state,
+        context.book_hash(book_path),
+        context.boundary_index(book_path, settings.get("book_encoding"))
+    )
+    return pre_correction_list
+
+
+def run_correct(context : PipelineContext, pre_correction_list : list):
+    """
+    把任务发送给llm校正，返回 correction.json 的内容。失败的任务总是保存到 failed_corrections.json。
+    """
+    if not pre_correction_list:
+        print("错误: 预校对列表为空。")
+        exit(1)
+
+    settings = context.config["pre_correction_to_correction"]
+    llm_cache = open_llm_cache(settings.get("llm_cache"))
+    journal = CorrectionJournal(settings.get("journal_path", "correction_journal.jsonl"), hash_data(pre_correction_list), resume=context.resume)
+    book_path = context.config["clippings_to_pre_correction"]["book_path"]
+    book_text = None
+    if (settings.get("triage") or {}).get("enabled", False):
+        book_text = context.book(book_path, context.config["clippings_to_pre_correction"].get("book_encoding"))
+
+    correction_list, failed_corrections = run_correction(settings, pre_correction_list, llm_cache, journal,
+                                                         context.pipeline_state, context.book_hash(book_path), book_text)
+
+    if failed_corrections:
+        _write_json('failed_corrections.json', failed_corrections)
+
+    if llm_cache is not None:
+        llm_cache.close()
+    return correction_list
+
+
+def run_apply(context : PipelineContext, correction_list : list):
+    """
+    把校正应用到原文，写入 correction_apply 中的 output_path，返回报告。
+    """
+    if not correction_list:
+        print("错误: 校正列表为空。")
+        exit(1)
+
+    settings = context.config["correction_apply"]
+    book_path = settings["book_path"]
+    report = apply_to_book(context.book(book_path, settings.get("book_encoding")), correction_list, settings["output_path"],
+                           context.pipeline_state, context.book_hash(book_path),
+                           context.boundary_index(book_path, settings.get("book_encoding")))
+
+    if settings.get("report_path"):
+        _write_json(settings["report_path"], report)
+    return report
+
+
+def load_stage_input(config : dict, stage : str):
+    """
+    从上一步的输出文件中读取某个步骤的输入，用于从中间开始运行。
+    """
+    if stage == "locate":
+        return _read_json(config["clippings_to_pre_correction"]["clipping_json_path"])
+    if stage == "correct":
+        return _read_json(config["pre_correction_to_correction"]["pre_correction_json_path"])
+    if stage == "apply":
+        return _read_json(config["correction_apply"]["correction_json_path"])
+    return None
+
+
+def save_stage_output(config : dict, stage : str, output):
+    """
+    保存某个步骤的输出，文件路径与单独运行各个脚本时相同。
+    """
+    if stage == "locate":
+        _write_json(config["clippings_to_pre_correction"]["pre_correction_json_path"], output)
+    elif stage == "correct":
+        _write_json(config["pre_correction_to_correction"]["correction_json_path"], output)
+
+
+def run_pipeline(config : dict, from_stage : str = "parse", to_stage : str = "apply", clippings_file : str = "My Clippings.txt",
+                 save_intermediate : bool = False, resume : bool = False):
+    """
+    依次运行 from_stage 到 to_stage 之间的步骤，每一步的输出直接作为下一步的输入。
+
+    从中间的步骤开始时，输入从上一步的输出文件中读取。
+    中间结果只在 save_intermediate 为 True 时写入文件；最后一步的输出总是会写入，
+    以便之后从下一步继续。应用步骤本身就会写入校正后的书籍。
+
+    :return: 每一步的用时（秒）。
+    """
+    stage_functions = {
+        "parse": lambda context, _: run_parse(context, clippings_file),
+        "locate": run_locate,
+        "correct": run_correct,
+        "apply": run_apply,
+    }
+
+    stages = STAGES[STAGES.index(from_stage):STAGES.index(to_stage) + 1]
+    if not stages:
+        print(f"错误: --from {from_stage} 在 --to {to_stage} 之后。")
+        exit(1)
+
+    context = PipelineContext(config, save_intermediate, resume)
+    timings = {}
+    try:
+        data = load_stage_input(config, stages[0])
+        for stage in stages:
+            print(f"\n===== {stage} =====")
+            started_at = time.perf_counter()
+            # 定位和应用两步可以选择做 cProfile / tracemalloc 分析
+            profile_settings = (config.get("metrics") or {}).get("profile") if stage in ("locate", "apply") else None
+            with metrics.stage(stage), profile_stage(stage, profile_settings):
+                data = stage_functions[stage](context, data)
+            if save_intermediate or stage == stages[-1]:
+                save_stage_output(config, stage, data)
+            timings[stage] = round(time.perf_counter() - started_at, 3)
+    finally:
+        context.close()
+
+    return timings
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="在一个进程中运行 解析标注 → 定位 → 校正 → 应用 的完整流程。")
+    parser.add_argument("--from", dest="from_stage", choices=STAGES, default="parse", help="从哪一步开始，默认为 parse。")
+    parser.add_argument("--to", dest="to_stage", choices=STAGES, default="apply", help="运行到哪一步为止，默认为 apply。")
+    parser.add_argument("--clippings-file", default="My Clippings.txt", help="Kindle 的标注文件路径。")
+    parser.add_argument("--save-intermediate", action="store_true", help="保存每一步的中间结果（pre_correction.json、correction.json）。")
+    parser.add_argument("--resume", action="store_true", help="校正步骤重放上次运行的日志，跳过已经完成的任务。")
+    args = parser.parse_args()
+
+    if not os.path.exists('config.json'):
+        print("错误: 找不到配置文件 'config.json'")
+        exit(1)
+
+    config = json.load(open('config.json', 'r', encoding='utf-8'))
+
+    timings = run_pipeline(config, args.from_stage, args.to_stage, args.clippings_file, args.save_intermediate, args.resume)
+
+    print("\n各步骤用时：" + "，".join(f"{stage} {seconds} 秒" for stage, seconds in timings.items()))
+
+    metrics.export(config.get("metrics"))
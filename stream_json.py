@@ -0,0 +1,69 @@
+import json
+
+
+class JSONArrayStreamParser:
+    """
+    增量解析流式返回的JSON数组，每当数组中的一个对象完整闭合，就立即解析出来。
+
+    模型返回的可能是裸数组 [...]，也可能是 {"results": [...]}，或者外面包着 ```json 代码块，
+    这里取第一个不在字符串中的 '[' 作为结果数组的开头。
+    流在中途断开时，之前已经闭合的对象都已经返回，只丢失最后一个不完整的对象。
+    """
+
+    def __init__(self):
+        self._in_string = False
+        self._escaped = False
+        # 进入结果数组之前为 None；之后为相对于数组的嵌套深度，数组内部为1
+        self._depth = None
+        self._object_chars = None
+        self.finished = False
+
+    def feed(self, text : str):
+        """
+        送入新收到的一段文本。
+
+        :return: 本段文本中闭合的对象列表。
+        """
+        objects = []
+        for char in text:
+            if self.finished:
+                break
+
+            if self._object_chars is not None:
+                self._object_chars.append(char)
+
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == '\\':
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+
+            if char == '"':
+                self._in_string = True
+            elif self._depth is None:
+                if char == '[':
+                    self._depth = 1
+            elif char in '[{':
+                if self._depth == 1 and char == '{':
+                    self._object_chars = [char]
+                self._depth += 1
+            elif char in ']}':
+                self._depth -= 1
+                if self._depth == 1 and self._object_chars is not None:
+                    objects.append(self._parse_object(''.join(self._object_chars)))
+                    self._object_chars = None
+                elif self._depth == 0:
+                    self.finished = True
+
+        return [obj for obj in objects if obj is not None]
+
+    @staticmethod
+    def _parse_object(object_text : str):
+        try:
+            return json.loads(object_text)
+        except json.JSONDecodeError as e:
+            print(f"错误: 无法解析流式返回的结果，已忽略: {e}")
+            return None
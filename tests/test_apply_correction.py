@@ -0,0 +1,37 @@
+import apply_correction
+from apply_correction import apply_to_book
+from boundary_index import BoundaryIndex
+
+TEXT = "第一句话。他慢慢的走回了家。第三句话。"
+
+
+def make_correction(correction_id, start, end, corrected_text, original_text=None):
+    return {
+        "id": correction_id,
+        "position_start": start,
+        "position_end": end,
+        "original_text": TEXT[start:end] if original_text is None else original_text,
+        "corrected_text": corrected_text,
+        "is_corrected": True
+    }
+
+
+def test_conflicts_and_mismatches_carry_their_sentence(tmp_path):
+    corrections = [
+        make_correction("1", 5, 14, "他慢慢地走回了家。"),
+        make_correction("2", 8, 9, "地"),
+        make_correction("3", 14, 18, "第三句子", original_text="不对的原文"),
+    ]
+    output_path = tmp_path / "out.txt"
+    report = apply_to_book(TEXT, corrections, str(output_path), boundary_index=BoundaryIndex(TEXT))
+
+    assert output_path.read_text(encoding='utf-8') == "第一句话。他慢慢地走回了家。第三句话。"
+    assert report["conflicts"][0]["id"] == "2"
+    assert report["conflicts"][0]["sentence"]["text"] == "他慢慢的走回了家。"
+    assert report["skipped"][0]["sentence"]["text"] == "第三句话。"
+
+
+def test_index_is_built_only_when_needed(tmp_path, monkeypatch):
+    monkeypatch.setattr(apply_correction, "BoundaryIndex", None)
+    report = apply_to_book(TEXT, [make_correction("1", 8, 9, "地")], str(tmp_path / "out.txt"))
+    assert report["applied"] == ["1"]
@@ -0,0 +1,108 @@
+import json
+
+import pytest
+
+from clippings_parser import PARSER_VERSION, _strip_title, default_checkpoint_path, parse_and_group_clippings, parse_clipping_entry, parse_metadata_line
+
+
+@pytest.mark.parametrize("line, expected", [
+    # 中文
+    ("- 您在第 12 页（位置 #177-178）的标注 | 添加于 2020年1月1日星期三 下午10:00:00",
+     {'type': 'highlight', 'page': 12, 'location_start': 177, 'location_end': 178, 'date': "2020年1月1日星期三 下午10:00:00"}),
+    ("- 您在位置 #180的笔记 | 添加于 2020年1月1日星期三 下午10:00:00",
+     {'type': 'note', 'page': None, 'location_start': 180, 'location_end': None, 'date': "2020年1月1日星期三 下午10:00:00"}),
+    # 英文，以及旧款 Kindle 的 "Loc." 和缩写的结束位置
+    ("- Your Highlight on page 12 | Location 177-178 | Added on Wednesday, January 1, 2020 10:00:00 PM",
+     {'type': 'highlight', 'page': 12, 'location_start': 177, 'location_end': 178, 'date': "Wednesday, January 1, 2020 10:00:00 PM"}),
+    ("- Highlight Loc. 1234-40  | Added on Monday, April 2, 2012, 09:12 PM",
+     {'type': 'highlight', 'page': None, 'location_start': 1234, 'location_end': 1240, 'date': "Monday, April 2, 2012, 09:12 PM"}),
+    ("- Your Bookmark on Location 500 | Added on Wednesday, January 1, 2020 10:00:00 PM",
+     {'type': 'bookmark', 'page': None, 'location_start': 500, 'location_end': None, 'date': "Wednesday, January 1, 2020 10:00:00 PM"}),
+    # 日文
+    ("- 12ページ|位置No. 177-178のハイライト |作成日: 2020年1月1日水曜日 22:00:00",
+     {'type': 'highlight', 'page': 12, 'location_start': 177, 'location_end': 178, 'date': "2020年1月1日水曜日 22:00:00"}),
+    # 德文
+    ("- Ihre Markierung auf Seite 12 | Position 177-178 | Hinzugefügt am Mittwoch, 1. Januar 2020 22:00:00",
+     {'type': 'highlight', 'page': 12, 'location_start': 177, 'location_end': 178, 'date': "Mittwoch, 1. Januar 2020 22:00:00"}),
+    ("- Ihre Notiz bei Position 180 | Hinzugefügt am Mittwoch, 1. Januar 2020 22:00:00",
+     {'type': 'note', 'page': None, 'location_start': 180, 'location_end': None, 'date': "Mittwoch, 1. Januar 2020 22:00:00"}),
+    # 法文
+    ("- Votre surlignement sur la page 12 | emplacement 177-178 | Ajouté le mercredi 1 janvier 2020 22:00:00",
+     {'type': 'highlight', 'page': 12, 'location_start': 177, 'location_end': 178, 'date': "mercredi 1 janvier 2020 22:00:00"}),
+    # 西班牙文
+    ("- Tu subrayado en la página 12 | posición 177-178 | Añadido el miércoles, 1 de enero de 2020 22:00:00",
+     {'type': 'highlight', 'page': 12, 'location_start': 177, 'location_end': 178, 'date': "miércoles, 1 de enero de 2020 22:00:00"}),
+    # 意大利文
+    ("- La tua evidenziazione a pagina 12 | posizione 177-178 | Aggiunto in data mercoledì 1 gennaio 2020 22:00:00",
+     {'type': 'highlight', 'page': 12, 'location_start': 177, 'location_end': 178, 'date': "mercoledì 1 gennaio 2020 22:00:00"}),
+    # 葡萄牙文
+    ("- Seu destaque na página 12 | posição 177-178 | Adicionado: quarta-feira, 1 de janeiro de 2020 22:00:00",
+     {'type': 'highlight', 'page': 12, 'location_start': 177, 'location_end': 178, 'date': "quarta-feira, 1 de janeiro de 2020 22:00:00"}),
+])
+def test_parse_metadata_line_locales(line, expected):
+    assert parse_metadata_line(line) == expected
+
+
+def test_position_inside_a_word_is_not_a_location():
+    metadata = parse_metadata_line("- Your Note on page 12 (composition 3) | Location 100 | Added on Monday")
+    assert metadata['location_start'] == 100
+
+
+def test_position_without_number_is_not_a_location():
+    metadata = parse_metadata_line("- Your Highlight at position of page 12 | Added on Monday")
+    assert metadata['page'] == 12
+    assert metadata['location_start'] is None
+
+
+def test_parse_metadata_line_rejects_other_lines():
+    assert parse_metadata_line("这是一段正文") is None
+    assert parse_metadata_line("- 没有类型和位置的一行") is None
+
+
+@pytest.mark.parametrize("line, expected", [
+    ("书名 (作者)", "书名"),
+    ("Foo (Bar) Baz (Author)", "Foo (Bar) Baz"),
+    ("Foo (Author (Ed.))", "Foo"),
+    ("(Untitled)", "(Untitled)"),
+    ("没有作者的书名", "没有作者的书名"),
+])
+def test_strip_title(line, expected):
+    assert _strip_title(line) == expected
+
+
+def test_parse_clipping_entry_keeps_multiline_text():
+    entry = "﻿书名 (作者)\r\n- 您在位置 #10-12的标注 | 添加于 2020年1月1日\r\n\r\n第一行\r\n第二行\r\n"
+    clipping = parse_clipping_entry(entry)
+    assert clipping['title'] == "书名"
+    assert clipping['text'] == "第一行\r\n第二行"
+
+
+def write_clippings(path, entries):
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        for title, metadata, text in entries:
+            f.write(f"{title}\r\n{metadata}\r\n\r\n{text}\r\n==========\r\n")
+
+
+def test_checkpoint_from_older_parser_forces_full_parse(tmp_path):
+    clippings_path = str(tmp_path / "My Clippings.txt")
+    output_json = str(tmp_path / "grouped_clippings.json")
+    write_clippings(clippings_path, [
+        ("中文书 (作者)", "- 您在位置 #10-12的标注 | 添加于 2020年1月1日", "中文标注"),
+        ("English Book (Author)", "- Your Highlight on Location 20-21 | Added on Monday", "English highlight"),
+    ])
+    parse_and_group_clippings(clippings_path, output_json)
+
+    # 模拟旧版本留下的结果：只有中文标注，没有 location_end 和 date，断点也没有版本
+    with open(output_json, 'w', encoding='utf-8') as f:
+        json.dump({"中文书": [{"page": None, "location_start": 10, "text": "中文标注"}]}, f, ensure_ascii=False)
+    checkpoint_path = default_checkpoint_path(output_json)
+    with open(checkpoint_path, 'r', encoding='utf-8') as f:
+        checkpoint = json.load(f)
+    assert checkpoint['parser_version'] == PARSER_VERSION
+    del checkpoint['parser_version']
+    with open(checkpoint_path, 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f)
+
+    grouped = parse_and_group_clippings(clippings_path, output_json)
+    assert set(grouped) == {"中文书", "English Book"}
+    assert grouped["中文书"] == [{"page": None, "location_start": 10, "location_end": 12, "date": "2020年1月1日", "text": "中文标注"}]
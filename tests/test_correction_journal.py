@@ -0,0 +1,35 @@
+import json
+
+from correction_journal import CorrectionJournal
+
+
+def result(result_id : int):
+    return {"id": str(result_id), "is_corrected": False, "original_text": "甲", "corrected_text": "甲"}
+
+
+def test_resume_after_truncated_line_keeps_later_batches(tmp_path):
+    path = str(tmp_path / "correction_journal.jsonl")
+    journal = CorrectionJournal(path, "hash")
+    journal.append("first", [result(1)])
+
+    # 模拟写入第二批时崩溃，只留下半行
+    line = json.dumps({"phase": "first", "results": [result(2)]}, ensure_ascii=False)
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(line[:len(line) // 2])
+
+    resumed = CorrectionJournal(path, "hash", resume=True)
+    assert set(resumed.get_completed("first")) == {"1"}
+    resumed.append("first", [result(3)])
+
+    replayed = CorrectionJournal(path, "hash", resume=True)
+    assert set(replayed.get_completed("first")) == {"1", "3"}
+    with open(path, 'r', encoding='utf-8') as f:
+        assert all(json.loads(line) for line in f)
+
+
+def test_resume_with_other_input_starts_over(tmp_path):
+    path = str(tmp_path / "correction_journal.jsonl")
+    CorrectionJournal(path, "hash").append("first", [result(1)])
+
+    journal = CorrectionJournal(path, "other", resume=True)
+    assert journal.get_completed("first") == {}
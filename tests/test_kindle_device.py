@@ -0,0 +1,98 @@
+import hashlib
+
+from kindle_device import SIGNATURE_SIZE, FakeDevice, sync_clippings_file
+
+
+def entry(index : int):
+    return f"书籍 (作者)\r\n- 您在位置 #{index}-{index + 1}的标注 | 添加于 2024年1月1日\r\n\r\n第{index}条标注\r\n==========\r\n".encode('utf-8')
+
+
+def make_data(count : int, start : int = 0):
+    return b"".join(entry(index) for index in range(start, start + count))
+
+
+def expected_state(device : FakeDevice, local_path : str):
+    data = device.data
+    return {
+        "name": device.name,
+        "size": len(data),
+        "mtime": device.mtime,
+        "head_hash": hashlib.sha256(data[:SIGNATURE_SIZE]).hexdigest(),
+        "tail_hash": hashlib.sha256(data[max(0, len(data) - SIGNATURE_SIZE):]).hexdigest(),
+        "local_path": local_path
+    }
+
+
+def test_first_sync_copies_whole_file(tmp_path):
+    local_path = str(tmp_path / "My Clippings.txt")
+    device = FakeDevice("kindle", make_data(200), mtime=1.0)
+    state = {}
+
+    assert sync_clippings_file(device, local_path, state) == (local_path, "full")
+    assert (tmp_path / "My Clippings.txt").read_bytes() == device.data
+    assert device.bytes_read == len(device.data)
+    assert state[device.id] == expected_state(device, local_path)
+
+
+def test_unchanged_file_is_not_read(tmp_path):
+    local_path = str(tmp_path / "My Clippings.txt")
+    device = FakeDevice("kindle", make_data(200), mtime=1.0)
+    state = {}
+    sync_clippings_file(device, local_path, state)
+    saved = dict(state[device.id])
+    device.bytes_read = 0
+
+    assert sync_clippings_file(device, local_path, state) == (local_path, "unchanged")
+    assert device.bytes_read == 0
+    assert (tmp_path / "My Clippings.txt").read_bytes() == device.data
+    assert state[device.id] == saved
+
+
+def test_appended_clippings_download_only_new_bytes(tmp_path):
+    local_path = str(tmp_path / "My Clippings.txt")
+    device = FakeDevice("kindle", make_data(200), mtime=1.0)
+    state = {}
+    sync_clippings_file(device, local_path, state)
+    old_size = len(device.data)
+    assert old_size > 2 * SIGNATURE_SIZE
+
+    appended = make_data(5, start=200)
+    device.append(appended)
+    device.bytes_read = 0
+
+    assert sync_clippings_file(device, local_path, state) == (local_path, "appended")
+    assert (tmp_path / "My Clippings.txt").read_bytes() == device.data
+    # 只读取了用于校验的开头和原来的末尾，以及新增的部分
+    assert device.bytes_read == 2 * SIGNATURE_SIZE + len(appended)
+    assert state[device.id] == expected_state(device, local_path)
+    assert state[device.id]["size"] == old_size + len(appended)
+
+
+def test_rewritten_file_is_copied_again(tmp_path):
+    local_path = str(tmp_path / "My Clippings.txt")
+    device = FakeDevice("kindle", make_data(200), mtime=1.0)
+    state = {}
+    sync_clippings_file(device, local_path, state)
+
+    # 删除了开头的标注：文件更长，但已不是原来文件的前缀
+    device.rewrite(make_data(300, start=1))
+    device.bytes_read = 0
+
+    assert sync_clippings_file(device, local_path, state) == (local_path, "full")
+    assert (tmp_path / "My Clippings.txt").read_bytes() == device.data
+    assert state[device.id] == expected_state(device, local_path)
+
+
+def test_device_without_partial_read_copies_whole_file_on_append(tmp_path):
+    local_path = str(tmp_path / "My Clippings.txt")
+    device = FakeDevice("kindle", make_data(10), mtime=1.0, supports_partial_read=False)
+    state = {}
+    sync_clippings_file(device, local_path, state)
+
+    device.append(make_data(1, start=10))
+    device.bytes_read = 0
+
+    assert sync_clippings_file(device, local_path, state) == (local_path, "full")
+    assert device.bytes_read == len(device.data)
+    assert (tmp_path / "My Clippings.txt").read_bytes() == device.data
+    assert state[device.id] == expected_state(device, local_path)
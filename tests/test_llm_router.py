@@ -0,0 +1,23 @@
+from llm_router import served_model
+
+BASE_SETTINGS = {
+    "llm_api_url": "http://127.0.0.1:8000/v1/chat/completions",
+    "llm_api_key": "",
+    "llm_model": "model-a",
+    "llm_temperature": 0.2,
+    "llm_prompt": "INPUT_TASKS_JSON_STRING"
+}
+
+
+def test_served_model_without_endpoints():
+    assert served_model(BASE_SETTINGS) == "model-a"
+
+
+def test_served_model_uses_the_endpoints_model():
+    settings = dict(BASE_SETTINGS, endpoints=[{"llm_model": "model-b"}, {"llm_model": "model-b", "weight": 2}])
+    assert served_model(settings) == "model-b"
+
+
+def test_served_model_is_none_when_endpoints_use_different_models():
+    settings = dict(BASE_SETTINGS, endpoints=[{}, {"llm_model": "model-b"}])
+    assert served_model(settings) is None
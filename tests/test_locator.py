@@ -0,0 +1,76 @@
+import random
+
+from locator import locate_clippings
+from text_matcher import find_closest, match_text
+
+PHRASE = "重复出现的一句话"
+
+
+def make_text(positions : list, length : int = 4000):
+    rng = random.Random(0)
+    chars = [rng.choice("abcdefghij") for _ in range(length)]
+    for position in positions:
+        chars[position:position + len(PHRASE)] = PHRASE
+    return "".join(chars)
+
+
+def test_find_closest_prefers_the_nearest_occurrence():
+    text = make_text([1000, 1200, 1400])
+    assert find_closest(text, PHRASE, 1190) == 1200
+    assert find_closest(text, PHRASE, 1390, 0, 1300) == 1200
+    assert find_closest(text, PHRASE, 0, 1500) == -1
+
+
+def test_match_text_exact_tier_uses_the_estimate():
+    text = make_text([1000, 1200])
+    match = match_text(text, PHRASE, 900, 1300, 1210)
+    assert (match['start'], match['method']) == (1200, 'exact')
+
+
+def test_locate_clippings_anchors_repeated_phrase_near_the_estimate():
+    text = make_text([1000, 1200])
+    clippings = [{'location_start': 1200, 'text': PHRASE}]
+    matches, _ = locate_clippings(text, clippings, {'start': 0, 'end': len(text)})
+    assert matches[0]['start'] == 1200
+    assert matches[0]['method'] == 'exact'
+
+
+def test_short_clipping_with_one_substitution_is_matched_fuzzily():
+    filler = make_text([], 1000)
+    text = filler + "他慢慢地走回了家" + filler
+    match = match_text(text, "他慢慢的走回了家", 900, 1100, 1000)
+    assert (match['start'], match['end'], match['method']) == (1000, 1008, 'fuzzy')
+
+
+def test_very_short_clipping_is_not_matched_fuzzily():
+    text = "abc" * 100 + "走回家" + "abc" * 100
+    assert match_text(text, "跑回家", 250, 350, 300) is None
+
+
+def test_match_text_counts_scanned_chars_in_every_tier():
+    text = make_text([], 20000)
+    stats = {}
+    assert match_text(text, PHRASE, 1000, 2000, 1500, stats=stats) is None
+    # 窗口内的精确与规范化查找，加上整本书的精确与规范化查找
+    assert stats['scanned_chars'] >= 2 * 1000 + 2 * len(text)
+
+
+def test_locate_clippings_counts_match_text_scanning():
+    text = make_text([], 20000)
+    clippings = [{'location_start': 5000, 'text': "书中没有的一段标注文字"}]
+    matches, stats = locate_clippings(text, clippings, {'start': 0, 'end': len(text)})
+    assert matches[0] is None
+    assert stats['scanned_chars'] >= len(text)
+
+
+def test_phase_two_matches_become_anchors_when_phase_one_finds_none():
+    first, second = "第一段足够长可以作为锚点的文字", "第二段足够长可以作为锚点的文字"
+    chars = list(make_text([], 20000))
+    # 每段文字在附近出现两次，第一阶段不能把它们作为锚点
+    for position, phrase in ((5000, first), (5300, first), (15000, second), (15300, second)):
+        chars[position:position + len(phrase)] = phrase
+    text = "".join(chars)
+    clippings = [{'location_start': 5000, 'text': first}, {'location_start': 15000, 'text': second}]
+    matches, stats = locate_clippings(text, clippings, {'start': 0, 'end': len(text)})
+    assert [match['start'] for match in matches] == [5000, 15000]
+    assert stats['anchors'] == 2
@@ -0,0 +1,36 @@
+import pre_correction_to_correction as correction
+from pipeline_state import STAGE_CORRECTED, PipelineState, correction_settings_key, item_key
+
+LLM_SETTINGS = {"llm_model": "model-a", "llm_temperature": 0.2, "llm_prompt": "prompt INPUT_TASKS_JSON_STRING"}
+
+TASK = {"id": 1, "location_start": 10, "position_start": 0, "position_end": 2, "text": "甲乙", "sentence": {"text": "甲乙。"}}
+
+
+def test_item_key_depends_on_correction_settings():
+    base = correction_settings_key(LLM_SETTINGS, ["model-a"])
+    assert item_key(TASK, base) == item_key(dict(TASK, id=2), base)
+    assert item_key(TASK, base) != item_key(TASK, correction_settings_key(LLM_SETTINGS, ["model-b"]))
+    assert item_key(TASK, base) != item_key(TASK, correction_settings_key(dict(LLM_SETTINGS, llm_prompt="other"), ["model-a"]))
+    assert item_key(TASK, base) != item_key(TASK, correction_settings_key(dict(LLM_SETTINGS, llm_temperature=0.5), ["model-a"]))
+    assert item_key(TASK, base) != item_key(TASK, correction_settings_key(dict(LLM_SETTINGS, compact_prompt=True), ["model-a"]))
+
+
+def test_changing_the_model_corrects_stored_tasks_again(tmp_path, monkeypatch):
+    sent = []
+
+    def fake_get_correction(llm_settings, pre_correction_list, *args):
+        sent.append([task["id"] for task in pre_correction_list])
+        return [{"id": task["id"], "model": llm_settings["llm_model"]} for task in pre_correction_list], []
+
+    monkeypatch.setattr(correction, "get_correction", fake_get_correction)
+    state = PipelineState(str(tmp_path / "pipeline_state.sqlite"))
+
+    def run(llm_settings):
+        results, _ = correction.get_correction_incremental(state, "book", STAGE_CORRECTED, llm_settings, [TASK], 10, None, None)
+        return results
+
+    assert run(LLM_SETTINGS)[0]["model"] == "model-a"
+    assert run(LLM_SETTINGS)[0]["model"] == "model-a"
+    assert run(dict(LLM_SETTINGS, llm_model="model-b"))[0]["model"] == "model-b"
+    assert sent == [[1], [1]]
+    state.close()
@@ -0,0 +1,48 @@
+import json
+
+from prompt_encoding import COMPACT_ENCODING_NOTE, encode_tasks_compact
+
+
+def decode(encoded : str):
+    """
+    按 COMPACT_ENCODING_NOTE 的说明还原任务。
+    """
+    data = json.loads(encoded[len(COMPACT_ENCODING_NOTE):])
+    tasks = []
+    for task in data["tasks"]:
+        decoded = {}
+        for field, value in task.items():
+            if field.endswith("_ref"):
+                decoded[field[:-len("_ref")]] = data["contexts"][value]
+            else:
+                decoded[field] = value
+        tasks.append(decoded)
+    return data, tasks
+
+
+def test_repeated_contexts_are_sent_once():
+    tasks = [
+        {"id": "1", "text": "甲", "sentence": "同一句话。"},
+        {"id": "2", "text": "乙", "sentence": "同一句话。"},
+        {"id": "3", "text": "丙", "sentence": "另一句话。"},
+    ]
+    data, decoded = decode(encode_tasks_compact(tasks))
+    assert list(data["contexts"].values()) == ["同一句话。"]
+    assert data["tasks"][2]["sentence"] == "另一句话。"
+    assert decoded == tasks
+
+
+def test_sentence_that_looks_like_a_key_is_not_a_reference():
+    tasks = [
+        {"id": "1", "text": "甲", "sentence": "重复的句子"},
+        {"id": "2", "text": "乙", "sentence": "重复的句子"},
+        {"id": "3", "text": "S1", "sentence": "S1"},
+    ]
+    data, decoded = decode(encode_tasks_compact(tasks))
+    assert data["tasks"][2] == {"id": "3", "text": "S1", "sentence": "S1"}
+    assert decoded == tasks
+
+
+def test_without_repeats_tasks_are_a_plain_array():
+    tasks = [{"id": "1", "text": "甲", "sentence": "一句话。"}]
+    assert json.loads(encode_tasks_compact(tasks)) == tasks
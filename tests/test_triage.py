@@ -0,0 +1,29 @@
+from triage import BigramModel, find_candidates, triage
+
+BOOK = "他慢慢地走回家。我的书放在桌上。明天再来看看。" * 50
+
+
+def make_task(sentence : str):
+    return {
+        'id': 1, 'location_start': 0, 'position_start': 0, 'position_end': len(sentence),
+        'text': sentence, 'sentence': {'text': sentence}, 'paragraph': {'text': sentence}
+    }
+
+
+def test_frequent_confusions_are_flagged_when_the_context_prefers_the_alternative():
+    model = BigramModel(BOOK)
+    assert find_candidates("他慢慢的走回家。", model)
+    assert find_candidates("明天在来看看。", model)
+
+
+def test_clean_sentence_with_frequent_characters_is_skipped():
+    model = BigramModel(BOOK)
+    assert not find_candidates("他慢慢地走回家。", model)
+    assert not find_candidates("我的书放在桌上。", model)
+
+
+def test_triage_sends_only_flagged_tasks():
+    flagged, resolved = triage([make_task("他慢慢的走回家。"), dict(make_task("我的书放在桌上。"), id=2)], BigramModel(BOOK))
+    assert [task['id'] for task in flagged] == [1]
+    assert [result['id'] for result in resolved] == [2]
+    assert resolved[0]['is_corrected'] is False
@@ -0,0 +1,285 @@
+import unicodedata
+
+# NFKC 不会处理的弯引号，统一为直引号
+_QUOTE_TABLE = str.maketrans({
+    '\u201c': '"', '\u201d': '"', '\u201e': '"', '\u201f': '"',
+    '\u2018': "'", '\u2019': "'", '\u201a': "'", '\u201b': "'",
+})
+
+# 各层匹配结果的置信度
+EXACT_CONFIDENCE = 1.0
+NORMALIZED_CONFIDENCE = 0.95
+FUZZY_CONFIDENCE = 0.9
+WHOLE_BOOK_PENALTY = 0.8
+
+# 标注不短于这个长度时，即使按 max_edit_ratio 算出的编辑距离不到1，也允许一个字的差异
+MIN_FUZZY_LENGTH = 4
+
+# 整本书查找规范化文本时，每次处理的字符数
+WHOLE_BOOK_CHUNK_SIZE = 1 << 20
+
+
+def normalize_with_map(text : str, base : int = 0):
+    """
+    规范化文本：全角转半角（NFKC）、统一引号、去掉所有空白字符（包括 \\r\\n）。
+
+    :param text: 原始文本。
+    :param base: text 在原文中的起始位置，会加到偏移表中。
+    :return: (normalized, offsets)，offsets[i] 为 normalized[i] 在原文中的位置。
+    """
+    normalized = []
+    offsets = []
+    for i, char in enumerate(text):
+        if char.isspace():
+            continue
+        if char.isascii():
+            normalized.append(char)
+            offsets.append(base + i)
+            continue
+        for normalized_char in unicodedata.normalize('NFKC', char).translate(_QUOTE_TABLE):
+            if not normalized_char.isspace():
+                normalized.append(normalized_char)
+                offsets.append(base + i)
+    return ''.join(normalized), offsets
+
+
+def normalize_text(text : str):
+    """
+    只返回规范化后的文本，规则与 normalize_with_map 相同。
+    """
+    return normalize_with_map(text)[0]
+
+
+def _myers_best_end(pattern : str, text : str, max_distance : int):
+    """
+    Myers 位并行算法：在 text 中查找与 pattern 编辑距离最小的子串。
+
+    :return: (distance, end)，end 为子串最后一个字符的位置；没有距离不超过 max_distance 的子串时返回 None。
+    """
+    m = len(pattern)
+    if m == 0:
+        return None
+
+    peq = {}
+    for i, char in enumerate(pattern):
+        peq[char] = peq.get(char, 0) | (1 << i)
+
+    full = (1 << m) - 1
+    high_bit = 1 << (m - 1)
+    pv = full
+    mv = 0
+    score = m
+    best = None
+
+    for j, char in enumerate(text):
+        eq = peq.get(char, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = (mv | ~(xh | pv)) & full
+        mh = pv & xh
+        if ph & high_bit:
+            score += 1
+        elif mh & high_bit:
+            score -= 1
+        ph = (ph << 1) & full
+        mh = (mh << 1) & full
+        pv = (mh | ~(xv | ph)) & full
+        mv = ph & xv
+
+        if score <= max_distance and (best is None or score < best[0]):
+            best = (score, j)
+            if score == 0:
+                break
+
+    return best
+
+
+def _fuzzy_find(pattern : str, text : str, max_distance : int):
+    """
+    在 text 中查找与 pattern 编辑距离不超过 max_distance 的子串。
+
+    :return: (distance, start, end)，end 不包含在子串内；找不到时返回 None。
+    """
+    best = _myers_best_end(pattern, text, max_distance)
+    if best is None:
+        return None
+    distance, end = best
+
+    # 反向再做一次，找到子串的起点
+    window_start = max(0, end + 1 - len(pattern) - max_distance)
+    reversed_text = text[window_start:end + 1][::-1]
+    reverse_best = _myers_best_end(pattern[::-1], reversed_text, distance)
+    if reverse_best is None:
+        return None
+    start = end - reverse_best[1]
+    return distance, start, end + 1
+
+
+def _candidate_regions(pattern : str, text : str, max_distance : int):
+    """
+    鸽巢原理：把 pattern 切成 max_distance + 1 段，编辑距离不超过 max_distance 的匹配中
+    至少有一段原样出现。只返回这些段出现位置附近的区域，避免在整个窗口上做模糊匹配。
+
+    :return: 合并后的区域列表 [(start, end)]；片段太短、无法有效筛选时返回 None。
+    """
+    m = len(pattern)
+    pieces = max_distance + 1
+    piece_length = m // pieces
+    if piece_length < 2:
+        return None
+
+    regions = []
+    for p in range(pieces):
+        piece_start = p * piece_length
+        piece = pattern[piece_start:piece_start + piece_length]
+        found = text.find(piece)
+        while found != -1:
+            region_start = max(0, found - piece_start - max_distance)
+            region_end = min(len(text), found - piece_start + m + max_distance)
+            regions.append((region_start, region_end))
+            found = text.find(piece, found + 1)
+
+    regions.sort()
+    merged = []
+    for region in regions:
+        if merged and region[0] <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], region[1]))
+        else:
+            merged.append(region)
+    return merged
+
+
+def _count_scanned(stats : dict, chars : int):
+    """
+    把扫描过的字符数累加到 stats['scanned_chars']，未传入 stats 时不统计。
+    """
+    if stats is not None:
+        stats['scanned_chars'] = stats.get('scanned_chars', 0) + chars
+
+
+def find_closest(text : str, pattern : str, estimated_pos : int, start : int = 0, end : int = None):
+    """
+    在 text[start:end] 中查找 pattern，多处出现时返回离 estimated_pos 最近的位置，找不到时返回 -1。
+    越过 estimated_pos 之后的第一处就停止，后面的只会更远。
+    """
+    if end is None:
+        end = len(text)
+    best = -1
+    found = text.find(pattern, start, end)
+    while found != -1:
+        if best == -1 or abs(found - estimated_pos) < abs(best - estimated_pos):
+            best = found
+        if found > estimated_pos:
+            break
+        found = text.find(pattern, found + 1, end)
+    return best
+
+
+def _closest_scanned_end(found_pos : int, estimated_pos : int, pattern : str, end : int):
+    """
+    find_closest 实际扫描到的位置：找到时越过估算位置后的第一处就停止，找不到时扫描到 end。
+    """
+    if found_pos == -1:
+        return end
+    return min(end, max(found_pos, estimated_pos) + len(pattern))
+
+
+def _match_normalized(text : str, pattern : str, search_start : int, search_end : int, max_edit_ratio : float, stats : dict = None):
+    """
+    在 text[search_start:search_end] 中按规范化文本匹配，必要时进行模糊匹配。
+
+    :return: 匹配结果字典，找不到时返回 None。
+    """
+    normalized_pattern = normalize_text(pattern)
+    if not normalized_pattern:
+        return None
+
+    normalized_window, offsets = normalize_with_map(text[search_start:search_end], search_start)
+    _count_scanned(stats, search_end - search_start)
+
+    found = normalized_window.find(normalized_pattern)
+    if found != -1:
+        return {
+            'start': offsets[found],
+            'end': offsets[found + len(normalized_pattern) - 1] + 1,
+            'confidence': NORMALIZED_CONFIDENCE,
+            'method': 'normalized'
+        }
+
+    # 中文标注常常只有几个字，按比例算出的编辑距离为0，一个错字就无法匹配
+    max_distance = int(len(normalized_pattern) * max_edit_ratio)
+    if max_distance < 1 and max_edit_ratio > 0 and len(normalized_pattern) >= MIN_FUZZY_LENGTH:
+        max_distance = 1
+    if max_distance < 1:
+        return None
+
+    regions = _candidate_regions(normalized_pattern, normalized_window, max_distance)
+    if regions is None:
+        regions = [(0, len(normalized_window))]
+
+    best = None
+    for region_start, region_end in regions:
+        _count_scanned(stats, region_end - region_start)
+        fuzzy = _fuzzy_find(normalized_pattern, normalized_window[region_start:region_end], max_distance)
+        if fuzzy and (best is None or fuzzy[0] < best[0]):
+            best = (fuzzy[0], region_start + fuzzy[1], region_start + fuzzy[2])
+
+    if best is None:
+        return None
+
+    distance, start, end = best
+    return {
+        'start': offsets[start],
+        'end': offsets[end - 1] + 1,
+        'confidence': round(FUZZY_CONFIDENCE * (1 - distance / len(normalized_pattern)), 4),
+        'method': 'fuzzy'
+    }
+
+
+def match_text(text : str, pattern : str, search_start : int, search_end : int, estimated_pos : int, max_edit_ratio : float = 0.1, stats : dict = None):
+    """
+    分层查找标注文本在原文中的位置，每一层只在上一层失败时才会执行：
+
+    1. 在窗口内精确查找，多处出现时取离估算位置最近的；
+    2. 在窗口内按规范化文本查找（全角/半角、引号、空白与换行差异），再通过偏移表映射回原文；
+    3. 在窗口内做编辑距离不超过 len * max_edit_ratio 的模糊匹配（不短于 MIN_FUZZY_LENGTH 个字时至少允许1），只扫描候选区域；
+    4. 在整本书中精确查找，再按规范化文本分块查找，取离估算位置最近的结果。
+
+    :param text: 原文。
+    :param pattern: 标注文本。
+    :param search_start: 窗口起点。
+    :param search_end: 窗口终点。
+    :param estimated_pos: 估算的字符位置，多处出现时用于在结果中选择。
+    :param max_edit_ratio: 模糊匹配允许的最大编辑距离占标注长度的比例。
+    :param stats: 可选，各层扫描过的字符数会累加到其中的 'scanned_chars'（模糊匹配按候选区域计算）。
+    :return: {'start', 'end', 'confidence', 'method'}，找不到时返回 None。
+    """
+    found_pos = find_closest(text, pattern, estimated_pos, search_start, search_end)
+    _count_scanned(stats, _closest_scanned_end(found_pos, estimated_pos, pattern, search_end) - search_start)
+    if found_pos != -1:
+        return {'start': found_pos, 'end': found_pos + len(pattern), 'confidence': EXACT_CONFIDENCE, 'method': 'exact'}
+
+    match = _match_normalized(text, pattern, search_start, search_end, max_edit_ratio, stats)
+    if match:
+        return match
+
+    found_pos = find_closest(text, pattern, estimated_pos)
+    _count_scanned(stats, _closest_scanned_end(found_pos, estimated_pos, pattern, len(text)))
+    if found_pos != -1:
+        return {'start': found_pos, 'end': found_pos + len(pattern), 'confidence': EXACT_CONFIDENCE * WHOLE_BOOK_PENALTY, 'method': 'whole_book_exact'}
+
+    # 整本书的规范化查找按块进行，相邻块之间留出足够的重叠
+    overlap = len(pattern) * 4 + 64
+    best = None
+    for chunk_start in range(0, len(text), WHOLE_BOOK_CHUNK_SIZE):
+        chunk_end = min(len(text), chunk_start + WHOLE_BOOK_CHUNK_SIZE + overlap)
+        match = _match_normalized(text, pattern, chunk_start, chunk_end, 0, stats)
+        if match and (best is None or abs(match['start'] - estimated_pos) < abs(best['start'] - estimated_pos)):
+            best = match
+        if best and best['start'] > estimated_pos:
+            break
+
+    if best:
+        best['confidence'] = round(best['confidence'] * WHOLE_BOOK_PENALTY, 4)
+        best['method'] = 'whole_book_normalized'
+    return best
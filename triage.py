@@ -0,0 +1,196 @@
+import re
+import math
+from collections import Counter
+
+from book_source import iter_text_chunks
+from metrics import metrics
+
+# 单字的混淆集：字形相近、容易在排版或OCR中混淆，而且本身不太常用的字。
+# 书中的用法只要与替换字相差不多（见 find_candidates 的 margin），就发送给大模型
+CHAR_CONFUSION_SETS = [
+    "己已巳",
+    "戌戍戊",
+    "末未",
+    "鸟乌",
+    "拔拨",
+    "侯候",
+    "辨辩辫",
+    "竟竞",
+    "杨扬",
+    "历厉",
+    "晴睛",
+    "汩汨",
+    "祟崇",
+    "赢嬴羸",
+    "徒徙",
+]
+
+# 常用字的混淆集：结构助词“的、地、得”和“在、再”。这些字几乎每句都有，
+# 用与上面相同的 margin 会使大部分标注都被发送，因此使用更小的 frequent_margin
+FREQUENT_CONFUSION_SETS = [
+    "的地得",
+    "在再",
+]
+
+# frequent_margin 的默认值，取值的依据见 benchmark_triage.py 与 readme
+DEFAULT_FREQUENT_MARGIN = 0.5
+
+# 词语的混淆集，词语整体比较，不拆成单字
+WORD_CONFUSION_SETS = [
+    ("部署", "部属"),
+    ("必须", "必需"),
+    ("即使", "既使"),
+    ("以致", "以至"),
+    ("截止", "截至"),
+    ("反应", "反映"),
+    ("权利", "权力"),
+    ("度过", "渡过"),
+    ("启用", "起用"),
+    ("做客", "作客"),
+    ("品味", "品位"),
+    ("不只", "不止"),
+    ("账号", "帐号"),
+    ("震撼", "震憾"),
+    ("再接再厉", "再接再励"),
+    ("一股作气", "一鼓作气"),
+]
+
+CHAR_ALTERNATIVES = {char: [other for other in group if other != char]
+                     for group in CHAR_CONFUSION_SETS + FREQUENT_CONFUSION_SETS for char in group}
+FREQUENT_CHARS = set("".join(FREQUENT_CONFUSION_SETS))
+WORD_ALTERNATIVES = {word: [other for other in group if other != word] for group in WORD_CONFUSION_SETS for word in group}
+
+# 自动判定为无错时写入的说明
+TRIAGE_EXPLANATION = "本地预筛未发现可疑的错误，未发送给大模型。"
+
+
+# 至少有一个字在混淆集中的二元组，只有这些会被 BigramModel.log_prob 查询
+CONFUSION_BIGRAM_PATTERN = re.compile("(?=(.[{0}]|[{0}].))".format("".join(CHAR_ALTERNATIVES)), re.DOTALL)
+
+
+class BigramModel:
+    """
+    用书籍本身统计的字二元语法模型，给一个字在上下文中出现的可能性打分。
+
+    同一本书中的用字习惯最有参考价值：如果书中其他地方“自己”远比“自已”常见，
+    那么标注中的“自已”就值得让大模型看一看。
+
+    打分时只会查询含有混淆集中的字的二元组，因此只统计这些二元组，
+    占用的内存取决于混淆集的大小和书中不同字的个数，与书的长度无关。
+    """
+
+    def __init__(self, text):
+        """
+        :param text: 书籍全文，str 或 book_source.MappedBook。
+        """
+        self.unigrams = Counter()
+        self.bigrams = Counter()
+        # 相邻的块重叠一个字，跨越块边界的二元组只统计一次
+        for chunk_start, chunk in iter_text_chunks(text, 1 << 20, 1):
+            own = chunk if chunk_start + len(chunk) >= len(text) else chunk[:-1]
+            self.unigrams.update(own)
+            self.bigrams.update(CONFUSION_BIGRAM_PATTERN.findall(chunk))
+
+        self.text = text
+        self.vocabulary = max(1, len(self.unigrams))
+        self._word_counts = {}
+
+    def log_prob(self, previous : str, char : str):
+        """
+        加一平滑的 log P(char | previous)，previous 和 char 中至少有一个在混淆集中。
+        """
+        return math.log((self.bigrams[previous + char] + 1) / (self.unigrams[previous] + self.vocabulary))
+
+    def context_score(self, sentence : str, index : int, char : str):
+        """
+        把 sentence[index] 换成 char 之后，它与前后两个字组成的二元语法的得分。
+        """
+        score = 0.0
+        if index > 0:
+            score += self.log_prob(sentence[index - 1], char)
+        if index + 1 < len(sentence):
+            score += self.log_prob(char, sentence[index + 1])
+        return score
+
+    def word_count(self, word : str):
+        """
+        词语在书中出现的次数，第一次查询时统计后缓存。
+        """
+        if word not in self._word_counts:
+            count = 0
+            for _, chunk in iter_text_chunks(self.text, 1 << 20, len(word) - 1):
+                count += chunk.count(word)
+            self._word_counts[word] = count
+        return self._word_counts[word]
+
+
+def find_candidates(sentence : str, model : BigramModel, margin : float = 1.0, frequent_margin : float = DEFAULT_FREQUENT_MARGIN):
+    """
+    找出句子中可能有错的位置。
+
+    对混淆集中的每个字，比较原字和替换字在上下文中的得分，替换字的得分超过原字减去 margin 时记为候选；
+    常用字（FREQUENT_CONFUSION_SETS）改用更小的 frequent_margin。
+    对混淆集中的词语，替换词在书中出现的次数多于原词时记为候选。
+    两个 margin 越大越保守，发送给大模型的标注越多，漏掉的错误越少；越小则跳过的越多。
+
+    :return: 候选列表 [(位置, 原文, 可能的替换)]。
+    """
+    candidates = []
+    for index, char in enumerate(sentence):
+        alternatives = CHAR_ALTERNATIVES.get(char)
+        if not alternatives:
+            continue
+        original_score = model.context_score(sentence, index, char)
+        threshold = original_score - (frequent_margin if char in FREQUENT_CHARS else margin)
+        for alternative in alternatives:
+            if model.context_score(sentence, index, alternative) > threshold:
+                candidates.append((index, char, alternative))
+
+    for word, alternatives in WORD_ALTERNATIVES.items():
+        start = sentence.find(word)
+        while start != -1:
+            for alternative in alternatives:
+                if model.word_count(alternative) > model.word_count(word):
+                    candidates.append((start, word, alternative))
+            start = sentence.find(word, start + 1)
+
+    return candidates
+
+
+def triage(pre_correction_list : list, model : BigramModel, margin : float = 1.0, frequent_margin : float = DEFAULT_FREQUENT_MARGIN):
+    """
+    在发送给大模型之前，用混淆集和二元语法模型在本地预筛标注。
+
+    检查的范围是标注所在的整个句子，因为第一轮还要判断片段之外是否有错。
+    没有任何候选的标注直接判定为 is_corrected 为 false，输出格式与第一轮的结果相同；
+    有候选的标注照常发送给大模型。
+
+    :return: (flagged, resolved)，flagged 为需要发送给大模型的任务，resolved 为自动判定的结果。
+    """
+    flagged = []
+    resolved = []
+    for pre_correction in pre_correction_list:
+        sentence = pre_correction['sentence']['text'] or pre_correction['text']
+        if find_candidates(sentence, model, margin, frequent_margin):
+            flagged.append(pre_correction)
+            continue
+        resolved.append({
+            'id': pre_correction['id'],
+            "location_start": pre_correction['location_start'],
+            "position_start": pre_correction['position_start'],
+            "position_end": pre_correction['position_end'],
+            'is_corrected': False,
+            'original_text': pre_correction['text'],
+            'corrected_text': pre_correction['text'],
+            'sentence': pre_correction['sentence'],
+            "paragraph": pre_correction['paragraph'],
+            'explanation': TRIAGE_EXPLANATION,
+            "error_outside_snippet": False
+        })
+
+    total = len(pre_correction_list)
+    metrics.inc("triage_tasks_total", len(flagged), status="flagged")
+    metrics.inc("triage_tasks_total", len(resolved), status="skipped")
+    if total:
+        print(f"本地预筛：共 {total} 条标注，{len(flagged)} 条发送给大模型，跳过 {len(resolved)} 条（跳过率 {len(resolved) / total:.1%}）。")
+    return flagged, resolved